@@ -155,8 +155,91 @@ TELEGRAM_API_HASH = os.getenv("TELEGRAM_API_HASH")
 TELEGRAM_SESSIONS = os.getenv("TELEGRAM_SESSIONS")
 TELEGRAM_CHANNELS = os.getenv("TELEGRAM_CHANNELS", "").split(",")
 SCHEDULE_INTERVAL = os.getenv("SCHEDULE_INTERVAL", 20)
+# Seconds a scraper worker holds its lease without renewing it, see run_scraper
+SCRAPER_LEASE_SECONDS = int(os.getenv("SCRAPER_LEASE_SECONDS", 300))
+# Each channel is polled when about SCRAPER_MESSAGES_PER_POLL new messages are
+# expected from its posting rate, between SCRAPER_MIN_POLL_SECONDS and
+# SCRAPER_MAX_POLL_SECONDS apart, reading pages of SCRAPER_MIN_FETCH_LIMIT to
+# SCRAPER_MAX_FETCH_LIMIT messages (telegram returns at most 100)
+SCRAPER_MESSAGES_PER_POLL = int(os.getenv("SCRAPER_MESSAGES_PER_POLL", 5))
+SCRAPER_MIN_POLL_SECONDS = int(os.getenv("SCRAPER_MIN_POLL_SECONDS", 120))
+SCRAPER_MAX_POLL_SECONDS = int(os.getenv("SCRAPER_MAX_POLL_SECONDS", 6 * 3600))
+SCRAPER_MIN_FETCH_LIMIT = int(os.getenv("SCRAPER_MIN_FETCH_LIMIT", 10))
+SCRAPER_MAX_FETCH_LIMIT = int(os.getenv("SCRAPER_MAX_FETCH_LIMIT", 100))
+# In streaming mode (run_scraper --stream), seconds between scans of the
+# channel histories for messages the stream missed
+SCRAPER_RECONCILE_SECONDS = int(os.getenv("SCRAPER_RECONCILE_SECONDS", 3600))
+
+# Scraper pipeline concurrency (per stage)
+SCRAPER_CHANNEL_CONCURRENCY = int(os.getenv("SCRAPER_CHANNEL_CONCURRENCY", 4))
+SCRAPER_PARSE_WORKERS = int(os.getenv("SCRAPER_PARSE_WORKERS", 8))
+SCRAPER_DB_WORKERS = int(os.getenv("SCRAPER_DB_WORKERS", 2))
+SCRAPER_IMAGE_WORKERS = int(os.getenv("SCRAPER_IMAGE_WORKERS", 4))
+SCRAPER_QUEUE_SIZE = int(os.getenv("SCRAPER_QUEUE_SIZE", 100))
+# Posts saved per database transaction
+SCRAPER_WRITE_BATCH_SIZE = int(os.getenv("SCRAPER_WRITE_BATCH_SIZE", 100))
+# Photo downloads and uploads in flight across all posts, and the size up to
+# which a downloaded photo is kept in memory rather than a temporary file
+SCRAPER_MEDIA_CONCURRENCY = int(os.getenv("SCRAPER_MEDIA_CONCURRENCY", 8))
+SCRAPER_MEDIA_SPOOL_BYTES = int(os.getenv("SCRAPER_MEDIA_SPOOL_BYTES", 1024 * 1024))
+# Scraped messages are recorded as jobs, failures are retried after
+# INGEST_RETRY_SECONDS, doubling every time, up to INGEST_MAX_ATTEMPTS tries.
+# Jobs claimed longer than INGEST_LOCK_SECONDS ago are handed to another worker.
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", 6))
+INGEST_RETRY_SECONDS = int(os.getenv("INGEST_RETRY_SECONDS", 60))
+INGEST_LOCK_SECONDS = int(os.getenv("INGEST_LOCK_SECONDS", 900))
+# Captions sent to Gemini per request, 1 disables batching
+SCRAPER_LLM_BATCH_SIZE = int(os.getenv("SCRAPER_LLM_BATCH_SIZE", 10))
 
 GEMENI_API_KEY = os.getenv("GEMENI_API_KEY", "").split(",")
+# Per key quota, shared by every caller in the process
+GEMENI_REQUESTS_PER_MINUTE = int(os.getenv("GEMENI_REQUESTS_PER_MINUTE", 15))
+
+# Parsed caption cache
+CAPTION_CACHE_MAX_ENTRIES = int(os.getenv("CAPTION_CACHE_MAX_ENTRIES", 50000))
+CAPTION_CACHE_TTL_DAYS = int(os.getenv("CAPTION_CACHE_TTL_DAYS", 30))
+# Captions the rule-based parser scores at least this high skip Gemini
+SPEC_PARSER_MIN_CONFIDENCE = float(os.getenv("SPEC_PARSER_MIN_CONFIDENCE", 0.8))
+
+# "ann" serves similar laptops from the vector index, "table" from SimilarNeighbour
+SIMILARITY_BACKEND = os.getenv("SIMILARITY_BACKEND", "ann")
+# Written by the scraper worker, web processes must see the same folder.
+# Those that do not serve similar laptops from SimilarNeighbour instead, and
+# log an error.
+SIMILARITY_INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", BASE_DIR / "similarity_index")
+
+# "auto" uses the database's full-text index (PostgreSQL or SQLite FTS5),
+# "icontains" the unindexed substring search
+LAPTOP_SEARCH_BACKEND = os.getenv("LAPTOP_SEARCH_BACKEND", "auto")
+
+# In-memory autocomplete index: size cap, and how often each process picks
+# up posts written elsewhere and rebuilds from scratch
+AUTOCOMPLETE_MAX_SUGGESTIONS = int(os.getenv("AUTOCOMPLETE_MAX_SUGGESTIONS", 50000))
+AUTOCOMPLETE_REFRESH_SECONDS = int(os.getenv("AUTOCOMPLETE_REFRESH_SECONDS", 60))
+AUTOCOMPLETE_REBUILD_SECONDS = int(os.getenv("AUTOCOMPLETE_REBUILD_SECONDS", 3600))
+
+# How long facet counts of a search are cached
+FACETS_CACHE_SECONDS = int(os.getenv("FACETS_CACHE_SECONDS", 300))
+
+# How long public API responses are cached, 0 disables the response cache.
+# Entries are dropped as soon as the data changes anyway.
+RESPONSE_CACHE_SECONDS = int(os.getenv("RESPONSE_CACHE_SECONDS", 600))
+
+# The cache must be shared by the web processes and the scraper worker, which
+# may run on another host, so that invalidations made by the scraper reach
+# the web workers. The database backend is shared wherever the database is
+# (its table is made by ``manage.py createcachetable``). The file backend,
+# e.g. CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache with
+# CACHE_LOCATION set to a folder, only works when they all run on one host.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", "laptops_cache"),
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", 10000))},
+    }
+}
 
 
 MIDDLEWARE = [
@@ -164,6 +247,7 @@ MIDDLEWARE = [
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
+    "django.middleware.http.ConditionalGetMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
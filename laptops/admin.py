@@ -1,5 +1,13 @@
 from django.contrib import admin
-from laptops.models import TelegramChat, LaptopPost, SimilarityScore
+from laptops.models import (
+    TelegramChat,
+    LaptopPost,
+    SimilarNeighbour,
+    IngestJob,
+    ChannelFetchState,
+)
 
 # Register your models here.
-admin.site.register([TelegramChat, LaptopPost, SimilarityScore])
+admin.site.register(
+    [TelegramChat, LaptopPost, SimilarNeighbour, IngestJob, ChannelFetchState]
+)
@@ -6,6 +6,4 @@ class LaptopsConfig(AppConfig):
     name = "laptops"
 
     def ready(self):
-        from laptops.tasks import start_scheduler
-
-        start_scheduler()
+        from laptops import signals  # noqa: F401
@@ -0,0 +1,362 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.utils import timezone
+from rapidfuzz.distance import Levenshtein
+
+logger = logging.getLogger("laptops")
+
+FIELDS = ("title", "processor", "graphics", "ram")
+
+# Suggestions longer than this are truncated, titles can be whole sentences
+MAX_TERM_LENGTH = 80
+# Prefix matches looked at per query before ranking, bounds short prefixes
+MAX_SCAN = 1000
+# Spelling corrections tried per misspelled query word
+MAX_CORRECTIONS = 3
+
+
+def normalize_term(value):
+    return " ".join((value or "").lower().split())[:MAX_TERM_LENGTH]
+
+
+def max_typos(word):
+    """Edits tolerated between a query word and an indexed word."""
+    if len(word) < 3:
+        return 0
+    return 1 if len(word) < 7 else 2
+
+
+def prefix_distance(word, candidate, typos):
+    """Edit distance between ``word`` and the closest prefix of ``candidate``."""
+    return min(
+        Levenshtein.distance(word, candidate[:length], score_cutoff=typos)
+        for length in range(len(word) - typos, len(word) + typos + 1)
+    )
+
+
+class AutocompleteIndex:
+    """
+    In-memory prefix index over spec values.
+
+    Every distinct value of a field is a suggestion, e.g. "core i7 1165g7".
+    It is reachable from the start of each of its words ("i7 1165g7",
+    "1165g7") through a sorted list of keys, so a prefix lookup is a binary
+    search. Misspelled query words are corrected against the vocabulary of
+    indexed words before the lookup. At most ``max_suggestions`` are kept,
+    the ones used by the fewest posts are evicted first.
+    """
+
+    def __init__(self, max_suggestions=50000):
+        self.max_suggestions = max_suggestions
+        # (field, term) -> [display value, number of posts using it]
+        self.suggestions = {}
+        # Sorted (key, field, term) tuples
+        self.keys = []
+        # Word -> number of suggestions containing it, and the sorted words
+        self.words = {}
+        self.vocabulary = []
+        # Post id -> suggestions it contributed, to undo them on update
+        self.documents = {}
+
+    def __len__(self):
+        return len(self.suggestions)
+
+    @staticmethod
+    def suggestion_keys(term):
+        words = term.split(" ")
+        return [" ".join(words[i:]) for i in range(len(words))]
+
+    def add(self, post_id, values, sort=True):
+        """
+        Index a post, replacing what it contributed before.
+
+        :param values: Mapping of field name to the post's value.
+        :param sort: Keep the keys sorted. Bulk loads pass False and call
+            ``sort()`` once at the end, which also evicts.
+        """
+        self.remove(post_id)
+        contributed = []
+        for field in FIELDS:
+            term = normalize_term(values.get(field))
+            if not term:
+                continue
+            suggestion = (field, term)
+            entry = self.suggestions.get(suggestion)
+            if entry is None:
+                self.suggestions[suggestion] = [
+                    " ".join(values[field].split())[:MAX_TERM_LENGTH],
+                    1,
+                ]
+                self.add_keys(field, term, sort)
+            else:
+                entry[1] += 1
+            contributed.append(suggestion)
+        self.documents[post_id] = tuple(contributed)
+
+        # Eviction looks keys up by binary search, so it waits for sort()
+        if sort and len(self.suggestions) > self.max_suggestions:
+            self.evict()
+
+    def add_keys(self, field, term, sort):
+        for key in self.suggestion_keys(term):
+            if sort:
+                insort(self.keys, (key, field, term))
+            else:
+                self.keys.append((key, field, term))
+        for word in set(term.split(" ")):
+            if word not in self.words:
+                self.words[word] = 0
+                if sort:
+                    insort(self.vocabulary, word)
+                else:
+                    self.vocabulary.append(word)
+            self.words[word] += 1
+
+    def sort(self):
+        self.keys.sort()
+        self.vocabulary.sort()
+        if len(self.suggestions) > self.max_suggestions:
+            self.evict()
+
+    def remove(self, post_id):
+        for suggestion in self.documents.pop(post_id, ()):
+            entry = self.suggestions[suggestion]
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.suggestions[suggestion]
+                self.remove_keys(*suggestion)
+
+    def remove_keys(self, field, term):
+        for key in self.suggestion_keys(term):
+            position = bisect_left(self.keys, (key, field, term))
+            if position < len(self.keys) and self.keys[position] == (key, field, term):
+                del self.keys[position]
+        for word in set(term.split(" ")):
+            self.words[word] -= 1
+            if not self.words[word]:
+                del self.words[word]
+                position = bisect_left(self.vocabulary, word)
+                if position < len(self.vocabulary) and self.vocabulary[position] == word:
+                    del self.vocabulary[position]
+
+    def evict(self):
+        """
+        Drop the least used tenth of the suggestions, so eviction runs
+        rarely rather than on every insert.
+        """
+        excess = len(self.suggestions) - int(self.max_suggestions * 0.9)
+        if excess <= 0:
+            return
+        evicted = set(
+            heapq.nsmallest(
+                excess, self.suggestions, key=lambda s: self.suggestions[s][1]
+            )
+        )
+        for suggestion in evicted:
+            del self.suggestions[suggestion]
+            self.remove_keys(*suggestion)
+        # Posts stop accounting for evicted suggestions, so one indexed again
+        # later is not decremented by the posts that used it before
+        for post_id, contributed in self.documents.items():
+            if not evicted.isdisjoint(contributed):
+                self.documents[post_id] = tuple(
+                    suggestion
+                    for suggestion in contributed
+                    if suggestion not in evicted
+                )
+
+    def prefix_matches(self, prefix, field=None):
+        start = bisect_left(self.keys, (prefix,))
+        end = bisect_left(self.keys, (prefix + "\uffff",), lo=start)
+        matches = self.keys[start : min(end, start + MAX_SCAN)]
+        if field is None:
+            return [(key_field, term) for _, key_field, term in matches]
+        return [
+            (key_field, term) for _, key_field, term in matches if key_field == field
+        ]
+
+    def has_prefix(self, prefix):
+        position = bisect_left(self.vocabulary, prefix)
+        return position < len(self.vocabulary) and self.vocabulary[position].startswith(
+            prefix
+        )
+
+    def corrections(self, word, last):
+        """
+        ``(word, edits)`` candidates for a query word, the word itself when
+        it is known. The last word is still being typed, so it only needs
+        to be close to the start of an indexed word.
+
+        Only words sharing the first character are compared: a typo there is
+        rare, and it keeps the scan to a small slice of the vocabulary.
+        """
+        if (self.has_prefix(word) if last else word in self.words) or not max_typos(
+            word
+        ):
+            return [(word, 0)]
+
+        typos = max_typos(word)
+        candidates = []
+        start = bisect_left(self.vocabulary, word[0])
+        for candidate in itertools.islice(self.vocabulary, start, None):
+            if candidate[0] != word[0]:
+                break
+            edits = (
+                prefix_distance(word, candidate, typos)
+                if last
+                else Levenshtein.distance(word, candidate, score_cutoff=typos)
+            )
+            if edits <= typos:
+                candidates.append((edits, -self.words[candidate], candidate))
+        return [
+            (candidate, edits)
+            for edits, _, candidate in heapq.nsmallest(MAX_CORRECTIONS, candidates)
+        ]
+
+    def complete(self, query, field=None, limit=10):
+        """
+        :return: Up to ``limit`` ``(field, value, count)`` suggestions, the
+            ones needing the fewest corrections first, then by the number of
+            posts using them.
+        """
+        query = normalize_term(query)
+        if not query:
+            return []
+
+        ranked = {suggestion: 0 for suggestion in self.prefix_matches(query, field)}
+        if len(ranked) < limit:
+            words = query.split(" ")
+            options = [
+                self.corrections(word, i == len(words) - 1)
+                for i, word in enumerate(words)
+            ]
+            for corrected in itertools.product(*options):
+                edits = sum(edits for _, edits in corrected)
+                if not edits:
+                    continue
+                prefix = " ".join(word for word, _ in corrected)
+                for suggestion in self.prefix_matches(prefix, field):
+                    ranked.setdefault(suggestion, edits)
+
+        best = heapq.nsmallest(
+            limit,
+            (
+                (edits, -self.suggestions[suggestion][1], suggestion)
+                for suggestion, edits in ranked.items()
+            ),
+        )
+        return [
+            (suggestion[0], *self.suggestions[suggestion]) for _, _, suggestion in best
+        ]
+
+
+class LiveAutocompleteIndex:
+    """
+    The process-wide ``AutocompleteIndex``, kept in sync with ``LaptopPost``.
+
+    Saves in this process are applied right away by signal handlers. Writes
+    from other processes (the scraper) are picked up by re-indexing posts
+    updated since the last refresh, at most every ``refresh_interval``
+    seconds, and the index is rebuilt from scratch every ``rebuild_interval``
+    seconds to drop deleted posts. Requests keep using the previous index
+    while a rebuild runs.
+    """
+
+    def __init__(self, max_suggestions, refresh_interval, rebuild_interval):
+        self.max_suggestions = max_suggestions
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.index = None
+        self.lock = threading.Lock()
+        self.rebuild_lock = threading.Lock()
+        self.refreshed_at = self.built_at = 0.0
+        self.watermark = None
+
+    def posts(self):
+        from .models import LaptopPost
+
+        return LaptopPost.objects.order_by().values_list("id", *FIELDS)
+
+    def rebuild(self):
+        watermark = timezone.now()
+        index = AutocompleteIndex(self.max_suggestions)
+        for post_id, *values in self.posts().iterator(chunk_size=2000):
+            index.add(post_id, dict(zip(FIELDS, values)), sort=False)
+        index.sort()
+
+        with self.lock:
+            self.index = index
+            self.watermark = watermark
+            self.built_at = self.refreshed_at = time.monotonic()
+
+    def refresh(self):
+        watermark = timezone.now()
+        posts = list(self.posts().filter(updated_at__gte=self.watermark))
+        with self.lock:
+            for post_id, *values in posts:
+                self.index.add(post_id, dict(zip(FIELDS, values)))
+            self.watermark = watermark
+            self.refreshed_at = time.monotonic()
+
+    def get(self):
+        """
+        :return: The index, built on first use and refreshed as needed.
+        """
+        now = time.monotonic()
+        stale = self.index is None or now - self.built_at > self.rebuild_interval
+        # Only one thread rebuilds or refreshes, the others carry on with the
+        # current index unless there is none yet
+        if (stale or now - self.refreshed_at > self.refresh_interval) and (
+            self.rebuild_lock.acquire(blocking=self.index is None)
+        ):
+            try:
+                # Another thread may have finished while this one waited
+                now = time.monotonic()
+                if self.index is None or now - self.built_at > self.rebuild_interval:
+                    self.rebuild()
+                elif now - self.refreshed_at > self.refresh_interval:
+                    self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing autocomplete index: {str(e)}")
+                if self.index is None:
+                    raise
+            finally:
+                self.rebuild_lock.release()
+        return self.index
+
+    def complete(self, query, field=None, limit=10):
+        index = self.get()
+        with self.lock:
+            return index.complete(query, field, limit)
+
+    def post_saved(self, instance):
+        with self.lock:
+            if self.index is not None:
+                self.index.add(
+                    instance.id, {field: getattr(instance, field) for field in FIELDS}
+                )
+
+    def post_deleted(self, instance):
+        with self.lock:
+            if self.index is not None:
+                self.index.remove(instance.id)
+
+
+_live_index = None
+
+
+def get_autocomplete_index():
+    global _live_index
+    if _live_index is None:
+        _live_index = LiveAutocompleteIndex(
+            settings.AUTOCOMPLETE_MAX_SUGGESTIONS,
+            settings.AUTOCOMPLETE_REFRESH_SECONDS,
+            settings.AUTOCOMPLETE_REBUILD_SECONDS,
+        )
+    return _live_index
@@ -0,0 +1,127 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ParsedCaption
+
+URL_PATTERN = re.compile(r"(https?://\S+|t\.me/\S+|@\w+)")
+NON_WORD_PATTERN = re.compile(r"[^\w.$]+")
+
+
+def normalize_caption(text: str) -> str:
+    """
+    Normalize a caption so reposts of the same listing hash alike.
+
+    Links and @mentions (which differ per reseller channel), emojis,
+    punctuation, case and whitespace are ignored.
+    """
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    text = URL_PATTERN.sub(" ", text)
+    return " ".join(NON_WORD_PATTERN.sub(" ", text).split())
+
+
+def caption_key(text: str, namespace: str = "") -> str:
+    return hashlib.sha256(
+        f"{namespace}\n{normalize_caption(text)}".encode("utf-8")
+    ).hexdigest()
+
+
+class CaptionCache:
+    """
+    Persistent cache of parsed captions backed by ``ParsedCaption``.
+
+    Entries expire ``ttl`` after they were created and the table is trimmed
+    to ``max_entries`` rows, dropping the least recently used first. The
+    ``namespace`` is mixed into every key so changing the prompt starts a
+    fresh cache.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "",
+        max_entries: int | None = None,
+        ttl: timedelta | None = None,
+    ):
+        self.namespace = namespace
+        self.max_entries = (
+            settings.CAPTION_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        )
+        self.ttl = ttl or timedelta(days=settings.CAPTION_CACHE_TTL_DAYS)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, caption: str) -> str:
+        return caption_key(caption, self.namespace)
+
+    def get_many(self, captions):
+        """
+        :param captions: Mapping of any id to caption text.
+        :return: Mapping of the same ids to cached data, for hits only.
+        """
+        keys = {message_id: self.key(text) for message_id, text in captions.items()}
+        found = dict(
+            ParsedCaption.objects.filter(
+                caption_hash__in=set(keys.values()),
+                created_at__gte=timezone.now() - self.ttl,
+            ).values_list("caption_hash", "data")
+        )
+        if found:
+            ParsedCaption.objects.filter(caption_hash__in=found).update(
+                hits=F("hits") + 1, last_used_at=timezone.now()
+            )
+
+        results = {
+            message_id: found[key] for message_id, key in keys.items() if key in found
+        }
+        with self._lock:
+            self.hits += len(results)
+            self.misses += len(keys) - len(results)
+        return results
+
+    def set_many(self, captions):
+        """
+        :param captions: Mapping of caption text to verified data.
+        """
+        if not captions:
+            return
+        now = timezone.now()
+        ParsedCaption.objects.bulk_create(
+            [
+                ParsedCaption(
+                    caption_hash=self.key(text),
+                    data=data,
+                    created_at=now,
+                    last_used_at=now,
+                )
+                for text, data in captions.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["caption_hash"],
+            update_fields=["data", "created_at", "last_used_at"],
+        )
+        self.evict()
+
+    def evict(self):
+        ParsedCaption.objects.filter(created_at__lt=timezone.now() - self.ttl).delete()
+
+        if self.max_entries and ParsedCaption.objects.count() > self.max_entries:
+            cutoff = ParsedCaption.objects.order_by("-last_used_at").values_list(
+                "last_used_at", flat=True
+            )[self.max_entries]
+            ParsedCaption.objects.filter(last_used_at__lte=cutoff).delete()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,222 @@
+import hashlib
+import json
+
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+
+from .response_cache import get_generation
+from .search import search_tokens
+
+# Bucket lower bounds, each bucket runs up to the next bound
+RAM_BUCKETS = (0, 8, 16, 32)
+STORAGE_BUCKETS = (0, 256, 512, 1024, 2048)
+PRICE_BANDS = {
+    "ETB": (0, 20000, 40000, 60000, 80000, 120000),
+    "USD": (0, 200, 400, 600, 800, 1200),
+}
+
+CPU_FAMILIES = {
+    ("intel", 1): "Celeron / Pentium",
+    ("intel", 8): "Xeon",
+    ("amd", 1): "Athlon",
+    ("apple", 7): "Apple M",
+    ("apple", 9): "Apple M Pro / Max",
+}
+
+# Most frequent values returned for open-ended facets
+FACET_LIMIT = 20
+
+GROUP_COLUMNS = (
+    "cpu_vendor",
+    "cpu_tier",
+    "ram_bucket",
+    "storage_bucket",
+    "currency",
+    "price_band",
+    "status",
+    "color",
+    "channel_id",
+    "channel_name",
+)
+
+
+def bucket_case(column, bounds):
+    """SQL CASE giving the index of the bucket ``column`` falls in."""
+    return Case(
+        *[
+            When(
+                Q(**{f"{column}__gte": lower})
+                & (
+                    Q(**{f"{column}__lt": bounds[i + 1]})
+                    if i + 1 < len(bounds)
+                    else Q()
+                ),
+                then=Value(i),
+            )
+            for i, lower in enumerate(bounds)
+        ],
+        output_field=IntegerField(),
+    )
+
+
+def bucket_params(name, bounds, index):
+    """Range filter parameters selecting one bucket."""
+    params = {f"{name}_min": bounds[index]}
+    if index + 1 < len(bounds):
+        params[f"{name}_max"] = bounds[index + 1] - 1
+    return params
+
+
+def range_label(bounds, index, amount):
+    if index == 0:
+        return f"Under {amount(bounds[1])}"
+    if index + 1 == len(bounds):
+        return f"{amount(bounds[index])}+"
+    return f"{amount(bounds[index])} - {amount(bounds[index + 1])}"
+
+
+def size(gb):
+    return f"{gb // 1024}TB" if gb >= 1024 else f"{gb}GB"
+
+
+def price(currency):
+    if currency == "USD":
+        return lambda amount: f"${amount:,}"
+    return lambda amount: f"{amount // 1000}k Birr"
+
+
+def cpu_family_label(vendor, tier):
+    if (vendor, tier) in CPU_FAMILIES:
+        return CPU_FAMILIES[(vendor, tier)]
+    if vendor == "amd":
+        return f"Ryzen {tier}"
+    return f"Core i{tier}"
+
+
+def compute_facets(queryset):
+    """
+    Counts per processor family, RAM, storage, price band, status, color and
+    channel of the posts in ``queryset``, from a single GROUP BY query.
+
+    Every entry has the filter ``params`` that select it on /api/laptops/.
+    """
+    rows = (
+        queryset.order_by()
+        .annotate(
+            ram_bucket=bucket_case("ram_gb", RAM_BUCKETS),
+            storage_bucket=bucket_case("storage_gb", STORAGE_BUCKETS),
+            price_band=Case(
+                *[
+                    When(currency=currency, then=bucket_case("price_amount", bounds))
+                    for currency, bounds in PRICE_BANDS.items()
+                ],
+                output_field=IntegerField(),
+            ),
+        )
+        .values(*GROUP_COLUMNS)
+        .annotate(count=Count("id"))
+    )
+
+    total = 0
+    counts = {
+        name: {} for name in ("processor", "ram", "storage", "price", "status", "color")
+    }
+    channels = {}
+    for row in rows:
+        count = row["count"]
+        total += count
+        keys = {
+            "processor": (
+                (row["cpu_vendor"], row["cpu_tier"]) if row["cpu_vendor"] else None
+            ),
+            "ram": row["ram_bucket"],
+            "storage": row["storage_bucket"],
+            "price": (
+                (row["currency"], row["price_band"])
+                if row["price_band"] is not None
+                else None
+            ),
+            "status": row["status"] or None,
+            "color": row["color"] or None,
+        }
+        for name, key in keys.items():
+            if key is not None:
+                counts[name][key] = counts[name].get(key, 0) + count
+
+        channel = channels.setdefault(
+            row["channel_id"], {"label": row["channel_name"], "count": 0}
+        )
+        channel["count"] += count
+
+    def most_frequent(items):
+        return sorted(items, key=lambda item: -item[1])[:FACET_LIMIT]
+
+    facets = {
+        "processor": [
+            {
+                "label": cpu_family_label(vendor, tier),
+                "count": count,
+                "params": {"cpu_vendor": vendor, "cpu_tier": tier},
+            }
+            for (vendor, tier), count in most_frequent(counts["processor"].items())
+        ],
+        "ram": [
+            {
+                "label": range_label(RAM_BUCKETS, index, size),
+                "count": count,
+                "params": bucket_params("ram", RAM_BUCKETS, index),
+            }
+            for index, count in sorted(counts["ram"].items())
+        ],
+        "storage": [
+            {
+                "label": range_label(STORAGE_BUCKETS, index, size),
+                "count": count,
+                "params": bucket_params("storage", STORAGE_BUCKETS, index),
+            }
+            for index, count in sorted(counts["storage"].items())
+        ],
+        "price": [
+            {
+                "label": range_label(PRICE_BANDS[currency], index, price(currency)),
+                "count": count,
+                "params": {
+                    "currency": currency,
+                    **bucket_params("price", PRICE_BANDS[currency], index),
+                },
+            }
+            for (currency, index), count in sorted(counts["price"].items())
+        ],
+        "status": [
+            {"label": status, "count": count, "params": {"status": status}}
+            for status, count in most_frequent(counts["status"].items())
+        ],
+        "color": [
+            {"label": color, "count": count, "params": {"color": color}}
+            for color, count in most_frequent(counts["color"].items())
+        ],
+        "channel": [
+            {**channel, "params": {"channel": channel_id}}
+            for channel_id, channel in sorted(
+                channels.items(), key=lambda item: -item[1]["count"]
+            )[:FACET_LIMIT]
+        ],
+    }
+    return {"count": total, "facets": facets}
+
+
+def facets_cache_key(filters, query, types, null_price):
+    """
+    Cache key of the facets of a search, the same for every spelling of the
+    same search (parameter order, case, repeated values, word order). It
+    includes the data generation, so facets are recounted after any change.
+    """
+    normalized = {
+        "filters": filters,
+        "q": sorted(set(search_tokens(query))),
+        "type": sorted(set(types) - {""}),
+        "null_price": null_price,
+    }
+    digest = hashlib.sha256(
+        json.dumps(normalized, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    return f"laptops:facets:{get_generation()}:{digest}"
@@ -0,0 +1,149 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Min, Q
+from django.utils import timezone
+
+from .ingest import last_enqueued_message_id
+from .models import ChannelFetchState, TelegramChat
+
+# Weight of the latest poll in the posting rate, the rest is history
+RATE_SMOOTHING = 0.3
+
+
+def channel_state(channel):
+    """
+    Fetch state of ``channel``, created on its first poll from the messages
+    already recorded.
+    """
+    state = ChannelFetchState.objects.filter(channel=channel).first()
+    if state is None:
+        state, _ = ChannelFetchState.objects.get_or_create(
+            channel=channel,
+            defaults={
+                "last_message_id": last_enqueued_message_id(channel.channel_id),
+                "fetch_limit": settings.SCRAPER_MAX_FETCH_LIMIT,
+            },
+        )
+    return state
+
+
+def due_channels(now=None):
+    """
+    Active channels due for a poll, most overdue first. Channels polled for
+    the first time are due right away, channels in a flood wait are not due
+    before it is over.
+    """
+    now = now or timezone.now()
+    return list(
+        TelegramChat.objects.filter(is_active=True)
+        .filter(Q(fetch_state__isnull=True) | Q(fetch_state__next_poll_at__lte=now))
+        .order_by(F("fetch_state__next_poll_at").asc(nulls_first=True))
+    )
+
+
+def next_poll_delay(now=None):
+    """Seconds until the next active channel is due, ``None`` if none is."""
+    now = now or timezone.now()
+    next_poll_at = ChannelFetchState.objects.filter(channel__is_active=True).aggregate(
+        next=Min("next_poll_at")
+    )["next"]
+    if next_poll_at is None:
+        return None
+    return max(0.0, (next_poll_at - now).total_seconds())
+
+
+def poll_seconds(messages_per_hour):
+    """
+    Interval expected to bring ``SCRAPER_MESSAGES_PER_POLL`` new messages:
+    busy channels are polled often, dormant ones rarely.
+    """
+    if messages_per_hour <= 0:
+        return settings.SCRAPER_MAX_POLL_SECONDS
+    seconds = 3600 * settings.SCRAPER_MESSAGES_PER_POLL / messages_per_hour
+    return int(
+        min(
+            settings.SCRAPER_MAX_POLL_SECONDS,
+            max(settings.SCRAPER_MIN_POLL_SECONDS, seconds),
+        )
+    )
+
+
+def fetch_limit(messages_per_hour, seconds):
+    """Page size fitting twice the messages expected in ``seconds``."""
+    expected = messages_per_hour * seconds / 3600
+    return min(
+        settings.SCRAPER_MAX_FETCH_LIMIT,
+        max(settings.SCRAPER_MIN_FETCH_LIMIT, math.ceil(2 * expected)),
+    )
+
+
+def remember_progress(state, oldest_id, newest_id):
+    """
+    Make the next poll continue below ``oldest_id``, the oldest message
+    fetched so far, rather than from the newest message of the channel.
+    """
+    if oldest_id:
+        state.resume_offset_id = oldest_id
+        state.pending_message_id = max(state.pending_message_id, newest_id)
+
+
+def record_poll(state, new_messages, newest_id, caught_up=True, oldest_id=0, now=None):
+    """
+    Update the posting rate of a channel after a poll and schedule the next
+    one.
+
+    :param new_messages: Messages newer than ``state.last_message_id``
+        fetched by the poll.
+    :param newest_id: Newest message id fetched, if any.
+    :param caught_up: Whether the poll reached the messages seen before.
+        ``last_message_id`` only moves forward then. A poll stopped by its
+        limit is followed by a larger one right away, which resumes below
+        ``oldest_id``, the oldest message fetched.
+    """
+    now = now or timezone.now()
+    resumed = bool(state.resume_offset_id)
+    if not caught_up:
+        state.poll_seconds = settings.SCRAPER_MIN_POLL_SECONDS
+        state.fetch_limit = min(settings.SCRAPER_MAX_FETCH_LIMIT, 2 * state.fetch_limit)
+        remember_progress(state, oldest_id, newest_id)
+    else:
+        # The first poll has no interval to measure a rate over, the next
+        # one comes after the default interval. Polls closing a gap fetched
+        # a backlog, not what was posted since the previous one.
+        if state.last_polled_at is not None and not resumed:
+            hours = max((now - state.last_polled_at).total_seconds() / 3600, 1 / 60)
+            observed = new_messages / hours
+            state.messages_per_hour = (
+                RATE_SMOOTHING * observed
+                + (1 - RATE_SMOOTHING) * state.messages_per_hour
+            )
+            state.poll_seconds = poll_seconds(state.messages_per_hour)
+            state.fetch_limit = fetch_limit(state.messages_per_hour, state.poll_seconds)
+        state.last_message_id = max(
+            state.last_message_id, state.pending_message_id, newest_id
+        )
+        state.resume_offset_id = state.pending_message_id = 0
+    state.last_polled_at = now
+    state.next_poll_at = now + timedelta(seconds=state.poll_seconds)
+    state.flood_waits = 0
+    state.flood_wait_until = None
+    state.save()
+
+
+def record_flood_wait(state, seconds, oldest_id=0, newest_id=0, now=None):
+    """
+    Leave a channel alone until its flood wait is over, and poll it less
+    often while flood waits repeat. The next poll resumes below
+    ``oldest_id`` if the interrupted one fetched any message.
+    """
+    now = now or timezone.now()
+    remember_progress(state, oldest_id, newest_id)
+    state.flood_waits += 1
+    state.flood_wait_until = now + timedelta(seconds=seconds)
+    state.poll_seconds = min(settings.SCRAPER_MAX_POLL_SECONDS, 2 * state.poll_seconds)
+    state.next_poll_at = max(
+        state.flood_wait_until, now + timedelta(seconds=state.poll_seconds)
+    )
+    state.save()
@@ -0,0 +1,82 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+
+from .models import LaptopPost
+
+# Query parameter -> (column, lookup)
+RANGE_FILTERS = {
+    "price_min": ("price_amount", "gte"),
+    "price_max": ("price_amount", "lte"),
+    "ram_min": ("ram_gb", "gte"),
+    "ram_max": ("ram_gb", "lte"),
+    "storage_min": ("storage_gb", "gte"),
+    "storage_max": ("storage_gb", "lte"),
+    "cpu_tier_min": ("cpu_tier", "gte"),
+    "cpu_generation_min": ("cpu_generation", "gte"),
+    "screen_min": ("screen_inches", "gte"),
+    "screen_max": ("screen_inches", "lte"),
+    "rating_min": ("rating_average", "gte"),
+}
+
+# Query parameter -> (column, normalizer), comma separated values match any
+CHOICE_FILTERS = {
+    "currency": ("currency", str.upper),
+    "storage_type": ("storage_type", str.upper),
+    "cpu_vendor": ("cpu_vendor", str.lower),
+    "cpu_tier": ("cpu_tier", None),
+    "ram_gb": ("ram_gb", None),
+    "status": ("status", None),
+    "color": ("color", None),
+    "channel": ("channel_id", None),
+}
+
+# Prices are compared within one currency
+DEFAULT_CURRENCY = "ETB"
+
+
+def _to_python(column, value, param):
+    try:
+        return LaptopPost._meta.get_field(column).to_python(value)
+    except DjangoValidationError:
+        raise ValidationError({param: f"Invalid value {value!r}"})
+
+
+def filter_params(params):
+    """
+    The spec filters set in ``params``, as ``{param: value}`` with values
+    converted to the column type.
+    """
+    filters = {}
+    for param, (column, _) in RANGE_FILTERS.items():
+        if params.get(param, "") != "":
+            filters[param] = _to_python(column, params[param], param)
+
+    for param, (column, normalize) in CHOICE_FILTERS.items():
+        values = [value.strip() for value in params.get(param, "").split(",")]
+        values = [normalize(value) if normalize else value for value in values if value]
+        if values:
+            filters[param] = sorted(
+                {_to_python(column, value, param) for value in values}
+            )
+
+    if ("price_min" in filters or "price_max" in filters) and "currency" not in filters:
+        filters["currency"] = [DEFAULT_CURRENCY]
+    return filters
+
+
+def apply_spec_filters(queryset, params):
+    """
+    Filter posts on the normalized spec columns. Every filter is a plain
+    comparison on an indexed column.
+
+    :raises ValidationError: On values that do not fit the column type.
+    """
+    lookups = {}
+    for param, value in filter_params(params).items():
+        if param in RANGE_FILTERS:
+            column, lookup = RANGE_FILTERS[param]
+            lookups[f"{column}__{lookup}"] = value
+        else:
+            column, _ = CHOICE_FILTERS[param]
+            lookups[f"{column}__in"] = value
+    return queryset.filter(**lookups)
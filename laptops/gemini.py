@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import threading
+import time
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
+from django.conf import settings
+
+logger = logging.getLogger("laptops")
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``rate_per_minute``.
+
+    Not tied to an event loop, so one bucket can be shared by every scrape
+    cycle (each cycle runs in its own ``asyncio.run``).
+    """
+
+    def __init__(self, rate_per_minute: int, capacity: int | None = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if one is available.
+
+        :return: 0 if a token was taken, otherwise the seconds until one will be.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float):
+        """
+        Empty the bucket and refuse tokens for ``seconds`` (e.g. after a 429).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class GeminiKeyPool:
+    """
+    Process-wide pool of Gemini API keys.
+
+    Every key gets its own token bucket and its own cached async client, so
+    requests go to whichever key still has budget and clients are built once
+    instead of per caption.
+    """
+
+    def __init__(
+        self,
+        api_keys,
+        requests_per_minute: int,
+        model_name: str = "gemini-1.5-flash",
+    ):
+        self.api_keys = [key.strip() for key in api_keys if key and key.strip()]
+        self.model_name = model_name
+        self.buckets = {key: TokenBucket(requests_per_minute) for key in self.api_keys}
+        self._clients = {}
+        self._loop = None
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> str:
+        """
+        Wait until some key has budget and return it, preferring the key
+        with the most tokens left so load spreads across keys.
+        """
+        if not self.api_keys:
+            raise RuntimeError("No Gemini API key configured")
+
+        while True:
+            waits = []
+            keys = sorted(
+                self.api_keys, key=lambda key: self.buckets[key].tokens, reverse=True
+            )
+            for key in keys:
+                wait = self.buckets[key].try_acquire()
+                if not wait:
+                    return key
+                waits.append(wait)
+            await asyncio.sleep(min(waits))
+
+    def get_client(self, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        """
+        Return the cached client for ``api_key``.
+
+        Async gRPC clients are bound to the event loop that created them, so
+        the cache is reset whenever it is used from a new loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop is not self._loop:
+                self._clients = {}
+                self._loop = loop
+
+            client = self._clients.get(api_key)
+            if client is None:
+                # The key goes to the client itself, genai.configure() would
+                # set a single key for the whole process
+                client = glm.GenerativeServiceAsyncClient(
+                    client_options={"api_key": api_key}
+                )
+                self._clients[api_key] = client
+            return client
+
+    def build_request(self, contents: str, system_instruction: str):
+        return glm.GenerateContentRequest(
+            model=f"models/{self.model_name}",
+            system_instruction=glm.Content(parts=[glm.Part(text=system_instruction)]),
+            contents=[glm.Content(role="user", parts=[glm.Part(text=contents)])],
+        )
+
+    def penalize(self, api_key: str, seconds: float = 60):
+        logger.warning(f"Gemini key throttled, pausing it for {seconds} seconds")
+        self.buckets[api_key].block(seconds)
+
+    async def generate(self, contents: str, system_instruction: str):
+        """
+        Run ``generate_content`` on the first key with budget.
+
+        :return: A ``genai.types.GenerateContentResponse``, e.g. for its
+            ``text``.
+        """
+        api_key = await self.acquire()
+        client = self.get_client(api_key)
+        try:
+            response = await client.generate_content(
+                self.build_request(contents, system_instruction)
+            )
+        except ResourceExhausted:
+            self.penalize(api_key)
+            raise
+        return genai.types.GenerateContentResponse.from_response(response)
+
+
+_key_pool = None
+_key_pool_lock = threading.Lock()
+
+
+def get_key_pool() -> GeminiKeyPool:
+    global _key_pool
+    with _key_pool_lock:
+        if _key_pool is None:
+            _key_pool = GeminiKeyPool(
+                settings.GEMENI_API_KEY,
+                requests_per_minute=settings.GEMENI_REQUESTS_PER_MINUTE,
+            )
+        return _key_pool
@@ -0,0 +1,152 @@
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .models import IngestJob, LaptopPost, RawMessage
+
+# Errors are kept for inspection, tracebacks can be long
+MAX_ERROR_LENGTH = 2000
+
+
+def record_messages(channel, raw_messages, messages):
+    """
+    Archive a fetched page of messages and enqueue the captioned ones, in
+    one transaction.
+    """
+    with transaction.atomic():
+        archive_messages(channel, raw_messages)
+        enqueue_messages(messages)
+
+
+def archive_messages(channel, raw_messages):
+    """
+    Append messages to the ``RawMessage`` archive, skipping those already
+    archived.
+
+    :param raw_messages: Dicts from ``pipeline.raw_message_data``.
+    """
+    RawMessage.objects.bulk_create(
+        [
+            RawMessage(
+                channel=channel,
+                message_id=raw["id"],
+                posted_at=datetime.fromisoformat(raw["date"]),
+                compressed=RawMessage.compress(raw),
+            )
+            for raw in raw_messages
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def enqueue_messages(messages):
+    """
+    Record scraped messages as pending jobs. Messages already recorded are
+    left as they are, so fetching the same history twice is harmless.
+
+    :param messages: ``ScrapedMessage`` objects.
+    """
+    IngestJob.objects.bulk_create(
+        [
+            IngestJob(
+                channel=message.channel,
+                message_id=message.message_id,
+                chat_id=message.chat_id,
+                channel_name=message.channel_name,
+                caption=message.caption,
+                media_group_id=message.media_group_id,
+                posted_at=message.posted_at,
+            )
+            for message in messages
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def last_enqueued_message_id(channel_id):
+    """Newest message of the channel recorded as a job or a post, or 0."""
+    job = IngestJob.objects.filter(channel_id=channel_id).aggregate(
+        last=Max("message_id")
+    )["last"]
+    post = LaptopPost.objects.filter(channel_id=channel_id).aggregate(
+        last=Max("post_id")
+    )["last"]
+    return max(job or 0, post or 0)
+
+
+def claim_jobs(limit):
+    """
+    Claim up to ``limit`` due jobs for this worker: pending jobs whose
+    backoff is over, and running jobs whose worker has not finished them
+    within ``INGEST_LOCK_SECONDS`` (it most likely died).
+
+    On PostgreSQL the candidates are locked with ``FOR UPDATE SKIP LOCKED``
+    so concurrent workers claim different jobs without waiting. SQLite has
+    no row locks, but it serializes writes, and the claiming UPDATE repeats
+    the due condition, so a job taken by another worker meanwhile is not
+    claimed twice.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = Q(state=IngestJob.State.PENDING, available_at__lte=now) | Q(
+        state=IngestJob.State.RUNNING,
+        locked_at__lt=now - timedelta(seconds=settings.INGEST_LOCK_SECONDS),
+    )
+    with transaction.atomic():
+        candidates = IngestJob.objects.filter(due).order_by("available_at", "id")
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list("id", flat=True)[:limit])
+        IngestJob.objects.filter(due, id__in=ids).update(
+            state=IngestJob.State.RUNNING,
+            locked_by=token,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+        )
+    return list(
+        IngestJob.objects.filter(locked_by=token)
+        .select_related("channel")
+        .order_by("id")
+    )
+
+
+def complete_jobs(job_ids):
+    IngestJob.objects.filter(id__in=[i for i in job_ids if i is not None]).update(
+        state=IngestJob.State.DONE, locked_by=None, last_error=None
+    )
+
+
+def retry_delay(attempts):
+    """Seconds before the next attempt, doubling after every failure."""
+    return settings.INGEST_RETRY_SECONDS * 2 ** max(0, attempts - 1)
+
+
+def fail_jobs(errors):
+    """
+    Schedule failed jobs for another attempt, or give up on those that
+    reached ``INGEST_MAX_ATTEMPTS``.
+
+    :param errors: Mapping of job id to error message.
+    """
+    errors = {job_id: error for job_id, error in errors.items() if job_id is not None}
+    if not errors:
+        return
+    now = timezone.now()
+    jobs = list(
+        IngestJob.objects.filter(id__in=errors).only("id", "attempts", "available_at")
+    )
+    for job in jobs:
+        job.last_error = str(errors[job.id])[:MAX_ERROR_LENGTH]
+        job.locked_by = None
+        if job.attempts >= settings.INGEST_MAX_ATTEMPTS:
+            job.state = IngestJob.State.FAILED
+        else:
+            job.state = IngestJob.State.PENDING
+            job.available_at = now + timedelta(seconds=retry_delay(job.attempts))
+    IngestJob.objects.bulk_update(
+        jobs, ["state", "available_at", "locked_by", "last_error"]
+    )
@@ -0,0 +1,122 @@
+import json
+import re
+
+from django.core.files.storage import default_storage
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Stands for the scheme and host of the request in stored URLs, which are
+# rendered without one
+ORIGIN = "__origin__"
+# Stands for the URL of a stored image, followed by its name. Storage URLs
+# are built when a card is served, as signed S3 URLs expire.
+IMAGE = "__image__"
+IMAGE_PATTERN = re.compile(rf'"{IMAGE}((?:[^"\\]|\\.)*)"')
+
+
+def absolute(url):
+    return f"{ORIGIN}{url}" if url and url.startswith("/") else url
+
+
+def image_urls(cards, origin):
+    """
+    ``cards`` with the names of their images replaced by the storage URLs,
+    prefixed with ``origin`` when the storage serves relative ones.
+    """
+    urls = {}
+
+    def url(match):
+        name = json.loads(f'"{match.group(1)}"')
+        if name not in urls:
+            image_url = default_storage.url(name)
+            if image_url.startswith("/"):
+                image_url = f"{origin}{image_url}"
+            urls[name] = json.dumps(image_url, ensure_ascii=False)
+        return urls[name]
+
+    return IMAGE_PATTERN.sub(url, cards)
+
+
+def render_card(post):
+    """
+    JSON text of ``post`` as listed by the API.
+
+    :param post: A post from ``LaptopPost.objects.for_listing()``.
+    """
+    from .serializers import LaptopPostSerializer
+
+    data = LaptopPostSerializer(post, context={"is_single_retrieval": False}).data
+    data["channel"] = absolute(data["channel"])
+    names = [f"{IMAGE}{image.image.name}" for image in post.images.all()]
+    for image, name in zip(data["images"], names):
+        image["image"] = name
+    data["first_image"] = names[0] if names else None
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":"))
+
+
+def refresh_listing_cards(post_ids):
+    """
+    Re-render the cards of the given posts from their current fields,
+    images and reviews.
+    """
+    from .models import LaptopPost
+
+    posts = list(LaptopPost.objects.filter(id__in=post_ids).for_listing())
+    for post in posts:
+        post.listing_card = render_card(post)
+    # bulk_update sends no signals, so this does not trigger another refresh
+    LaptopPost.objects.bulk_update(posts, ["listing_card"])
+    return posts
+
+
+def listing_cards(posts):
+    """
+    Cards of ``posts``, rendering the missing ones, e.g. of posts written
+    before cards existed.
+    """
+    missing = [post.id for post in posts if post.listing_card is None]
+    if missing:
+        rendered = {
+            post.id: post.listing_card for post in refresh_listing_cards(missing)
+        }
+        for post in posts:
+            if post.listing_card is None:
+                post.listing_card = rendered.get(post.id)
+    return [post.listing_card for post in posts if post.listing_card is not None]
+
+
+class ListingCardMixin:
+    """
+    List posts from their stored cards: the page query reads the ordering
+    columns and the card of each post, and the response body is the cards
+    joined together, without serializing any post.
+
+    Views define ``get_listing_queryset()``. Other renderers than JSON, e.g.
+    the browsable API, go through the serializer as usual.
+    """
+
+    listing_columns = ("id", "posted_at", "listing_card")
+
+    def list(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.get_listing_queryset().only(*self.listing_columns)
+        page = self.paginate_queryset(queryset)
+        envelope = self.get_paginated_response([]).data
+        envelope.pop("results")
+
+        origin = request.build_absolute_uri("/")[:-1]
+        results = image_urls(
+            ",".join(listing_cards(page)).replace(f'"{ORIGIN}/', f'"{origin}/'),
+            origin,
+        )
+        members = [
+            f"{json.dumps(key)}:{json.dumps(value, cls=JSONEncoder)}"
+            for key, value in envelope.items()
+        ]
+        members.append(f'"results":[{results}]')
+        return HttpResponse(
+            "{" + ",".join(members) + "}", content_type="application/json"
+        )
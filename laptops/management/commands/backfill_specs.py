@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from laptops.listing_cards import refresh_listing_cards
+from laptops.models import LaptopPost
+from laptops.response_cache import bump_generation
+from laptops.spec_parser import structured_specs
+
+SPEC_COLUMNS = list(structured_specs({}))
+
+
+class Command(BaseCommand):
+    help = "Fill the normalized spec columns of posts from their text fields"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recompute every post, not only those with no normalized specs",
+        )
+
+    def handle(self, *args, **options):
+        queryset = LaptopPost.objects.order_by("id")
+        if not options["all"]:
+            queryset = queryset.filter(
+                **{f"{column}__isnull": True for column in SPEC_COLUMNS}
+            )
+
+        updated = 0
+        last_id = 0
+        while True:
+            # Page by primary key rather than OFFSET: chunks stay fast, and
+            # updated rows leaving the filter do not shift the next page
+            posts = list(
+                queryset.filter(id__gt=last_id).only(
+                    "id", "price", "storage", "processor", "ram", "display"
+                )[: options["chunk_size"]]
+            )
+            if not posts:
+                break
+            last_id = posts[-1].id
+
+            for post in posts:
+                for column, value in structured_specs(post.__dict__).items():
+                    setattr(post, column, value)
+            with transaction.atomic():
+                LaptopPost.objects.bulk_update(posts, SPEC_COLUMNS)
+                # Cards list the normalized specs, bulk_update sends no signal
+                refresh_listing_cards([post.id for post in posts])
+            updated += len(posts)
+            self.stdout.write(f"{updated} posts updated")
+
+        bump_generation()
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully backfilled specs of {updated} posts.")
+        )
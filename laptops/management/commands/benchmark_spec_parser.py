@@ -0,0 +1,110 @@
+import asyncio
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from laptops.spec_parser import PARSERS, canonical, parse_caption
+from laptops.tasks import process_product
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the rule-based spec parser with the LLM on a captured corpus. "
+        'The corpus is a JSONL file with one {"caption": ..., "expected": {...}} '
+        "object per line, where `expected` is the LLM output for that caption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("corpus", help="Path to the JSONL corpus")
+        parser.add_argument(
+            "--live",
+            action="store_true",
+            help="Call the LLM for every caption instead of using `expected`, "
+            "and time it",
+        )
+        parser.add_argument(
+            "--min-confidence",
+            type=float,
+            default=settings.SPEC_PARSER_MIN_CONFIDENCE,
+            help="Confidence above which a caption would skip the LLM",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["corpus"], encoding="utf-8") as corpus:
+                samples = [json.loads(line) for line in corpus if line.strip()]
+        except (OSError, json.JSONDecodeError) as e:
+            raise CommandError(f"Could not read corpus: {e}")
+
+        if not samples:
+            raise CommandError("Corpus is empty")
+
+        captions = [sample["caption"] for sample in samples]
+
+        start = time.perf_counter()
+        parsed = [parse_caption(caption) for caption in captions]
+        rules_seconds = time.perf_counter() - start
+
+        llm_seconds = None
+        if options["live"]:
+            start = time.perf_counter()
+            expected = asyncio.run(self.run_llm(captions))
+            llm_seconds = time.perf_counter() - start
+        else:
+            expected = [sample.get("expected") or {} for sample in samples]
+
+        fields = list(PARSERS)
+        agree = dict.fromkeys(fields, 0)
+        compared = dict.fromkeys(fields, 0)
+        confident = confident_correct = 0
+
+        for (confidence, data), reference in zip(parsed, expected):
+            all_match = True
+            for field in fields:
+                if not reference.get(field):
+                    continue
+                compared[field] += 1
+                if canonical(field, data.get(field)) == canonical(
+                    field, reference[field]
+                ):
+                    agree[field] += 1
+                else:
+                    all_match = False
+
+            if confidence >= options["min_confidence"]:
+                confident += 1
+                confident_correct += all_match
+
+        total = len(samples)
+        self.stdout.write(f"Captions: {total}")
+        self.stdout.write(
+            f"Rules: {rules_seconds * 1e6 / total:.1f} us/caption "
+            f"({rules_seconds:.3f}s total)"
+        )
+        if llm_seconds is not None:
+            self.stdout.write(
+                f"LLM:   {llm_seconds * 1e3 / total:.1f} ms/caption "
+                f"({llm_seconds:.3f}s total)"
+            )
+
+        self.stdout.write("Field agreement with the LLM:")
+        for field in fields:
+            if compared[field]:
+                self.stdout.write(
+                    f"  {field:<10} {agree[field] / compared[field]:6.1%} "
+                    f"({agree[field]}/{compared[field]})"
+                )
+
+        self.stdout.write(
+            f"Above {options['min_confidence']} confidence: {confident}/{total} "
+            f"({confident / total:.1%}), fully matching: {confident_correct}"
+        )
+        self.stdout.write(self.style.SUCCESS("Benchmark complete."))
+
+    async def run_llm(self, captions):
+        results = []
+        for caption in captions:
+            status, data = await process_product(caption)
+            results.append(data if status else {})
+        return results
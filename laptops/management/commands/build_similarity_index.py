@@ -0,0 +1,22 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from laptops.models import LaptopPost
+from laptops.vector_index import build_index, record_build
+
+
+class Command(BaseCommand):
+    help = "Build the feature-vector index used to serve similar laptops"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        index = build_index(LaptopPost.objects.all())
+        record_build(index.save(settings.SIMILARITY_INDEX_DIR))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully built similarity index ({len(index)} posts, "
+                f"{time.perf_counter() - start:.1f}s)."
+            )
+        )
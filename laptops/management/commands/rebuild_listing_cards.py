@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from laptops.listing_cards import refresh_listing_cards
+from laptops.models import LaptopPost
+from laptops.response_cache import bump_generation
+
+
+class Command(BaseCommand):
+    help = "Render the stored listing cards of posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Re-render every card, not only the missing ones",
+        )
+
+    def handle(self, *args, **options):
+        queryset = LaptopPost.objects.order_by("id")
+        if not options["all"]:
+            queryset = queryset.filter(listing_card__isnull=True)
+
+        rendered = 0
+        last_id = 0
+        while True:
+            post_ids = list(
+                queryset.filter(id__gt=last_id).values_list("id", flat=True)[
+                    : options["chunk_size"]
+                ]
+            )
+            if not post_ids:
+                break
+            last_id = post_ids[-1]
+
+            with transaction.atomic():
+                refresh_listing_cards(post_ids)
+            rendered += len(post_ids)
+            self.stdout.write(f"{rendered} cards rendered")
+
+        bump_generation()
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully rendered {rendered} listing cards.")
+        )
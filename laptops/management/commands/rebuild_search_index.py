@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from laptops.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreate the full-text search index and its triggers, and reindex "
+        "every post"
+    )
+
+    def handle(self, *args, **options):
+        install_search_index(connection)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully rebuilt the {connection.vendor} search index."
+            )
+        )
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from laptops.listing_cards import refresh_listing_cards
+from laptops.models import LaptopPost
+from laptops.response_cache import bump_generation
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored rating aggregates of posts from their reviews"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        repaired = 0
+        checked = 0
+        last_id = 0
+        while True:
+            post_ids = list(
+                LaptopPost.objects.order_by("id")
+                .filter(id__gt=last_id)
+                .values_list("id", flat=True)[: options["chunk_size"]]
+            )
+            if not post_ids:
+                break
+            last_id = post_ids[-1]
+            checked += len(post_ids)
+
+            with transaction.atomic():
+                # Lock the chunk so reviews written meanwhile are not lost
+                posts = list(
+                    LaptopPost.objects.select_for_update()
+                    .filter(id__in=post_ids)
+                    .with_actual_ratings()
+                    .filter(
+                        ~Q(rating_count=F("actual_rating_count"))
+                        | ~Q(rating_sum=F("actual_rating_sum"))
+                    )
+                    .only("id", "rating_count", "rating_sum")
+                )
+                for post in posts:
+                    post.rating_count = post.actual_rating_count
+                    post.rating_sum = post.actual_rating_sum
+                    post.rating_average = (
+                        post.rating_sum / post.rating_count if post.rating_count else 0
+                    )
+                LaptopPost.objects.bulk_update(
+                    posts, ["rating_count", "rating_sum", "rating_average"]
+                )
+                refresh_listing_cards([post.id for post in posts])
+            repaired += len(posts)
+
+        if repaired:
+            bump_generation()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {checked} posts, repaired the ratings of {repaired}."
+            )
+        )
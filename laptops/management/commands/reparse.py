@@ -0,0 +1,67 @@
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from laptops.models import RawMessage
+from laptops.pipeline import ScrapedMessage, ScrapePipeline
+
+
+async def archived_messages(queryset, chunk_size):
+    """Stream captioned archived messages, one chunk in memory at a time."""
+    last_id = 0
+    while True:
+        raws = await sync_to_async(list)(
+            queryset.filter(id__gt=last_id).order_by("id")[:chunk_size]
+        )
+        if not raws:
+            return
+        last_id = raws[-1].id
+        for raw in raws:
+            message = ScrapedMessage.from_raw(raw)
+            if message.caption:
+                yield message
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild posts from the archived telegram messages, e.g. after changing "
+        "the parsing prompt or fields, without fetching the channels again"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--channel",
+            type=int,
+            action="append",
+            help="Only messages of this channel id, may be repeated",
+        )
+        parser.add_argument(
+            "--since", help="Only messages posted after this ISO date or datetime"
+        )
+        parser.add_argument(
+            "--parse-workers", type=int, default=None, help="Concurrent parse workers"
+        )
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        queryset = RawMessage.objects.select_related("channel")
+        if options["channel"]:
+            queryset = queryset.filter(channel_id__in=options["channel"])
+        if options["since"]:
+            try:
+                since = parse_datetime(options["since"]) or parse_datetime(
+                    f"{options['since']}T00:00:00Z"
+                )
+            except ValueError:
+                # Well formatted but out of range, e.g. month 13
+                since = None
+            if since is None:
+                raise CommandError(f"Invalid date: {options['since']}")
+            queryset = queryset.filter(posted_at__gte=since)
+
+        count = queryset.count()
+        self.stdout.write(f"Re-parsing up to {count} archived messages")
+        pipeline = ScrapePipeline(None, parse_workers=options["parse_workers"])
+        async_to_sync(pipeline.reparse)(
+            archived_messages(queryset, options["chunk_size"])
+        )
+        self.stdout.write(self.style.SUCCESS("Finished re-parsing."))
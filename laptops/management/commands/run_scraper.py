@@ -0,0 +1,150 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from laptops.fetch_scheduler import next_poll_delay
+from laptops.models import WorkerLease
+from laptops.tasks import scrape_laptops, stream_laptops
+
+logger = logging.getLogger("laptops")
+
+LEASE_NAME = "scraper"
+
+
+class Command(BaseCommand):
+    help = (
+        "Scrape the telegram channels as they come due, at least every "
+        "SCHEDULE_INTERVAL minutes. Any number of workers may run, a database "
+        "lease lets one scrape at a time and the others stand by to take over."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Most minutes between scrapes, SCHEDULE_INTERVAL by default",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Scrape once if the lease is free, then exit",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help=(
+                "Ingest new messages as they are posted, scanning the histories "
+                "every SCRAPER_RECONCILE_SECONDS only to fill in gaps"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options["once"] and options["stream"]:
+            raise CommandError("--once and --stream cannot be combined")
+        interval = 60 * float(options["interval"] or settings.SCHEDULE_INTERVAL)
+        lease_seconds = settings.SCRAPER_LEASE_SECONDS
+        # Renew well before the lease expires, a missed renewal is not fatal
+        renew_every = lease_seconds / 3
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stopping = threading.Event()
+        # Finish the current scrape and release the lease on shutdown
+        handlers = {
+            signum: signal.signal(signum, lambda *_: self.stopping.set())
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+        next_run = time.monotonic()
+        try:
+            while not self.stopping.is_set():
+                if not WorkerLease.acquire(LEASE_NAME, self.owner, lease_seconds):
+                    if options["once"]:
+                        self.stdout.write("Another worker holds the scraper lease.")
+                        return
+                    self.stopping.wait(renew_every)
+                    continue
+
+                if options["stream"]:
+                    # Returns on shutdown, or when the lease was lost
+                    self.with_lease(self.stream, lease_seconds, renew_every)
+                    self.stopping.wait(renew_every)
+                    continue
+
+                if time.monotonic() >= next_run:
+                    self.with_lease(self.scrape, lease_seconds, renew_every)
+                    next_run = time.monotonic() + self.next_delay(interval)
+                    if options["once"]:
+                        return
+                self.stopping.wait(
+                    min(renew_every, max(0, next_run - time.monotonic()))
+                )
+        finally:
+            WorkerLease.release(LEASE_NAME, self.owner)
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def next_delay(self, interval):
+        """
+        Seconds until the next channel is due, between
+        ``SCRAPER_MIN_POLL_SECONDS`` and ``interval``.
+        """
+        try:
+            delay = next_poll_delay()
+        except Exception as e:
+            logger.error(f"Error scheduling the next scrape: {str(e)}")
+            delay = None
+        if delay is None:
+            return interval
+        return min(interval, max(settings.SCRAPER_MIN_POLL_SECONDS, delay))
+
+    def scrape(self, lost):
+        scrape_laptops(lambda: lost.is_set())
+
+    def stream(self, lost):
+        stream_laptops(lambda: self.stopping.is_set() or lost.is_set())
+
+    def with_lease(self, work, lease_seconds, renew_every):
+        """
+        Run ``work(lost)``, renewing the lease from another thread meanwhile.
+        ``lost`` is set once the lease could not be renewed, whether another
+        worker took it over or the database could not be reached: it may
+        expire before the next attempt, so ``work`` must stop.
+        """
+        done = threading.Event()
+        lost = threading.Event()
+
+        def renew():
+            try:
+                while not done.wait(renew_every):
+                    try:
+                        renewed = WorkerLease.acquire(
+                            LEASE_NAME, self.owner, lease_seconds
+                        )
+                    except Exception as e:
+                        logger.error(f"Error renewing scraper lease: {str(e)}")
+                        # Reconnect on the next attempt
+                        connection.close()
+                        renewed = False
+                    if not renewed:
+                        logger.error("Scraper lease lost during a scrape")
+                        lost.set()
+                        return
+            finally:
+                connection.close()
+
+        renewer = threading.Thread(target=renew, name="scraper-lease", daemon=True)
+        renewer.start()
+        try:
+            work(lost)
+        except Exception as e:
+            logger.error(f"Error scraping laptops: {str(e)}")
+        finally:
+            done.set()
+            renewer.join()
@@ -1,8 +1,10 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
-from laptops.tasks import scrape_laptops
 
 
 class Command(BaseCommand):
+    help = "Scrape once unless another worker holds the lease, see run_scraper"
+
     def handle(self, *args, **options):
-        # Put here some script to get the data from api service and store it into your models.
-        scrape_laptops()
+        # Scraping without the lease would race the running worker
+        call_command("run_scraper", "--once", stdout=self.stdout, stderr=self.stderr)
@@ -1,96 +1,199 @@
+import numpy as np
 from django.core.management.base import BaseCommand
-from laptops.models import LaptopPost, SimilarityScore
-from Levenshtein import ratio
-from concurrent.futures import ThreadPoolExecutor
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from laptops.models import ComputeWatermark, LaptopPost, SimilarNeighbour
+from laptops.similarity import SimilarityEngine
 
+WATERMARK_NAME = "similarity"
 
-class Command(BaseCommand):
-    help = "Precompute similarity scores for all items based on multiple attributes"
 
-    def handle(self, *args, **kwargs):
-        items = LaptopPost.objects.all()
+class Command(BaseCommand):
+    help = "Precompute the top-K similar posts of every post"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only score posts created or updated since the last run, "
+            "against the whole catalog",
+        )
+        parser.add_argument(
+            "--top-k",
+            type=int,
+            default=20,
+            help="Neighbours kept per post",
+        )
+        parser.add_argument(
+            "--min-score",
+            type=float,
+            default=0.5,
+            help="Neighbours scoring below this are not stored",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=-1,
+            help="Threads used to compute scores (-1 uses every core)",
+        )
+        parser.add_argument(
+            "--max-changed",
+            type=int,
+            default=2000,
+            help="Recompute every post when more posts than this changed, "
+            "their scores against the whole catalog are kept in memory",
+        )
+        parser.add_argument("--chunk-size", type=int, default=512)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started_at = timezone.now()
+        watermark = (
+            ComputeWatermark.get_value(WATERMARK_NAME)
+            if options["incremental"]
+            else None
+        )
 
-        # Generate batches for efficiency
-        batch_size = 100
-        batches = self.generate_batches(items, batch_size)
+        engine = SimilarityEngine.from_queryset(
+            LaptopPost.objects.all(), workers=options["workers"]
+        )
 
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = []
-            for batch in batches:
-                futures.append(
-                    executor.submit(self.compute_similarities_for_batch, batch)
+        changed = None
+        if watermark is not None:
+            # Posts created since the engine was built are not in it, they
+            # are newer than `started_at` and scored by the next run
+            changed = engine.positions(
+                LaptopPost.objects.filter(updated_at__gt=watermark).values_list(
+                    "id", flat=True
                 )
-
-            # Wait for all the futures to complete
-            for future in futures:
-                future.result()
+            )
+            if len(changed) > options["max_changed"]:
+                changed = None
+
+        if changed is None:
+            neighbours = engine.top_k(
+                options["top_k"],
+                chunk_size=options["chunk_size"],
+                min_score=options["min_score"],
+            )
+        else:
+            neighbours = self.incremental_neighbours(engine, changed, options)
+
+        batch = {}
+        posts = 0
+        for item_id, item_neighbours in neighbours:
+            posts += 1
+            batch[item_id] = item_neighbours
+            if len(batch) * options["top_k"] >= options["batch_size"]:
+                self.save_neighbours(batch)
+                batch = {}
+
+        self.save_neighbours(batch)
+        ComputeWatermark.set_value(WATERMARK_NAME, started_at)
 
         self.stdout.write(
-            self.style.SUCCESS("Successfully precomputed similarity scores.")
+            self.style.SUCCESS(
+                f"Successfully precomputed similar posts ({posts} posts updated)."
+            )
         )
 
-    def generate_batches(self, items, batch_size):
+    def incremental_neighbours(self, engine, rows, options):
         """
-        Generates batches of LaptopPost items for efficient processing.
+        Yield fresh neighbour lists for the changed posts, and for every other
+        post that one of the changed posts now belongs in.
         """
-        for i in range(0, len(items), batch_size):
-            yield items[i : i + batch_size]
+        k, min_score = options["top_k"], options["min_score"]
+        if not len(rows):
+            return
+
+        # Similarity is symmetric, so the changed posts' rows are also their
+        # scores as seen from every other post
+        best_changed = np.full(len(engine), -1.0, dtype=np.float32)
+        changed_scores = []
+        for start in range(0, len(rows), options["chunk_size"]):
+            chunk = rows[start : start + options["chunk_size"]]
+            scores = engine.score_rows(chunk)
+            scores[np.arange(len(chunk)), chunk] = -1
+            changed_scores.append(scores)
+            np.maximum(best_changed, scores.max(axis=0), out=best_changed)
+        changed_scores = np.vstack(changed_scores)
+        changed_ids = {int(item_id) for item_id in engine.ids[rows]}
+
+        yield from engine.top_k(
+            k, rows=rows, chunk_size=options["chunk_size"], min_score=min_score
+        )
 
-    def compute_similarities_for_batch(self, batch):
-        """
-        Computes the similarity scores for a batch of LaptopPost items.
-        """
-        similarity_scores = []
-        for item_a in batch:
-            for item_b in batch:
-                if item_a != item_b:
-                    similarity_score = self.compute_similarity(item_a, item_b)
-                    if (
-                        similarity_score is not None
-                    ):  # Only add valid SimilarityScore objects
-                        similarity_scores.append(similarity_score)
-
-        # Use bulk_create to insert the batch into the database at once
-        if similarity_scores:
-            SimilarityScore.objects.bulk_create(similarity_scores)
-
-    def compute_similarity(self, item_a, item_b):
+        # Worst stored score of every post whose list is already full
+        thresholds = dict(
+            SimilarNeighbour.objects.values("item")
+            .annotate(count=Count("id"), worst=Min("score"))
+            .filter(count__gte=k)
+            .values_list("item", "worst")
+        )
+        # Posts already listing a changed post need its score refreshed
+        listing_changed = set(
+            SimilarNeighbour.objects.filter(neighbour_id__in=changed_ids).values_list(
+                "item_id", flat=True
+            )
+        )
+        affected = [
+            position
+            for position in range(len(engine))
+            if int(engine.ids[position]) not in changed_ids
+            and (
+                int(engine.ids[position]) in listing_changed
+                or best_changed[position]
+                > max(thresholds.get(int(engine.ids[position]), -1), min_score - 1e-6)
+            )
+        ]
+
+        for start in range(0, len(affected), options["batch_size"]):
+            positions = affected[start : start + options["batch_size"]]
+            item_ids = [int(engine.ids[position]) for position in positions]
+            current = {}
+            for item_id, neighbour_id, score in SimilarNeighbour.objects.filter(
+                item_id__in=item_ids
+            ).values_list("item_id", "neighbour_id", "score"):
+                # Scores against changed posts are replaced by fresh ones
+                if neighbour_id not in changed_ids:
+                    current.setdefault(item_id, []).append((neighbour_id, score))
+
+            for position, item_id in zip(positions, item_ids):
+                candidates = current.get(item_id, []) + [
+                    (int(engine.ids[row]), float(score))
+                    for row, score in zip(rows, changed_scores[:, position])
+                    if score >= min_score
+                ]
+                candidates.sort(key=lambda candidate: -candidate[1])
+                yield item_id, candidates[:k]
+
+    @transaction.atomic
+    def save_neighbours(self, neighbours):
         """
-        Computes the similarity score between two LaptopPost items.
+        Replace the neighbour lists of a batch of posts with bulk upserts.
         """
-        # Check if similarity score already exists
-        if SimilarityScore.objects.filter(item_a=item_a, item_b=item_b).exists():
-            return None  # Skip if already computed
-
-        # 1. Name similarity using Levenshtein ratio
-        name_a = item_a.title.lower() if item_a.title else ""
-        name_b = item_b.title.lower() if item_b.title else ""
-
-        storage_a = item_a.storage.lower() if item_a.storage else ""
-        storage_b = item_b.storage.lower() if item_b.storage else ""
-
-        processor_a = item_a.processor.lower() if item_a.processor else ""
-        processor_b = item_b.processor.lower() if item_b.processor else ""
-
-        ram_a = item_a.ram.lower() if item_a.ram else ""
-        ram_b = item_b.ram.lower() if item_b.ram else ""
-
-        name_similarity = ratio(name_a, name_b)
-        storage_similarity = ratio(storage_a, storage_b)
-        processor_similarity = ratio(processor_a, processor_b)
-        ram_similarity = ratio(ram_a, ram_b)
-
-        # 4. Weighted combined similarity
-        total_similarity = (
-            0.2 * name_similarity
-            + 0.3 * storage_similarity
-            + 0.3 * processor_similarity
-            + 0.2 * ram_similarity
-        )
+        if not neighbours:
+            return
 
-        # Create the SimilarityScore object
-        return SimilarityScore(
-            item_a=item_a,
-            item_b=item_b,
-            score=total_similarity,
+        SimilarNeighbour.objects.bulk_create(
+            [
+                SimilarNeighbour(
+                    item_id=item_id, rank=rank, neighbour_id=neighbour_id, score=score
+                )
+                for item_id, item_neighbours in neighbours.items()
+                for rank, (neighbour_id, score) in enumerate(item_neighbours)
+            ],
+            update_conflicts=True,
+            unique_fields=["item", "rank"],
+            update_fields=["neighbour", "score"],
         )
+
+        # Drop ranks past the end of lists that got shorter
+        by_length = {}
+        for item_id, item_neighbours in neighbours.items():
+            by_length.setdefault(len(item_neighbours), []).append(item_id)
+        for length, item_ids in by_length.items():
+            SimilarNeighbour.objects.filter(
+                item_id__in=item_ids, rank__gte=length
+            ).delete()
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('laptops', '0004_alter_laptopimage_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParsedCaption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('caption_hash', models.CharField(max_length=64, unique=True)),
+                ('data', models.JSONField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
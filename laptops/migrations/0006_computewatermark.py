@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0005_parsedcaption"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ComputeWatermark",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("value", models.DateTimeField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0006_computewatermark"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SimilarNeighbour",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("score", models.FloatField()),
+                (
+                    "item",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbours",
+                        to="laptops.laptoppost",
+                    ),
+                ),
+                (
+                    "neighbour",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="laptops.laptoppost",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["item", "rank"],
+            },
+        ),
+        migrations.DeleteModel(
+            name="SimilarityScore",
+        ),
+        migrations.AddConstraint(
+            model_name="similarneighbour",
+            constraint=models.UniqueConstraint(
+                fields=("item", "rank"), name="unique_neighbour_rank"
+            ),
+        ),
+    ]
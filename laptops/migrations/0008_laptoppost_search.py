@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:16
+
+import django.contrib.postgres.search
+from django.db import migrations
+from laptops.search import install_search_index, uninstall_search_index
+
+
+def install(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0007_similarneighbour"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="laptoppost",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(install, uninstall),
+    ]
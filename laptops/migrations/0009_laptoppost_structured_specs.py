@@ -0,0 +1,71 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0008_laptoppost_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="laptoppost",
+            name="cpu_generation",
+            field=models.PositiveSmallIntegerField(
+                blank=True, db_index=True, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="cpu_tier",
+            field=models.PositiveSmallIntegerField(
+                blank=True, db_index=True, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="cpu_vendor",
+            field=models.CharField(blank=True, db_index=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="currency",
+            field=models.CharField(blank=True, max_length=3, null=True),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="price_amount",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="ram_gb",
+            field=models.PositiveSmallIntegerField(
+                blank=True, db_index=True, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="screen_inches",
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="storage_gb",
+            field=models.PositiveIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="storage_type",
+            field=models.CharField(blank=True, db_index=True, max_length=10, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="laptoppost",
+            index=models.Index(
+                fields=["currency", "price_amount"],
+                name="laptops_lap_currenc_158b95_idx",
+            ),
+        ),
+    ]
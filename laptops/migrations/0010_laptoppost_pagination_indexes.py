@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0009_laptoppost_structured_specs"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="laptoppost",
+            index=models.Index(
+                fields=["-posted_at", "-id"], name="laptoppost_posted_at_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="laptoppost",
+            index=models.Index(
+                fields=["channel_id", "-posted_at", "-id"],
+                name="laptoppost_channel_posted_idx",
+            ),
+        ),
+    ]
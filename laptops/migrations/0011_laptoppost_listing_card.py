@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0010_laptoppost_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="laptoppost",
+            name="listing_card",
+            field=models.TextField(editable=False, null=True),
+        ),
+    ]
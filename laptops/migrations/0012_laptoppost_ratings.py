@@ -0,0 +1,59 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
+from laptops.search import install_search_index
+
+
+def compute_ratings(apps, schema_editor):
+    LaptopPost = apps.get_model("laptops", "LaptopPost")
+    Review = apps.get_model("laptops", "Review")
+    reviews = Review.objects.filter(product=OuterRef("pk")).values("product")
+    count = Subquery(reviews.annotate(count=Count("id")).values("count"))
+    total = Subquery(reviews.annotate(total=Sum("rating")).values("total"))
+    LaptopPost.objects.filter(reviews__isnull=False).distinct().update(
+        rating_count=Coalesce(count, 0),
+        rating_sum=Coalesce(total, 0),
+        rating_average=Cast(total, models.FloatField()) / count,
+    )
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    # SQLite adds NOT NULL columns by rebuilding the table, which drops the
+    # full-text index triggers
+    install_search_index(schema_editor.connection, rebuild=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0011_laptoppost_listing_card"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="laptoppost",
+            name="rating_average",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="laptoppost",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="laptoppost",
+            index=models.Index(
+                fields=["-rating_average", "-posted_at", "-id"],
+                name="laptoppost_rating_idx",
+            ),
+        ),
+        migrations.RunPython(reinstall_search_triggers, migrations.RunPython.noop),
+        migrations.RunPython(compute_ratings, migrations.RunPython.noop),
+    ]
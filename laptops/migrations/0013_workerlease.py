@@ -0,0 +1,25 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0012_laptoppost_ratings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WorkerLease",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("owner", models.CharField(max_length=255)),
+                ("expires_at", models.DateTimeField()),
+                ("acquired_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0014_ingestjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RawMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("message_id", models.BigIntegerField()),
+                ("posted_at", models.DateTimeField()),
+                ("compressed", models.BinaryField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "channel",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="raw_messages",
+                        to="laptops.telegramchat",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("channel", "message_id"),
+                        name="rawmessage_channel_message",
+                    )
+                ],
+            },
+        ),
+    ]
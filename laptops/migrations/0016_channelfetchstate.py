@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-18 10:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0015_rawmessage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChannelFetchState",
+            fields=[
+                (
+                    "channel",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="fetch_state",
+                        serialize=False,
+                        to="laptops.telegramchat",
+                    ),
+                ),
+                ("last_message_id", models.BigIntegerField(default=0)),
+                ("messages_per_hour", models.FloatField(default=0)),
+                ("fetch_limit", models.PositiveIntegerField(default=50)),
+                ("poll_seconds", models.PositiveIntegerField(default=1200)),
+                (
+                    "next_poll_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                ("last_polled_at", models.DateTimeField(blank=True, null=True)),
+                ("flood_waits", models.PositiveIntegerField(default=0)),
+                ("flood_wait_until", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
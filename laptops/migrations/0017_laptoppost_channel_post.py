@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:01
+
+from django.db import migrations, models
+from laptops.search import install_search_index
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    # SQLite alters constraints by rebuilding the table, which drops the
+    # full-text index triggers
+    install_search_index(schema_editor.connection, rebuild=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0016_channelfetchstate"),
+    ]
+
+    operations = [
+        # Message ids are only unique within a channel
+        migrations.AddConstraint(
+            model_name="laptoppost",
+            constraint=models.UniqueConstraint(
+                fields=("channel_id", "post_id"), name="laptoppost_channel_post"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="laptoppost",
+            name="post_id",
+            field=models.IntegerField(),
+        ),
+        migrations.RunPython(reinstall_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0017_laptoppost_channel_post"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="channelfetchstate",
+            name="pending_message_id",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="channelfetchstate",
+            name="resume_offset_id",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
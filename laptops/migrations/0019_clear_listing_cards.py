@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 14:12
+
+from django.db import migrations
+
+
+def clear_listing_cards(apps, schema_editor):
+    # Stored cards held image URLs, signed ones among them expire. They are
+    # rendered again with image names when next listed.
+    LaptopPost = apps.get_model("laptops", "LaptopPost")
+    LaptopPost.objects.update(listing_card=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("laptops", "0018_channelfetchstate_resume"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_listing_cards, migrations.RunPython.noop),
+    ]
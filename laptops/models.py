@@ -1,10 +1,77 @@
+import json
+import zlib
+from datetime import timedelta
+
 from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, transaction
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db.models import Case, Count, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from .spec_parser import structured_specs
 
 
 User = get_user_model()
 
 
+class LaptopPostQuerySet(models.QuerySet):
+    def for_listing(self):
+        """
+        Everything the listing serializer reads, in a constant number of
+        queries: ratings are stored on the post and images prefetched.
+        """
+        return self.prefetch_related("images")
+
+    def add_ratings(self, count, total):
+        """
+        Add ``count`` reviews rating ``total`` in all to the stored rating
+        aggregates, in a single UPDATE computed from the current column
+        values so concurrent reviews are all counted.
+        """
+        return self.update(
+            rating_count=F("rating_count") + count,
+            rating_sum=F("rating_sum") + total,
+            rating_average=Case(
+                When(rating_count=-count, then=Value(0.0)),
+                default=Cast(F("rating_sum") + total, models.FloatField())
+                / (F("rating_count") + count),
+                output_field=models.FloatField(),
+            ),
+        )
+
+    def with_actual_ratings(self):
+        """Annotate the rating aggregates computed from the reviews."""
+        reviews = Review.objects.filter(product=OuterRef("pk")).values("product")
+        return self.annotate(
+            actual_rating_count=Coalesce(
+                Subquery(reviews.annotate(count=Count("id")).values("count")), 0
+            ),
+            actual_rating_sum=Coalesce(
+                Subquery(reviews.annotate(total=Sum("rating")).values("total")), 0
+            ),
+        )
+
+    def for_detail(self):
+        """
+        ``for_listing`` plus the reviews and ranked neighbours shown on the
+        detail page.
+        """
+        return self.for_listing().prefetch_related(
+            models.Prefetch(
+                "reviews", queryset=Review.objects.select_related("user")
+            ),
+            models.Prefetch(
+                "neighbours",
+                queryset=SimilarNeighbour.objects.filter(rank__lt=10)
+                .select_related("neighbour")
+                .prefetch_related("neighbour__images"),
+            ),
+        )
+
+
 class LaptopPost(models.Model):
     title = models.CharField(max_length=255, db_index=True)
 
@@ -21,7 +88,28 @@ class LaptopPost(models.Model):
 
     description = models.TextField(null=True, blank=True)
     price = models.CharField(max_length=50, null=True, blank=True)
-    post_id = models.IntegerField(unique=True)
+
+    # Normalized from the text fields above by spec_parser.structured_specs
+    price_amount = models.PositiveIntegerField(null=True, blank=True)
+    currency = models.CharField(max_length=3, null=True, blank=True)
+    ram_gb = models.PositiveSmallIntegerField(null=True, blank=True, db_index=True)
+    storage_gb = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    storage_type = models.CharField(max_length=10, null=True, blank=True, db_index=True)
+    cpu_vendor = models.CharField(max_length=10, null=True, blank=True, db_index=True)
+    cpu_tier = models.PositiveSmallIntegerField(null=True, blank=True, db_index=True)
+    cpu_generation = models.PositiveSmallIntegerField(
+        null=True, blank=True, db_index=True
+    )
+    screen_inches = models.FloatField(null=True, blank=True, db_index=True)
+
+    # Aggregates of the post's reviews, kept up to date by Review.save() and
+    # a pre_delete signal handler
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_average = models.FloatField(default=0)
+
+    # Telegram message id, unique within its channel
+    post_id = models.IntegerField()
     channel_name = models.CharField(max_length=255)
     channel_id = models.ForeignKey(
         "TelegramChat", related_name="posts", on_delete=models.CASCADE
@@ -29,13 +117,99 @@ class LaptopPost(models.Model):
     posted_at = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by a database trigger on PostgreSQL, see laptops.search
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Pre-rendered JSON of the post in listings, see laptops.listing_cards
+    listing_card = models.TextField(null=True, editable=False)
+
+    objects = LaptopPostQuerySet.as_manager()
 
     class Meta:
         ordering = ["-posted_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["channel_id", "post_id"], name="laptoppost_channel_post"
+            )
+        ]
+        indexes = [
+            # Price ranges are always within one currency
+            models.Index(fields=["currency", "price_amount"]),
+            # Keyset pagination of the listing and of each channel's posts
+            models.Index(
+                fields=["-posted_at", "-id"], name="laptoppost_posted_at_idx"
+            ),
+            models.Index(
+                fields=["channel_id", "-posted_at", "-id"],
+                name="laptoppost_channel_posted_idx",
+            ),
+            # Best rated first, and the rating_min filter
+            models.Index(
+                fields=["-rating_average", "-posted_at", "-id"],
+                name="laptoppost_rating_idx",
+            ),
+        ]
+
+    # Only ever written by UPDATE statements, see LaptopPostQuerySet.add_ratings
+    RATING_FIELDS = ("rating_count", "rating_sum", "rating_average")
+    # Text fields the normalized spec columns are parsed from
+    SPEC_SOURCE_FIELDS = ("price", "storage", "processor", "ram", "display")
+    SPEC_FIELDS = tuple(structured_specs({}))
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def fit_values(cls, values):
+        """
+        ``values`` cut to fit their columns: text longer than the column is
+        truncated, integers outside the column's range are dropped. Parsed
+        values come from an LLM, and one that does not fit would fail the
+        write of a whole batch.
+
+        :param values: Mapping of field name to value.
+        """
+        fitted = dict(values)
+        for name, value in values.items():
+            field = cls._meta.get_field(name)
+            if isinstance(value, str) and field.max_length:
+                fitted[name] = value[: field.max_length]
+            elif isinstance(value, int) and isinstance(field, models.IntegerField):
+                # The narrowest range of the supported databases, SQLite
+                # alone would accept any 64 bit integer
+                low, high = BaseDatabaseOperations.integer_field_ranges[
+                    field.get_internal_type()
+                ]
+                if not low <= value <= high:
+                    fitted[name] = None
+        return fitted
+
+    def set_structured_specs(self):
+        """Recompute the normalized spec columns from the text fields."""
+        specs = structured_specs(
+            {name: getattr(self, name) for name in self.SPEC_SOURCE_FIELDS}
+        )
+        for name, value in self.fit_values(specs).items():
+            setattr(self, name, value)
+
+    def save(self, *args, **kwargs):
+        # Edits of the text fields, e.g. in the admin, must not leave the
+        # normalized specs that filters and facets use behind
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or set(update_fields) & set(self.SPEC_SOURCE_FIELDS):
+            self.set_structured_specs()
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, *self.SPEC_FIELDS}
+
+        # Saving an instance loaded before a review was written must not put
+        # back the old rating aggregates
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class LaptopImage(models.Model):
     post = models.ForeignKey(
@@ -98,6 +272,33 @@ class Review(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.user.username}"
 
+    def save(self, *args, **kwargs):
+        # Update the post's rating aggregates in the same transaction, before
+        # the save so post_save handlers see the new values
+        with transaction.atomic():
+            previous = (
+                None
+                if self._state.adding
+                else Review.objects.filter(pk=self.pk)
+                .values_list("product_id", "rating")
+                .first()
+            )
+            if previous is None:
+                LaptopPost.objects.filter(pk=self.product_id).add_ratings(
+                    1, self.rating
+                )
+            elif previous[0] == self.product_id:
+                if previous[1] != self.rating:
+                    LaptopPost.objects.filter(pk=self.product_id).add_ratings(
+                        0, self.rating - previous[1]
+                    )
+            else:
+                LaptopPost.objects.filter(pk=previous[0]).add_ratings(-1, -previous[1])
+                LaptopPost.objects.filter(pk=self.product_id).add_ratings(
+                    1, self.rating
+                )
+            super().save(*args, **kwargs)
+
     class Meta:
         unique_together = (
             "product",
@@ -105,29 +306,234 @@ class Review(models.Model):
         )  # Prevent duplicate reviews by the same user for the same product
 
 
-class SimilarityScore(models.Model):
-    item_a = models.ForeignKey(
-        "LaptopPost",
-        on_delete=models.CASCADE,
-        related_name="similarity_scores_as_a",
-        db_index=True,
+class SimilarNeighbour(models.Model):
+    """
+    The top-K most similar posts of ``item``, one row per rank.
+
+    Every post owns its own fixed-size list, so lookups never depend on
+    which side of a pair a post was stored on.
+    """
+
+    item = models.ForeignKey(
+        "LaptopPost", on_delete=models.CASCADE, related_name="neighbours"
     )
-    item_b = models.ForeignKey(
-        "LaptopPost",
-        on_delete=models.CASCADE,
-        related_name="similarity_scores_as_b",
-        db_index=True,
+    rank = models.PositiveSmallIntegerField()
+    neighbour = models.ForeignKey(
+        "LaptopPost", on_delete=models.CASCADE, related_name="+"
     )
     score = models.FloatField()
 
     class Meta:
+        ordering = ["item", "rank"]
         constraints = [
+            # Also serves as the (item, rank) index for detail-page lookups
             models.UniqueConstraint(
-                fields=["item_a", "item_b"], name="unique_similarity_score"
+                fields=["item", "rank"], name="unique_neighbour_rank"
             )
         ]
 
-    def save(self, *args, **kwargs):
-        if self.item_a.id > self.item_b.id:
-            self.item_a, self.item_b = self.item_b, self.item_a
-        super().save(*args, **kwargs)
+    def __str__(self):
+        return f"{self.item_id} #{self.rank} -> {self.neighbour_id}"
+
+
+class ParsedCaption(models.Model):
+    """
+    Verified LLM output keyed by a hash of the normalized caption text.
+    """
+
+    caption_hash = models.CharField(max_length=64, unique=True)
+    data = models.JSONField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return self.caption_hash
+
+
+class ComputeWatermark(models.Model):
+    """
+    Timestamp up to which a periodic job has processed its inputs.
+    """
+
+    name = models.CharField(max_length=100, primary_key=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
+
+    @classmethod
+    def get_value(cls, name):
+        return cls.objects.filter(name=name).values_list("value", flat=True).first()
+
+    @classmethod
+    def set_value(cls, name, value):
+        cls.objects.update_or_create(name=name, defaults={"value": value})
+
+
+class WorkerLease(models.Model):
+    """
+    Time-limited lock held by one process across every node, e.g. so a
+    single scraper runs at a time. The holder renews it before it expires,
+    and anyone may take it over once it has.
+    """
+
+    name = models.CharField(max_length=100, primary_key=True)
+    owner = models.CharField(max_length=255)
+    expires_at = models.DateTimeField()
+    acquired_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.owner} until {self.expires_at}"
+
+    @classmethod
+    def acquire(cls, name, owner, seconds):
+        """
+        Take or renew the lease for ``seconds``.
+
+        :return: Whether ``owner`` holds the lease.
+        """
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=seconds)
+        # Renew, or take over an expired lease, with conditional UPDATEs so
+        # two processes cannot both win
+        if cls.objects.filter(name=name, owner=owner).update(expires_at=expires_at):
+            return True
+        if cls.objects.filter(name=name, expires_at__lte=now).update(
+            owner=owner, expires_at=expires_at, acquired_at=now
+        ):
+            return True
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    name=name, owner=owner, expires_at=expires_at, acquired_at=now
+                )
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def release(cls, name, owner):
+        cls.objects.filter(name=name, owner=owner).delete()
+
+
+class IngestJob(models.Model):
+    """
+    A scraped telegram message waiting to be parsed and saved. Failed jobs
+    are retried with exponential backoff, see laptops.ingest.
+    """
+
+    class State(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    channel = models.ForeignKey(
+        TelegramChat, related_name="ingest_jobs", on_delete=models.CASCADE
+    )
+    message_id = models.BigIntegerField()
+    # Chat the message was sent from, where its media group is fetched
+    chat_id = models.BigIntegerField()
+    channel_name = models.CharField(max_length=255)
+    caption = models.TextField()
+    media_group_id = models.CharField(max_length=64, null=True, blank=True)
+    posted_at = models.DateTimeField()
+
+    state = models.CharField(
+        max_length=10, choices=State.choices, default=State.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Not claimed before this time, pushed back after each failure
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["channel", "message_id"], name="ingestjob_channel_message"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["state", "available_at"], name="ingestjob_due_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.channel_id}/{self.message_id} ({self.state})"
+
+
+class RawMessage(models.Model):
+    """
+    Append-only archive of the telegram messages as fetched, before any
+    parsing, so posts can be rebuilt from history (see the ``reparse``
+    command) without fetching the channels again.
+
+    The message is stored as zlib-compressed JSON: caption, date, chat and
+    sender chat, media group id and photo file ids.
+    """
+
+    channel = models.ForeignKey(
+        TelegramChat, related_name="raw_messages", on_delete=models.CASCADE
+    )
+    message_id = models.BigIntegerField()
+    posted_at = models.DateTimeField()
+    compressed = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["channel", "message_id"], name="rawmessage_channel_message"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.channel_id}/{self.message_id}"
+
+    @staticmethod
+    def compress(data):
+        return zlib.compress(
+            json.dumps(data, separators=(",", ":")).encode("utf-8"), 9
+        )
+
+    @property
+    def data(self):
+        return json.loads(zlib.decompress(self.compressed))
+
+
+class ChannelFetchState(models.Model):
+    """
+    How a channel is polled, adapted after every poll by
+    laptops.fetch_scheduler: the newest message seen, the posting rate, the
+    page size and interval derived from it, and recent flood waits.
+    """
+
+    channel = models.OneToOneField(
+        TelegramChat,
+        primary_key=True,
+        related_name="fetch_state",
+        on_delete=models.CASCADE,
+    )
+    last_message_id = models.BigIntegerField(default=0)
+    # A poll cut short by its limit leaves older new messages behind: the
+    # next poll resumes below the oldest message it fetched, and the newest
+    # one becomes last_message_id once the gap is closed
+    resume_offset_id = models.BigIntegerField(default=0)
+    pending_message_id = models.BigIntegerField(default=0)
+    # Smoothed rate of new messages, captioned or not
+    messages_per_hour = models.FloatField(default=0)
+    fetch_limit = models.PositiveIntegerField(default=50)
+    poll_seconds = models.PositiveIntegerField(default=1200)
+    next_poll_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_polled_at = models.DateTimeField(null=True, blank=True)
+    # Flood waits since the last successful poll
+    flood_waits = models.PositiveIntegerField(default=0)
+    flood_wait_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.channel_id} every {self.poll_seconds}s, next {self.next_poll_at}"
@@ -0,0 +1,179 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks to the last row of the previous page with
+    a ``WHERE (a, b) < (x, y)`` comparison on the ordering columns, so every
+    page costs the same as the first one. The total is counted on the first
+    page, as page-number responses always did, unless the client passes
+    ``?count=false``; pages past the first only count it when asked for with
+    ``?count=true``.
+
+    ``ordering`` must end with a unique column. Querysets that are already
+    ordered (e.g. by search relevance) keep their ordering, with the unique
+    column added as a tie-breaker.
+
+    Requests using ``?page=`` are still served by page number for existing
+    clients. Other requests get cursor ``next`` and ``previous`` links.
+    """
+
+    ordering = ("-pk",)
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if PageNumberPagination.page_query_param in request.query_params:
+            self.fallback = PageNumberPagination()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.sort_keys = self.get_ordering(queryset)
+        values, reverse = self.decode_cursor(queryset, request)
+        self.count = queryset.count() if self.wants_count(request) else None
+
+        ordering = self.reverse_ordering() if reverse else self.sort_keys
+        if values is not None:
+            queryset = queryset.filter(self.after(ordering, values))
+
+        results = list(queryset.order_by(*ordering)[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next = self.previous = None
+        if results:
+            if has_more or reverse:
+                self.next = self.encode_cursor(results[-1], reverse=False)
+            if (has_more and reverse) or (values is not None and not reverse):
+                self.previous = self.encode_cursor(results[0], reverse=True)
+        return results
+
+    def wants_count(self, request):
+        """Count the first page unless told not to, later pages only on demand."""
+        value = request.query_params.get(self.count_query_param, "").lower()
+        if value in ("0", "false"):
+            return False
+        first_page = self.cursor_query_param not in request.query_params
+        return first_page or value in ("1", "true")
+
+    def get_ordering(self, queryset):
+        ordering = [
+            field for field in queryset.query.order_by if isinstance(field, str)
+        ] or list(self.ordering)
+        names = {field.lstrip("-") for field in ordering}
+        return tuple(
+            ordering
+            + [field for field in self.ordering if field.lstrip("-") not in names]
+        )
+
+    def reverse_ordering(self):
+        return tuple(
+            field[1:] if field.startswith("-") else f"-{field}"
+            for field in self.sort_keys
+        )
+
+    @staticmethod
+    def compare(field, value, inclusive=False):
+        """``field`` strictly (or not) after ``value`` in its sort direction."""
+        lookup = "lt" if field.startswith("-") else "gt"
+        return Q(**{f"{field.lstrip('-')}__{lookup}{'e' if inclusive else ''}": value})
+
+    def after(self, ordering, values):
+        """
+        Rows after ``values`` in ``ordering``, as an OR of ``a < x``,
+        ``a = x AND b < y``, ... plus a bound on the first column that lets
+        the database range-scan the index.
+        """
+        seek = Q()
+        for i, field in enumerate(ordering):
+            ties = {
+                previous.lstrip("-"): value
+                for previous, value in zip(ordering[:i], values[:i])
+            }
+            seek |= Q(**ties) & self.compare(field, values[i])
+        return self.compare(ordering[0], values[0], inclusive=True) & seek
+
+    def field_value(self, queryset, name, value):
+        try:
+            field = queryset.model._meta.get_field(
+                queryset.model._meta.pk.name if name == "pk" else name
+            )
+        except FieldDoesNotExist:
+            return value  # an annotation, e.g. search rank
+        return field.to_python(value)
+
+    def decode_cursor(self, queryset, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+            values = [
+                self.field_value(queryset, field.lstrip("-"), value)
+                for field, value in zip(self.sort_keys, cursor["v"], strict=True)
+            ]
+            return values, bool(cursor.get("r"))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance, reverse):
+        values = [getattr(instance, field.lstrip("-")) for field in self.sort_keys]
+        cursor = {
+            "v": [
+                value.isoformat() if hasattr(value, "isoformat") else value
+                for value in values
+            ]
+        }
+        if reverse:
+            cursor["r"] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+
+        response = {}
+        if self.count is not None:
+            response["count"] = self.count
+        response.update(next=self.next, previous=self.previous, results=data)
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "count": {"type": "integer"},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class PostPagination(KeysetPagination):
+    ordering = ("-posted_at", "-id")
+
+
+class ReviewPagination(KeysetPagination):
+    ordering = ("-id",)
+
+
+class ChatPagination(KeysetPagination):
+    ordering = ("channel_id",)
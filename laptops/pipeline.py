@@ -0,0 +1,687 @@
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from pyrogram import Client, filters
+from pyrogram.errors import FloodWait
+from pyrogram.handlers import MessageHandler
+
+from .caption_cache import CaptionCache
+from .fetch_scheduler import (
+    channel_state,
+    due_channels,
+    record_flood_wait,
+    record_poll,
+)
+from .ingest import (
+    claim_jobs,
+    complete_jobs,
+    fail_jobs,
+    record_messages,
+)
+from .models import TelegramChat
+from .post_writer import discard_photos, has_photos, write_posts
+from .spec_parser import parse_caption
+from .tasks import (
+    ai_system_prompt,
+    download_mediagroup_images,
+    media_semaphore,
+    process_product,
+    process_products_batch,
+    upload_photos,
+)
+
+logger = logging.getLogger("laptops")
+
+# Sentinel pushed once per worker to tell it the upstream stage is finished
+_STOP = object()
+
+
+@dataclass
+class ScrapedMessage:
+    """
+    A captioned telegram message waiting to be parsed.
+    """
+
+    channel: TelegramChat
+    message_id: int
+    caption: str
+    channel_name: str
+    posted_at: datetime
+    chat_id: int
+    media_group_id: str | None = None
+    # IngestJob recording the message
+    job_id: int | None = None
+
+    @classmethod
+    def from_message(cls, channel, message):
+        """:param message: A pyrogram message with a caption."""
+        return cls(
+            channel=channel,
+            message_id=message.id,
+            caption=message.caption,
+            channel_name=(
+                message.sender_chat.title if message.sender_chat else "Unknown"
+            ),
+            posted_at=timezone.make_aware(message.date),
+            chat_id=(
+                message.sender_chat.id if message.sender_chat else channel.channel_id
+            ),
+            media_group_id=message.media_group_id,
+        )
+
+    @classmethod
+    def from_job(cls, job):
+        return cls(
+            channel=job.channel,
+            message_id=job.message_id,
+            caption=job.caption,
+            channel_name=job.channel_name,
+            posted_at=job.posted_at,
+            chat_id=job.chat_id,
+            media_group_id=job.media_group_id,
+            job_id=job.id,
+        )
+
+    @classmethod
+    def from_raw(cls, raw):
+        """:param raw: A ``RawMessage`` with a caption."""
+        data = raw.data
+        sender = data.get("sender_chat")
+        return cls(
+            channel=raw.channel,
+            message_id=raw.message_id,
+            caption=data["caption"],
+            channel_name=sender["title"] if sender else "Unknown",
+            posted_at=raw.posted_at,
+            chat_id=sender["id"] if sender else raw.channel_id,
+            media_group_id=data.get("media_group_id"),
+        )
+
+
+def raw_message_data(message):
+    """The parts of a pyrogram message kept in the ``RawMessage`` archive."""
+
+    def chat(chat):
+        return {"id": chat.id, "title": chat.title} if chat else None
+
+    photo = message.photo
+    return {
+        "id": message.id,
+        "date": timezone.make_aware(message.date).isoformat(),
+        "caption": message.caption,
+        "chat": chat(message.chat),
+        "sender_chat": chat(message.sender_chat),
+        "media_group_id": message.media_group_id,
+        "photo": (
+            {
+                "file_id": photo.file_id,
+                "file_unique_id": photo.file_unique_id,
+                "width": photo.width,
+                "height": photo.height,
+            }
+            if photo
+            else None
+        ),
+    }
+
+
+@dataclass
+class ParsedPost:
+    message: ScrapedMessage
+    data: dict = field(default_factory=dict)
+    # Storage names of the uploaded photos
+    photos: list = field(default_factory=list)
+
+
+class ScrapePipeline:
+    """
+    Bounded-concurrency scraping pipeline.
+
+    Channels are fetched concurrently (at most ``channel_concurrency`` at a
+    time), each with the page size its ``ChannelFetchState`` adapted to its
+    posting rate, and every captioned message is recorded as an
+    ``IngestJob``. Due
+    jobs, new or failed earlier, are claimed and flow through three stages
+    connected by bounded queues:
+
+        fetch -> jobs (DB) -> parse (LLM) -> images (download + upload)
+              -> persist (DB)
+
+    Each stage runs a fixed pool of workers, so a slow channel or a slow
+    Gemini call only holds up its own worker. Parse workers look captions up
+    in the ``CaptionCache`` first, then try the rule-based ``parse_caption``,
+    and send only low-confidence captions to the LLM, up to ``batch_size``
+    per request. Image workers download and upload the photos of a post
+    concurrently, with at most ``SCRAPER_MEDIA_CONCURRENCY`` transfers in
+    flight across the pipeline, and skip posts that already have photos. DB
+    workers write up to ``write_batch_size`` posts with their images at a
+    time with ``write_posts``, then mark their jobs done, or delete the
+    uploaded photos when the write fails. Jobs failing at any stage are
+    retried later with backoff.
+
+    ``run()`` fetches the given channels once, ``stream()`` ingests new
+    messages as telegram pushes them and scans the histories only now and
+    then to fill in gaps.
+
+    Calling ``stop()`` stops the fetchers and claiming; whatever is already
+    queued is drained before ``run()`` or ``stream()`` returns, the
+    remaining jobs wait for the next run.
+    """
+
+    def __init__(
+        self,
+        app: Client | None,
+        channel_concurrency: int | None = None,
+        parse_workers: int | None = None,
+        db_workers: int | None = None,
+        image_workers: int | None = None,
+        queue_size: int | None = None,
+        batch_size: int | None = None,
+        write_batch_size: int | None = None,
+        batch_linger: float = 0.5,
+        max_messages: int | None = None,
+        should_stop=None,
+    ):
+        self.app = app
+        self.channel_concurrency = (
+            channel_concurrency or settings.SCRAPER_CHANNEL_CONCURRENCY
+        )
+        self.parse_workers = parse_workers or settings.SCRAPER_PARSE_WORKERS
+        self.db_workers = db_workers or settings.SCRAPER_DB_WORKERS
+        self.image_workers = image_workers or settings.SCRAPER_IMAGE_WORKERS
+        self.batch_size = batch_size or settings.SCRAPER_LLM_BATCH_SIZE
+        self.write_batch_size = write_batch_size or settings.SCRAPER_WRITE_BATCH_SIZE
+        self.batch_linger = batch_linger
+        self.max_messages = max_messages
+        # Checked every second, stops the pipeline once it returns true,
+        # e.g. when the worker lost its lease
+        self.should_stop = should_stop
+
+        queue_size = queue_size or settings.SCRAPER_QUEUE_SIZE
+        self.parse_queue = asyncio.Queue(maxsize=queue_size)
+        self.image_queue = asyncio.Queue(maxsize=queue_size)
+        self.db_queue = asyncio.Queue(maxsize=queue_size)
+
+        self.min_confidence = settings.SPEC_PARSER_MIN_CONFIDENCE
+        self.caption_cache = CaptionCache(
+            namespace=hashlib.sha256(ai_system_prompt.encode("utf-8")).hexdigest()
+        )
+
+        self.media_semaphore = media_semaphore()
+
+        self._stopping = asyncio.Event()
+        # Set when jobs are recorded, wakes up the claiming loop
+        self._jobs_recorded = asyncio.Event()
+        # Channels whose new messages are ingested as they arrive, by id
+        self.streamed_channels = {}
+
+    def stop(self):
+        """
+        Stop fetching new messages. Messages already queued are still processed.
+        """
+        self._stopping.set()
+        self._jobs_recorded.set()
+
+    @property
+    def stopping(self):
+        return self._stopping.is_set()
+
+    async def run(self, channels):
+        await self._process(self._fetch_and_claim(channels))
+
+    async def reparse(self, messages):
+        """
+        Parse and save messages again, e.g. from the ``RawMessage`` archive,
+        without fetching anything from telegram. Posts keep their images.
+
+        :param messages: Async iterable of ``ScrapedMessage``.
+        """
+
+        async def feed():
+            async for message in messages:
+                if self.stopping:
+                    return
+                await self.parse_queue.put(message)
+
+        await self._process(feed())
+
+    async def _process(self, source):
+        """
+        Run the stages while ``source`` fills the parse queue, then drain
+        them.
+        """
+        parse_tasks = self._spawn(self._parse_worker, self.parse_workers, "parse")
+        image_tasks = self._spawn(self._image_worker, self.image_workers, "image")
+        db_tasks = self._spawn(self._db_worker, self.db_workers, "db")
+        watcher = asyncio.create_task(self._watch(), name="stop-watcher")
+        try:
+            await source
+        finally:
+            watcher.cancel()
+            # Drain the stages in order so nothing queued is lost
+            await self._drain(self.parse_queue, parse_tasks)
+            await self._drain(self.image_queue, image_tasks)
+            await self._drain(self.db_queue, db_tasks)
+            logger.info(f"Caption cache: {self.caption_cache.stats()}")
+
+    async def _watch(self):
+        if self.should_stop is None:
+            return
+        while not self.stopping:
+            if self.should_stop():
+                logger.info("Stopping the scraper pipeline")
+                self.stop()
+                return
+            await asyncio.sleep(1)
+
+    async def stream(self, reconcile_seconds, on_reconciled=None):
+        """
+        Ingest the messages of the active channels as telegram pushes them,
+        until ``stop()``. They are recorded like fetched ones and go through
+        the same stages within seconds.
+
+        Every ``reconcile_seconds`` the histories of the channels due for a
+        poll are scanned as well, which fills in whatever the stream missed,
+        e.g. while disconnected, and picks up new or deactivated channels.
+
+        :param on_reconciled: Coroutine function awaited after every scan.
+        """
+        await self._process(self._stream(reconcile_seconds, on_reconciled))
+
+    async def _stream(self, reconcile_seconds, on_reconciled):
+        chats = filters.chat()
+        handler = MessageHandler(self._on_message, chats)
+        self.app.add_handler(handler)
+        stopped = asyncio.create_task(self._stopping.wait())
+        # Between streamed messages, wake up when retries come due
+        claiming = asyncio.create_task(
+            self._claim_jobs(stopped, idle_seconds=settings.INGEST_RETRY_SECONDS),
+            name="claim-jobs",
+        )
+        try:
+            while not self.stopping:
+                channels = await sync_to_async(list)(
+                    TelegramChat.objects.filter(is_active=True)
+                )
+                self.streamed_channels = {
+                    channel.channel_id: channel for channel in channels
+                }
+                chats.clear()
+                chats.update(self.streamed_channels)
+
+                await self._fetch_channels(await sync_to_async(due_channels)())
+                if on_reconciled is not None:
+                    await on_reconciled()
+                await asyncio.wait([stopped], timeout=reconcile_seconds)
+        finally:
+            self.app.remove_handler(handler)
+            self.stop()
+            await claiming
+
+    async def _on_message(self, client, message):
+        channel = self.streamed_channels.get(message.chat.id)
+        if channel is None or self.stopping:
+            return
+        page = (
+            [ScrapedMessage.from_message(channel, message)] if message.caption else []
+        )
+        try:
+            await self._record(channel, [raw_message_data(message)], page)
+        except Exception as e:
+            logger.error(f"Error recording message {message.id} of {channel}: {str(e)}")
+
+    async def _record(self, channel, raw_messages, messages):
+        await sync_to_async(record_messages)(channel, raw_messages, messages)
+        if messages:
+            self._jobs_recorded.set()
+
+    async def _fetch_and_claim(self, channels):
+        fetching = asyncio.ensure_future(self._fetch_channels(channels))
+        claiming = asyncio.create_task(self._claim_jobs(fetching), name="claim-jobs")
+        try:
+            await fetching
+        finally:
+            await claiming
+
+    async def _fetch_channels(self, channels):
+        semaphore = asyncio.Semaphore(self.channel_concurrency)
+
+        async def fetch(channel):
+            async with semaphore:
+                if self.stopping:
+                    return
+                try:
+                    await self.fetch_channel(channel)
+                except Exception as e:
+                    logger.error(f"Error processing channel {channel}: {str(e)}")
+
+        await asyncio.gather(*(fetch(channel) for channel in channels))
+
+    def _spawn(self, worker, count, name):
+        return [
+            asyncio.create_task(worker(), name=f"{name}-worker-{i}")
+            for i in range(max(1, count))
+        ]
+
+    async def _drain(self, queue, tasks):
+        for _ in tasks:
+            await queue.put(_STOP)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def fetch_channel(self, channel: TelegramChat):
+        """
+        Record the messages of ``channel`` newer than the last poll, in pages
+        of the channel's adaptive ``fetch_limit`` and up to as many captioned
+        messages, then schedule its next poll. A poll stopped by that limit
+        leaves a gap, which the next polls close by paging further back
+        from where it stopped.
+
+        A flood wait does not hold the fetcher: the channel is rescheduled
+        after it and the fetcher moves on to other channels.
+        """
+        logger.info(f"Processing channel: {channel}")
+
+        state = await sync_to_async(channel_state)(channel)
+        last_post_id = state.last_message_id
+        limit = state.fetch_limit
+        max_messages = self.max_messages or limit
+
+        messages_with_captions = 0
+        new_messages = 0
+        newest_id = 0
+        # Resume below the oldest message fetched by an unfinished poll
+        last_message_id = state.resume_offset_id
+        caught_up = False
+        track = set()
+
+        while messages_with_captions < max_messages and not self.stopping:
+            should_break = False
+            page = []
+            raw_page = []
+            try:
+                async for message in self.app.get_chat_history(
+                    chat_id=channel.channel_id,
+                    limit=limit,
+                    offset_id=last_message_id,
+                ):
+                    if message.id in track:
+                        # it will stop it if end of channel messsage
+                        should_break = caught_up = True
+                    track.add(message.id)
+
+                    if message.id <= last_post_id:
+                        logger.info(
+                            f"Skipping message already processed: {message.id}"
+                        )
+                        should_break = caught_up = True
+                        break
+
+                    last_message_id = message.id
+                    newest_id = max(newest_id, message.id)
+                    new_messages += 1
+                    raw_page.append(raw_message_data(message))
+                    if not message.caption:
+                        continue
+
+                    messages_with_captions += 1
+                    page.append(ScrapedMessage.from_message(channel, message))
+
+                    if messages_with_captions >= max_messages or self.stopping:
+                        break
+
+            except FloodWait as e:
+                logger.info(
+                    f"Rate limit exceeded on {channel}, "
+                    f"polling it again in {e.value} seconds"
+                )
+                await sync_to_async(record_flood_wait)(
+                    state, e.value, last_message_id, newest_id
+                )
+                return
+            finally:
+                # Record the page before fetching the next one
+                if raw_page:
+                    await self._record(channel, raw_page, page)
+
+            # An empty page is the start of the channel
+            if should_break or not last_message_id or not raw_page:
+                caught_up = True
+                break
+
+        # A new channel starts from its newest messages, its history is not
+        # backfilled
+        caught_up = caught_up or not last_post_id
+        await sync_to_async(record_poll)(
+            state, new_messages, newest_id, caught_up, oldest_id=last_message_id
+        )
+
+    async def _claim_jobs(self, fetching, idle_seconds=None):
+        """
+        Feed due jobs to the parse stage until the fetchers are done and no
+        job is left to claim.
+
+        :param idle_seconds: Longest wait for new jobs once none is due,
+            ``batch_linger`` by default.
+        """
+        while not self.stopping:
+            fetched = fetching.done()
+            try:
+                jobs = await sync_to_async(claim_jobs)(self.write_batch_size)
+            except Exception as e:
+                logger.error(f"Error claiming ingest jobs: {str(e)}")
+                jobs = []
+            for job in jobs:
+                # Blocks while the pipeline is busy, so claimed jobs do not
+                # pile up in memory
+                await self.parse_queue.put(ScrapedMessage.from_job(job))
+            if not jobs:
+                if fetched:
+                    return
+                await self._wait_for_jobs(idle_seconds or self.batch_linger)
+
+    async def _wait_for_jobs(self, timeout):
+        try:
+            await asyncio.wait_for(self._jobs_recorded.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._jobs_recorded.clear()
+
+    async def _fail_jobs(self, errors):
+        try:
+            await sync_to_async(fail_jobs)(errors)
+        except Exception as e:
+            logger.error(f"Error scheduling retries of ingest jobs: {str(e)}")
+
+    async def _write_posts(self, batch):
+        """
+        Write ``batch`` with ``write_posts``. When the batch fails its posts
+        are written one by one, so only the ones the database rejects are
+        retried later.
+
+        :return: The posts written.
+        """
+        try:
+            await sync_to_async(write_posts)(batch)
+            return batch
+        except Exception as e:
+            if len(batch) == 1:
+                raise
+            logger.error(
+                f"Error saving {len(batch)} products to database, "
+                f"saving them one by one: {str(e)}"
+            )
+
+        written, failed = [], []
+        for item in batch:
+            try:
+                await sync_to_async(write_posts)([item])
+                written.append(item)
+            except Exception as e:
+                logger.error(f"Error saving product to database: {str(e)}")
+                failed.append((item, str(e)))
+        if failed:
+            await self._discard_photos([item for item, _ in failed])
+            await self._fail_jobs(
+                {item.message.job_id: error for item, error in failed}
+            )
+        return written
+
+    async def _discard_photos(self, parsed_posts):
+        # Retried jobs transfer their photos again, these would be orphaned
+        try:
+            await sync_to_async(discard_photos)(
+                [name for parsed in parsed_posts for name in parsed.photos]
+            )
+        except Exception as e:
+            logger.error(f"Error deleting photos of unsaved posts: {str(e)}")
+
+    async def _next_batch(self, queue, size):
+        """
+        Block for one item of ``queue``, then take whatever else arrives
+        within ``batch_linger`` seconds, up to ``size`` items.
+
+        :return: ``(batch, stop)`` where ``stop`` tells the worker to exit
+            once the batch is handled.
+        """
+        batch = []
+        item = await queue.get()
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_linger
+        while len(batch) < size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _parse_worker(self):
+        while True:
+            batch, stop = await self._next_batch(self.parse_queue, self.batch_size)
+            try:
+                if batch:
+                    await self.parse_batch(batch)
+            except Exception as e:
+                logger.error(f"Error parsing {len(batch)} messages: {str(e)}")
+                await self._fail_jobs({item.job_id: str(e) for item in batch})
+            finally:
+                for _ in range(len(batch) + stop):
+                    self.parse_queue.task_done()
+            if stop:
+                return
+
+    async def parse_batch(self, batch):
+        # Keyed by position, message ids repeat across channels
+        captions = {i: item.caption for i, item in enumerate(batch)}
+        results = {
+            i: (True, data)
+            for i, data in (
+                await sync_to_async(self.caption_cache.get_many)(captions)
+            ).items()
+        }
+
+        misses = {}
+        for i, caption in captions.items():
+            if i in results:
+                continue
+            # Templated captions are handled locally without a Gemini call
+            confidence, data = parse_caption(caption)
+            if confidence >= self.min_confidence:
+                results[i] = True, data
+            else:
+                misses[i] = caption
+        if len(misses) == 1:
+            [(i, caption)] = misses.items()
+            parsed = {i: await process_product(caption)}
+        elif misses:
+            parsed = await process_products_batch(misses)
+        else:
+            parsed = {}
+        results.update(parsed)
+
+        await sync_to_async(self.caption_cache.set_many)(
+            {
+                misses[i]: processed_product
+                for i, (status, processed_product) in parsed.items()
+                if status
+            }
+        )
+
+        failed = {}
+        for i, item in enumerate(batch):
+            status, processed_product = results.get(i, (False, {}))
+            if status:
+                await self.image_queue.put(ParsedPost(item, processed_product))
+            else:
+                logger.error(
+                    f"Error processing product: {processed_product}, {item.caption}"
+                )
+                failed[item.job_id] = f"Error processing product: {processed_product}"
+        if failed:
+            await self._fail_jobs(failed)
+
+    async def _image_worker(self):
+        while True:
+            item = await self.image_queue.get()
+            failed = False
+            try:
+                if item is _STOP:
+                    return
+                if self.app is None:
+                    continue  # re-parsing, posts keep their images
+                if await sync_to_async(has_photos)(item.message):
+                    continue  # re-scraped, the post keeps its photos
+                photos = await download_mediagroup_images(
+                    self.app,
+                    item.message.message_id,
+                    item.message.chat_id,
+                    self.media_semaphore,
+                )
+                item.photos = await upload_photos(photos, self.media_semaphore)
+            except Exception as e:
+                # Retried later rather than saved without its photos
+                logger.error(f"Error downloading laptop images: {str(e)}")
+                failed = True
+                await self._fail_jobs(
+                    {item.message.job_id: f"Error transferring photos: {str(e)}"}
+                )
+            finally:
+                if item is not _STOP and not failed:
+                    await self.db_queue.put(item)
+                self.image_queue.task_done()
+
+    async def _db_worker(self):
+        while True:
+            batch, stop = await self._next_batch(self.db_queue, self.write_batch_size)
+            try:
+                if batch:
+                    written = await self._write_posts(batch)
+                    await sync_to_async(complete_jobs)(
+                        [item.message.job_id for item in written]
+                    )
+            except Exception as e:
+                logger.error(
+                    f"Error saving {len(batch)} products to database: {str(e)}"
+                )
+                await self._discard_photos(batch)
+                await self._fail_jobs({item.message.job_id: str(e) for item in batch})
+            finally:
+                for _ in range(len(batch) + stop):
+                    self.db_queue.task_done()
+            if stop:
+                return
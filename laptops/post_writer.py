@@ -0,0 +1,133 @@
+from django.db import transaction
+
+from .listing_cards import refresh_listing_cards
+from .models import LaptopImage, LaptopPost
+from .response_cache import bump_generation
+from .spec_parser import structured_specs
+
+# Columns a scrape never overwrites: identity, creation time, and what is
+# derived from reviews or rendered after the write
+PRESERVED_FIELDS = {
+    "id",
+    "post_id",
+    "channel_id",
+    "created_at",
+    "listing_card",
+    "search_vector",
+}
+PRESERVED_FIELDS.update(LaptopPost.RATING_FIELDS)
+
+UPDATE_FIELDS = [
+    field.name
+    for field in LaptopPost._meta.concrete_fields
+    if field.name not in PRESERVED_FIELDS
+]
+
+
+def write_posts(parsed_posts):
+    """
+    Save a batch of parsed messages and their uploaded photos in one
+    transaction: one upsert for the posts, one query for their ids and one
+    insert for the images, whatever the size of the batch.
+
+    Bulk writes send no signals, so listing cards are rendered here and
+    cached responses invalidated once per batch. The autocomplete index
+    picks the posts up through their ``updated_at``.
+
+    :param parsed_posts: ``ParsedPost`` objects with their uploaded
+        ``photos``.
+    :return: The number of posts written.
+    """
+    # A message seen twice in a batch keeps its last version. Message ids
+    # are only unique within a channel.
+    parsed_posts = list(
+        {
+            (parsed.message.channel.channel_id, parsed.message.message_id): parsed
+            for parsed in parsed_posts
+        }.values()
+    )
+    if not parsed_posts:
+        return 0
+
+    posts = [
+        LaptopPost(
+            **LaptopPost.fit_values({**parsed.data, **structured_specs(parsed.data)}),
+            post_id=parsed.message.message_id,
+            channel_name=parsed.message.channel_name,
+            posted_at=parsed.message.posted_at,
+            channel_id=parsed.message.channel,
+        )
+        for parsed in parsed_posts
+    ]
+    keys = {(post.channel_id_id, post.post_id) for post in posts}
+    in_batch = {
+        "post_id__in": {message_id for _, message_id in keys},
+        "channel_id__in": {channel_id for channel_id, _ in keys},
+    }
+
+    # Re-scraped posts already have their photos, drop the new copies
+    with_images = set(
+        LaptopImage.objects.filter(
+            **{f"post__{lookup}": values for lookup, values in in_batch.items()}
+        ).values_list("post__channel_id", "post__post_id")
+    )
+    images = []
+    unused = []
+    for parsed in parsed_posts:
+        key = (parsed.message.channel.channel_id, parsed.message.message_id)
+        for name in parsed.photos:
+            if key in with_images:
+                unused.append(name)
+            else:
+                images.append((key, LaptopImage(image=name)))
+    discard_photos(unused)
+
+    with transaction.atomic():
+        LaptopPost.objects.bulk_create(
+            posts,
+            update_conflicts=True,
+            unique_fields=["channel_id", "post_id"],
+            update_fields=UPDATE_FIELDS,
+        )
+        ids = {
+            (channel_id, post_id): id
+            for channel_id, post_id, id in LaptopPost.objects.filter(
+                **in_batch
+            ).values_list("channel_id", "post_id", "id")
+            if (channel_id, post_id) in keys
+        }
+        for key, image in images:
+            image.post_id = ids[key]
+        LaptopImage.objects.bulk_create([image for _, image in images])
+        refresh_listing_cards(list(ids.values()))
+
+    bump_generation()
+    return len(posts)
+
+
+def has_photos(message):
+    """
+    Whether the post of ``message`` already has its photos. Re-scraped posts
+    keep them, so they are not downloaded again.
+    """
+    return LaptopImage.objects.filter(
+        post__channel_id=message.channel.channel_id,
+        post__post_id=message.message_id,
+    ).exists()
+
+
+def discard_photos(names):
+    """
+    Delete uploaded photos no ``LaptopImage`` uses. On S3 the names are
+    derived from the telegram media and overwrite each other, so a new copy
+    can have the name of the photo a post already uses.
+    """
+    names = set(names)
+    if not names:
+        return
+    names -= set(
+        LaptopImage.objects.filter(image__in=names).values_list("image", flat=True)
+    )
+    storage = LaptopImage._meta.get_field("image").storage
+    for name in names:
+        storage.delete(name)
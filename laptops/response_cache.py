@@ -0,0 +1,103 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.http import http_date
+
+GENERATION_KEY = "laptops:generation"
+
+# Response headers worth replaying on a cache hit
+CACHED_HEADERS = ("Content-Type", "Vary", "Allow")
+
+
+def get_generation():
+    """
+    Current data generation: the time, in nanoseconds, of the last change to
+    posts, images, reviews or chats. Cached responses of older generations
+    are never served.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = time.time_ns()
+        # Keep the value another process may have set in the meantime
+        if not cache.add(GENERATION_KEY, generation, None):
+            generation = cache.get(GENERATION_KEY, generation)
+    return generation
+
+
+def bump_generation():
+    """
+    Invalidate every cached response. Called on model saves and deletes,
+    and after bulk writes that bypass signals, such as a scrape.
+    """
+    cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+def response_cache_key(request, generation):
+    params = sorted(request.GET.lists())
+    normalized = [
+        request.scheme,
+        request.get_host(),
+        request.path,
+        params,
+        request.META.get("HTTP_ACCEPT", ""),
+    ]
+    digest = hashlib.sha256(json.dumps(normalized).encode("utf-8")).hexdigest()
+    return f"laptops:response:{generation}:{digest}"
+
+
+class CachedResponseMixin:
+    """
+    Serve GET requests of a public read-only view from the cache.
+
+    Entries are keyed by the data generation, host, path and normalized query
+    parameters, so any change to the data makes every older entry unused.
+    Responses carry an ETag and a Last-Modified date (the generation), which
+    ``ConditionalGetMiddleware`` turns into 304s for clients that already
+    have them.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        timeout = settings.RESPONSE_CACHE_SECONDS
+        if request.method != "GET" or timeout <= 0:
+            return super().dispatch(request, *args, **kwargs)
+
+        generation = get_generation()
+        key = response_cache_key(request, generation)
+        cached = cache.get(key)
+        if cached is not None:
+            response = HttpResponse(cached["content"], status=cached["status"])
+            for header, value in cached["headers"].items():
+                response[header] = value
+            return response
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code != 200 or response.streaming:
+            return response
+
+        def store(response):
+            response["ETag"] = '"%s"' % hashlib.sha256(response.content).hexdigest()
+            response["Last-Modified"] = http_date(generation / 1e9)
+            cache.set(
+                key,
+                {
+                    "content": response.content,
+                    "status": response.status_code,
+                    "headers": {
+                        header: response[header]
+                        for header in CACHED_HEADERS + ("ETag", "Last-Modified")
+                        if response.has_header(header)
+                    },
+                },
+                timeout,
+            )
+
+        if hasattr(response, "add_post_render_callback"):
+            response.add_post_render_callback(store)
+        else:
+            # Already rendered, e.g. a listing made of stored cards
+            store(response)
+        return response
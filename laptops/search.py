@@ -0,0 +1,228 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = "laptops_laptoppost_fts"
+
+# Columns covered by the full-text index, most relevant first
+SEARCH_COLUMNS = (
+    "title",
+    "processor",
+    "graphics",
+    "ram",
+    "storage",
+    "display",
+    "status",
+    "color",
+    "battrey",
+    "description",
+)
+
+# bm25 column weights, aligned with SEARCH_COLUMNS
+FTS_WEIGHTS = (10.0, 4.0, 4.0, 4.0, 4.0, 4.0, 2.0, 2.0, 2.0, 1.0)
+
+TOKEN = re.compile(r"\w+")
+
+POSTGRES_INSTALL_SQL = f"""
+CREATE OR REPLACE FUNCTION laptops_laptoppost_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A')
+        || setweight(to_tsvector('simple', concat_ws(' ', NEW.processor,
+            NEW.graphics, NEW.ram, NEW.storage, NEW.display)), 'B')
+        || setweight(to_tsvector('simple', concat_ws(' ', NEW.status,
+            NEW.color, NEW.battrey)), 'C')
+        || setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'D');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS laptops_laptoppost_search_vector ON laptops_laptoppost;
+CREATE TRIGGER laptops_laptoppost_search_vector
+    BEFORE INSERT OR UPDATE OF {", ".join(SEARCH_COLUMNS)} ON laptops_laptoppost
+    FOR EACH ROW EXECUTE FUNCTION laptops_laptoppost_search_vector();
+
+CREATE INDEX IF NOT EXISTS laptops_laptoppost_search_vector_gin
+    ON laptops_laptoppost USING gin (search_vector);
+"""
+
+POSTGRES_REBUILD_SQL = "UPDATE laptops_laptoppost SET title = title"
+
+POSTGRES_UNINSTALL_SQL = """
+DROP TRIGGER IF EXISTS laptops_laptoppost_search_vector ON laptops_laptoppost;
+DROP FUNCTION IF EXISTS laptops_laptoppost_search_vector();
+DROP INDEX IF EXISTS laptops_laptoppost_search_vector_gin;
+"""
+
+_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+_old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+
+# External-content FTS5 table: it stores only the index, the text stays in
+# laptops_laptoppost
+SQLITE_INSTALL_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({_columns}, "
+    "content='laptops_laptoppost', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON laptops_laptoppost BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON laptops_laptoppost BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns})
+        VALUES ('delete', old.id, {_old_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF {_columns} ON laptops_laptoppost BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns})
+        VALUES ('delete', old.id, {_old_values});
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+]
+
+SQLITE_REBUILD_SQL = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+
+SQLITE_UNINSTALL_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def install_search_index(connection, rebuild=True):
+    """
+    Create the full-text index of the connection's database and the triggers
+    keeping it up to date. Safe to run again, e.g. after SQLite rebuilt the
+    posts table during a migration and dropped its triggers.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(POSTGRES_INSTALL_SQL)
+            if rebuild:
+                cursor.execute(POSTGRES_REBUILD_SQL)
+        elif connection.vendor == "sqlite":
+            for statement in SQLITE_INSTALL_SQL:
+                cursor.execute(statement)
+            if rebuild:
+                cursor.execute(SQLITE_REBUILD_SQL)
+
+
+def uninstall_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(POSTGRES_UNINSTALL_SQL)
+        elif connection.vendor == "sqlite":
+            for statement in SQLITE_UNINSTALL_SQL:
+                cursor.execute(statement)
+
+
+def search_tokens(query):
+    return TOKEN.findall(query.lower())
+
+
+class IContainsSearch:
+    """
+    Substring matching with ``LIKE '%x%'``, no index and no ranking. Kept for
+    databases without a full-text index.
+    """
+
+    def search(self, queryset, query, types=()):
+        query_filter_types = {
+            "storage": Q(storage__icontains=query),
+            "processor": Q(processor__icontains=query),
+            "graphics": Q(graphics__icontains=query),
+            "display": Q(display__icontains=query),
+            "ram": Q(ram__icontains=query),
+            "battrey": Q(battrey__icontains=query),
+            "status": Q(status__icontains=query),
+            "color": Q(color__icontains=query),
+            "description": Q(description__icontains=query),
+        }
+
+        query_filter = Q()
+        for token in query.split():
+            query_filter &= Q(title__icontains=token) | Q(description__icontains=token)
+        for query_type in types:
+            if query_type in query_filter_types:
+                query_filter |= query_filter_types.get(query_type)
+
+        return queryset.filter(query_filter)
+
+
+class PostgresSearch:
+    """
+    Ranked search over the GIN-indexed ``search_vector`` column, which a
+    trigger keeps up to date on every insert and update.
+    """
+
+    def search(self, queryset, query, types=()):
+        tokens = search_tokens(query)
+        if not tokens:
+            return queryset.none()
+
+        # Every token must match, as a prefix so partial words still find posts
+        search_query = SearchQuery(
+            " & ".join(f"{token}:*" for token in tokens),
+            search_type="raw",
+            config="simple",
+        )
+        return (
+            queryset.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F("search_vector"), search_query))
+            .order_by("-rank", "-posted_at")
+        )
+
+
+class SQLiteSearch:
+    """
+    Ranked search over an FTS5 table mirroring ``LaptopPost``, which
+    triggers keep up to date on every insert, update and delete.
+    """
+
+    def search(self, queryset, query, types=()):
+        tokens = search_tokens(query)
+        if not tokens:
+            return queryset.none()
+
+        match = " ".join(f'"{token}"*' for token in tokens)
+        weights = ", ".join(str(weight) for weight in FTS_WEIGHTS)
+        # bm25() is lower for better matches
+        rank = RawSQL(
+            f"SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = laptops_laptoppost.id",
+            [match],
+        )
+        return (
+            queryset.filter(
+                id__in=RawSQL(
+                    f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                    [match],
+                )
+            )
+            .annotate(rank=rank)
+            .order_by("rank", "-posted_at")
+        )
+
+
+BACKENDS = {
+    "icontains": IContainsSearch,
+    "postgresql": PostgresSearch,
+    "sqlite": SQLiteSearch,
+}
+
+
+def get_search_backend():
+    """
+    The backend named by ``LAPTOP_SEARCH_BACKEND``, or with "auto" the
+    full-text backend of the database in use.
+    """
+    name = settings.LAPTOP_SEARCH_BACKEND
+    if name == "auto":
+        name = connection.vendor if connection.vendor in BACKENDS else "icontains"
+    return BACKENDS[name]()
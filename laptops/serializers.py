@@ -1,6 +1,8 @@
 from rest_framework import serializers
-from .models import LaptopPost, Review, LaptopImage, TelegramChat, SimilarityScore
+from .models import LaptopPost, Review, LaptopImage, TelegramChat, SimilarNeighbour
 from rest_framework.reverse import reverse
+from django.conf import settings
+from .vector_index import get_vector_index
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -42,30 +44,44 @@ class LaptopSimmilarPostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = LaptopPost
-        exclude = ("channel_id", "description", "created_at", "updated_at", "post_id")
+        exclude = (
+            "channel_id",
+            "description",
+            "created_at",
+            "updated_at",
+            "post_id",
+            "search_vector",
+            "listing_card",
+            "rating_count",
+            "rating_sum",
+            "rating_average",
+        )
 
     def get_channel(self, obj):
         return reverse(
             "chat-detail",
-            args=[obj.channel_id.channel_id],
+            args=[obj.channel_id_id],
             request=self.context.get("request"),
         )
 
 
-class SimilarityScoreSerializer(serializers.ModelSerializer):
+class SimilarNeighbourSerializer(serializers.ModelSerializer):
     similar_laptop = LaptopSimmilarPostSerializer(
-        source="item_b", read_only=True
+        source="neighbour", read_only=True
     )  # Renamed field to `similar_laptop`
 
     class Meta:
-        model = SimilarityScore
+        model = SimilarNeighbour
         fields = ("score", "similar_laptop")  # Updated field names
 
 
 class LaptopPostSerializer(serializers.ModelSerializer):
     reviews = ReviewSerializer(many=True, read_only=True)
-    average_rating = serializers.SerializerMethodField()
+    average_rating = serializers.FloatField(source="rating_average", read_only=True)
+    review_count = serializers.IntegerField(source="rating_count", read_only=True)
     images = LaptopImageSerializer(many=True, read_only=True)
+    first_image = serializers.SerializerMethodField()
+    image_count = serializers.SerializerMethodField()
     channel = serializers.SerializerMethodField()
     simmilar_items = serializers.SerializerMethodField()
 
@@ -83,47 +99,78 @@ class LaptopPostSerializer(serializers.ModelSerializer):
             "status",
             "description",
             "price",
+            "price_amount",
+            "currency",
+            "ram_gb",
+            "storage_gb",
+            "storage_type",
+            "cpu_vendor",
+            "cpu_tier",
+            "cpu_generation",
+            "screen_inches",
             "channel_name",
             "posted_at",
             "reviews",
             "average_rating",
+            "review_count",
             "images",
+            "first_image",
+            "image_count",
             "color",
             "channel",
             "simmilar_items",
         )
 
-    def get_average_rating(self, obj):
-        reviews = obj.reviews.all()
-        if reviews.exists():
-            return sum(review.rating for review in reviews) / reviews.count()
-        return 0
+    def get_first_image(self, obj):
+        images = obj.images.all()
+        if not images:
+            return None
+        return LaptopImageSerializer(images[0], context=self.context).data["image"]
+
+    def get_image_count(self, obj):
+        return len(obj.images.all())
 
     def get_channel(self, obj):
+        # The foreign key value is the channel id, no need to load the chat
         return reverse(
             "chat-detail",
-            args=[obj.channel_id.channel_id],
+            args=[obj.channel_id_id],
             request=self.context.get("request"),
         )
 
     def get_simmilar_items(self, obj):
-        item_id = obj.id
-        similar_items = SimilarityScore.objects.filter(item_a_id=item_id).order_by(
-            "-score"
-        )[:10]
-        # Serialize the SimilarityScore objects for the top 10 similar items
-        return SimilarityScoreSerializer(similar_items, many=True).data
-
-    def to_representation(self, instance):
-        # Call the parent method to get the initial representation
-        representation = super().to_representation(instance)
-
-        # Check if this is a single item retrieval
-        if self.context.get("is_single_retrieval", False):
-            # Keep `reviews` in the output
-            return representation
-        else:
-            # Exclude `reviews` from the output
-            representation.pop("reviews", None)
-            representation.pop("simmilar_items", None)
-            return representation
+        if settings.SIMILARITY_BACKEND == "ann":
+            index = get_vector_index()
+            if index is not None and obj.id in index:
+                return self.get_indexed_simmilar_items(index, obj)
+
+        # Ranked neighbour list of this post, a single (item, rank) range scan
+        similar_items = obj.neighbours.all()[:10]
+        return SimilarNeighbourSerializer(
+            similar_items, many=True, context=self.context
+        ).data
+
+    def get_indexed_simmilar_items(self, index, obj):
+        results = index.search(obj.id, 10)
+        posts = LaptopPost.objects.prefetch_related("images").in_bulk(
+            [item_id for item_id, _ in results]
+        )
+        return [
+            {
+                "score": score,
+                "similar_laptop": LaptopSimmilarPostSerializer(
+                    posts[item_id], context=self.context
+                ).data,
+            }
+            for item_id, score in results
+            if item_id in posts
+        ]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Reviews and similar items are only shown on the detail page, so
+        # listings never compute them
+        if not self.context.get("is_single_retrieval", False):
+            fields.pop("reviews", None)
+            fields.pop("simmilar_items", None)
+        return fields
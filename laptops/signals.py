@@ -0,0 +1,56 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .autocomplete import get_autocomplete_index
+from .listing_cards import refresh_listing_cards
+from .models import LaptopImage, LaptopPost, Review, TelegramChat
+from .response_cache import bump_generation
+
+
+@receiver(post_save, sender=LaptopPost)
+def index_saved_post(sender, instance, **kwargs):
+    get_autocomplete_index().post_saved(instance)
+
+
+@receiver(post_delete, sender=LaptopPost)
+def unindex_deleted_post(sender, instance, **kwargs):
+    get_autocomplete_index().post_deleted(instance)
+
+
+@receiver(post_save, sender=LaptopPost)
+def refresh_saved_post_card(sender, instance, **kwargs):
+    refresh_listing_cards([instance.id])
+
+
+@receiver(post_save, sender=LaptopImage)
+@receiver(post_delete, sender=LaptopImage)
+def refresh_image_post_card(sender, instance, **kwargs):
+    # The card shows the first image and the image count
+    refresh_listing_cards([instance.post_id])
+
+
+@receiver(pre_delete, sender=Review)
+def remove_deleted_rating(sender, instance, **kwargs):
+    # Deletes run in a transaction, also when cascading from a post or user
+    LaptopPost.objects.filter(pk=instance.product_id).add_ratings(
+        -1, -instance.rating
+    )
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def refresh_reviewed_post_card(sender, instance, **kwargs):
+    # The card shows the average rating and the review count
+    refresh_listing_cards([instance.product_id])
+
+
+@receiver(post_save, sender=LaptopPost)
+@receiver(post_delete, sender=LaptopPost)
+@receiver(post_save, sender=LaptopImage)
+@receiver(post_delete, sender=LaptopImage)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=TelegramChat)
+@receiver(post_delete, sender=TelegramChat)
+def invalidate_cached_responses(sender, **kwargs):
+    bump_generation()
@@ -0,0 +1,119 @@
+import numpy as np
+from rapidfuzz import fuzz, process
+
+# Weight of each attribute in the combined similarity score
+WEIGHTS = {
+    "title": 0.2,
+    "storage": 0.3,
+    "processor": 0.3,
+    "ram": 0.2,
+}
+
+
+class SimilarityEngine:
+    """
+    Vectorized similarity between laptop posts.
+
+    Each attribute column is normalized once and de-duplicated, so
+    ``rapidfuzz.process.cdist`` only compares distinct values (RAM and
+    storage have a handful of them). Scores are computed a block of rows at
+    a time, which keeps memory at ``chunk_size * n`` instead of ``n * n``,
+    and only the top-K per row is kept using ``np.argpartition``.
+    """
+
+    def __init__(self, ids, columns, weights=None, workers=-1):
+        """
+        :param ids: Post ids, one per row, in ascending order.
+        :param columns: Mapping of attribute name to a list of strings aligned
+            with ``ids``.
+        :param workers: Threads used by ``cdist`` (-1 uses every core).
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.weights = weights or WEIGHTS
+        self.workers = workers
+
+        self.columns = {}
+        for name in self.weights:
+            values = [(value or "").lower() for value in columns[name]]
+            uniques, inverse = np.unique(
+                np.asarray(values, dtype=object), return_inverse=True
+            )
+            self.columns[name] = (list(uniques), inverse)
+
+    @classmethod
+    def from_queryset(cls, queryset, **kwargs):
+        rows = list(queryset.order_by("id").values_list("id", *WEIGHTS))
+        ids = [row[0] for row in rows]
+        columns = {name: [row[i + 1] for row in rows] for i, name in enumerate(WEIGHTS)}
+        return cls(ids, columns, **kwargs)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def score_rows(self, rows):
+        """
+        Weighted similarity (0..1) of the given row positions against every row.
+
+        :return: float32 array of shape ``(len(rows), len(self))``.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = np.zeros((len(rows), len(self)), dtype=np.float32)
+
+        for name, weight in self.weights.items():
+            uniques, inverse = self.columns[name]
+            query_values = np.unique(inverse[rows])
+            matrix = process.cdist(
+                [uniques[i] for i in query_values],
+                uniques,
+                scorer=fuzz.ratio,
+                dtype=np.uint8,
+                workers=self.workers,
+            )
+            # Map every query row to its unique value's row in `matrix`
+            query_rows = np.searchsorted(query_values, inverse[rows])
+            scores += matrix[query_rows][:, inverse] * np.float32(weight / 100)
+
+        return scores
+
+    def top_k(self, k, rows=None, chunk_size=512, min_score=0.0):
+        """
+        Yield ``(item_id, [(neighbour_id, score), ...])`` for every requested
+        row, best neighbour first.
+
+        :param rows: Row positions to compute, defaults to every row.
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        k = min(k, len(self) - 1)
+        if k <= 0:
+            return
+
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            scores = self.score_rows(chunk)
+            # An item is not its own neighbour
+            scores[np.arange(len(chunk)), chunk] = -1
+
+            best = np.argpartition(scores, -k, axis=1)[:, -k:]
+            best_scores = np.take_along_axis(scores, best, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+            for row, neighbours, neighbour_scores in zip(chunk, best, best_scores):
+                yield int(self.ids[row]), [
+                    (int(self.ids[neighbour]), float(score))
+                    for neighbour, score in zip(neighbours, neighbour_scores)
+                    if score >= min_score
+                ]
+
+    def positions(self, item_ids):
+        """
+        Row positions of the given post ids. ``self.ids`` must be sorted, as
+        ``from_queryset`` does. Ids missing from the engine, e.g. posts
+        created after it was built, are skipped.
+        """
+        item_ids = np.asarray(sorted(item_ids), dtype=np.int64)
+        positions = np.searchsorted(self.ids, item_ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == item_ids[found]
+        return positions[found]
@@ -0,0 +1,425 @@
+import re
+import unicodedata
+
+# Share of the confidence score each field contributes when it is found
+FIELD_WEIGHTS = {
+    "title": 0.1,
+    "processor": 0.25,
+    "ram": 0.2,
+    "storage": 0.2,
+    "price": 0.15,
+    "graphics": 0.05,
+    "display": 0.05,
+}
+
+BRANDS = (
+    "hp",
+    "dell",
+    "lenovo",
+    "thinkpad",
+    "asus",
+    "acer",
+    "apple",
+    "macbook",
+    "msi",
+    "microsoft",
+    "surface",
+    "toshiba",
+    "samsung",
+    "razer",
+    "alienware",
+    "huawei",
+    "xiaomi",
+    "lg",
+    "gigabyte",
+    "fujitsu",
+    "panasonic",
+    "chromebook",
+)
+
+COLORS = (
+    "space gray",
+    "space grey",
+    "rose gold",
+    "midnight",
+    "silver",
+    "black",
+    "white",
+    "gray",
+    "grey",
+    "blue",
+    "gold",
+    "red",
+    "green",
+    "pink",
+    "purple",
+    "beige",
+)
+
+STATUSES = (
+    ("refurbished", "Refurbished"),
+    ("open box", "Open box"),
+    ("brand new", "New"),
+    ("slightly used", "Used"),
+    ("used", "Used"),
+    ("new", "New"),
+)
+
+BRAND_PATTERN = re.compile(r"\b(%s)\b" % "|".join(BRANDS), re.I)
+COLOR_PATTERN = re.compile(r"\b(%s)\b" % "|".join(COLORS), re.I)
+STATUS_PATTERN = re.compile(
+    r"\b(%s)\b" % "|".join(status for status, _ in STATUSES), re.I
+)
+
+RAM_PATTERN = re.compile(
+    r"\b(?:ram|memory)\b\s*[:=\-]?\s*(\d{1,3})\s*gb\b(?:\s*(ddr\d\w?|lpddr\d\w?))?"
+    r"|\b(\d{1,3})\s*gb\s*(?:(ddr\d\w?|lpddr\d\w?)\s*)?(?:ram|memory)\b"
+    r"|\b(\d{1,3})\s*gb\s*(ddr\d\w?|lpddr\d\w?)\b",
+    re.I,
+)
+# Bare "16GB" in templates like "Core i7 / 16GB / 512GB SSD"
+RAM_FALLBACK_PATTERN = re.compile(
+    r"\b(4|8|12|16|24|32|64)\s*gb\b(?!\s*(?:pcie\s*|nvme\s*|m\.2\s*)*(?:ssd|hdd|emmc|rom|storage))",
+    re.I,
+)
+GPU_NAME = (
+    r"(?:nvidia\s*)?(?:geforce\s*)?(?:rtx|gtx|mx)\s*[-]?\s*a?\d{3,4}(?:\s*ti)?"
+    r"|quadro\s*\w+|radeon\s*(?:rx\s*)?\w+"
+)
+# Graphics memory, e.g. "RTX 3060 6GB" or "4GB GDDR6", which must not be
+# taken for the system RAM
+VRAM_PATTERN = re.compile(
+    r"\b(?:%s)[ \t]*[(\-]?[ \t]*\d{1,2}[ \t]*gb\b(?![ \t]*(?:ram|memory)\b)"
+    r"|\b\d{1,2}[ \t]*gb[ \t]*(?:gddr\d\w?|vram|dedicated|graphics|gpu)\b"
+    r"|\b(?:graphics|gpu|video|vram)[ \t]*(?:memory|ram)?[ \t]*[:=\-]?[ \t]*"
+    r"\d{1,2}[ \t]*gb\b(?![ \t]*(?:ram|memory)\b)" % GPU_NAME,
+    re.I,
+)
+STORAGE_PATTERN = re.compile(
+    r"\b(\d{1,4}(?:\.\d)?)\s*(gb|tb)\s*(?:pcie\s*|nvme\s*|m\.2\s*)*(ssd|hdd|emmc)\b"
+    r"|\b(ssd|hdd|emmc|storage)\b\s*[:=\-]?\s*(\d{1,4}(?:\.\d)?)\s*(gb|tb)\b",
+    re.I,
+)
+INTEL_PATTERN = re.compile(
+    r"\b(?:intel\s*)?core\s*[-]?\s*(i[3579]|ultra\s*[579])"
+    r"(?:\s*[-]?\s*(\d{4,5}[a-z]{0,2}\d?|\d{3}[a-z]))?\b",
+    re.I,
+)
+BARE_INTEL_PATTERN = re.compile(r"\b(i[3579])\s*[-]?\s*(\d{4,5}[a-z]{0,2}\d?)?\b", re.I)
+GENERATION_PATTERN = re.compile(
+    r"\b(\d{1,2})\s*(?:st|nd|rd|th)?\s*gen(?:eration)?\b", re.I
+)
+AMD_PATTERN = re.compile(
+    r"\b(?:amd\s*)?ryzen\s*([3579])(?:\s*(?:pro\s*)?(\d{4}[a-z]{0,2}))?\b", re.I
+)
+APPLE_PATTERN = re.compile(r"\b(m[1-4])(?:\s*(pro|max|ultra))?\b", re.I)
+APPLE_BRAND_PATTERN = re.compile(r"\b(apple|macbook|imac)\b", re.I)
+OTHER_CPU_PATTERN = re.compile(
+    r"\b(celeron|pentium|xeon|athlon)\s*(?:[a-z]?\d{3,5}[a-z]{0,2})?\b", re.I
+)
+GPU_PATTERN = re.compile(
+    r"\b(?:nvidia\s*)?(?:geforce\s*)?(rtx|gtx|mx)\s*[-]?\s*(a?\d{3,4})(\s*ti)?\b"
+    r"|\b(quadro\s*\w+|radeon\s*(?:rx\s*)?\w+|iris\s*xe|uhd\s*graphics\s*\d*|intel\s*hd\s*graphics\s*\d*)",
+    re.I,
+)
+DISPLAY_PATTERN = re.compile(
+    r"\b(1[0-8](?:\.\d)?)\s*(?:\"|''|”|inch(?:es)?\b|-inch\b|in\b)", re.I
+)
+RESOLUTION_PATTERN = re.compile(
+    r"\b(fhd\+?|full\s*hd|uhd|4k|qhd\+?|2k|hd\+?|oled|ips|retina|touch(?:screen)?|\d{2,3}\s*hz)\b",
+    re.I,
+)
+PRICE_PATTERN = re.compile(
+    r"(?:\b(?:price|birr|br|etb)|\$)[ \t]*[:=\-]?[ \t]*(\d{1,3}(?:[,. ]\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)[ \t]*(k)?\b"
+    r"|\b(\d{1,3}(?:[,. ]\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)[ \t]*(k)?[ \t]*(birr|br|etb|\$)"
+    r"|\b(\d{2,3}(?:\.\d)?)[ \t]*(k)\b",
+    re.I,
+)
+BATTERY_PATTERN = re.compile(
+    r"\b(\d{1,2}(?:\s*-\s*\d{1,2})?)\s*(?:\+\s*)?(?:hrs?|hours?)\b", re.I
+)
+
+
+def _clean(text):
+    return unicodedata.normalize("NFKC", text or "")
+
+
+def parse_ram(text):
+    text = VRAM_PATTERN.sub(" ", _clean(text))
+    match = RAM_PATTERN.search(text)
+    if not match:
+        match = RAM_FALLBACK_PATTERN.search(text)
+        return f"{int(match.group(1))}GB" if match else None
+    size = match.group(1) or match.group(3) or match.group(5)
+    kind = match.group(2) or match.group(4) or match.group(6)
+    return f"{int(size)}GB {kind.upper()}" if kind else f"{int(size)}GB"
+
+
+def parse_storage(text):
+    match = STORAGE_PATTERN.search(_clean(text))
+    if not match:
+        return None
+    if match.group(1):
+        size, unit, kind = match.group(1), match.group(2), match.group(3)
+    else:
+        kind, size, unit = match.group(4), match.group(5), match.group(6)
+    kind = "" if kind.lower() == "storage" else f" {kind.upper()}"
+    return f"{size}{unit.upper()}{kind}"
+
+
+def parse_processor(text):
+    text = _clean(text)
+    generation = GENERATION_PATTERN.search(text)
+    generation = f" {int(generation.group(1))}th Gen" if generation else ""
+
+    match = INTEL_PATTERN.search(text) or BARE_INTEL_PATTERN.search(text)
+    if match:
+        family = " ".join(match.group(1).split()).title().replace("I", "i", 1)
+        model = f"-{match.group(2).upper()}" if match.group(2) else ""
+        return f"Intel Core {family}{model}{generation}"
+
+    match = AMD_PATTERN.search(text)
+    if match:
+        model = f" {match.group(2).upper()}" if match.group(2) else ""
+        return f"AMD Ryzen {match.group(1)}{model}"
+
+    match = APPLE_BRAND_PATTERN.search(text) and APPLE_PATTERN.search(text)
+    if match:
+        chip, tier = match.group(1).upper(), match.group(2)
+        return f"Apple {chip} {tier.title()}" if tier else f"Apple {chip}"
+
+    match = OTHER_CPU_PATTERN.search(text)
+    if match:
+        return f"Intel {match.group(0).strip().title()}{generation}"
+    return None
+
+
+def parse_graphics(text):
+    match = GPU_PATTERN.search(_clean(text))
+    if not match:
+        return None
+    if match.group(1):
+        series = match.group(1).upper()
+        suffix = " Ti" if match.group(3) else ""
+        return f"NVIDIA {series} {match.group(2).upper()}{suffix}"
+    return " ".join(match.group(4).split()).title()
+
+
+def parse_display(text):
+    text = _clean(text)
+    match = DISPLAY_PATTERN.search(text)
+    if not match:
+        return None
+    extras = []
+    for extra in RESOLUTION_PATTERN.findall(text):
+        extra = " ".join(extra.split()).upper()
+        if extra not in extras:
+            extras.append(extra)
+    return " ".join([f"{match.group(1)}-inch"] + extras)
+
+
+def price_amount(text):
+    """
+    :return: ``(amount, currency)`` with currency "USD" or "ETB", or
+        ``(None, None)`` when no price is found.
+    """
+    text = _clean(text)
+    match = PRICE_PATTERN.search(text)
+    if not match:
+        return None, None
+    amount = match.group(1) or match.group(3) or match.group(6)
+    value = float(re.sub(r"[,.\s](?=\d{3}\b)", "", amount))
+    if match.group(2) or match.group(4) or match.group(7):
+        value *= 1000
+    if value < 100:
+        return None, None
+    if "$" in text[match.start() : match.end() + 1]:
+        return value, "USD"
+    return value, "ETB"
+
+
+def parse_price(text):
+    value, currency = price_amount(text)
+    if value is None:
+        return None
+    if currency == "USD":
+        return f"${value:,.0f}"
+    return f"{value:,.0f} Birr"
+
+
+def parse_color(text):
+    match = COLOR_PATTERN.search(_clean(text))
+    return match.group(1).title() if match else None
+
+
+def parse_status(text):
+    match = STATUS_PATTERN.search(_clean(text))
+    if not match:
+        return None
+    return dict(STATUSES)[match.group(1).lower()]
+
+
+def parse_battery(text):
+    match = BATTERY_PATTERN.search(_clean(text))
+    return f"{match.group(1)} hours backup" if match else None
+
+
+def parse_title(text):
+    lines = [line.strip(" *-•#\t") for line in _clean(text).splitlines()]
+    lines = [line for line in lines if line]
+    for line in lines:
+        if BRAND_PATTERN.search(line):
+            return line[:255], True
+    return (lines[0][:255], False) if lines else ("", False)
+
+
+def ram_gb(text):
+    ram = parse_ram(text)
+    return int(ram.split("GB")[0]) if ram else None
+
+
+def storage_specs(text):
+    """
+    :return: ``(size_gb, kind)``, e.g. ``(1024, "SSD")``.
+    """
+    storage = parse_storage(text)
+    if not storage:
+        return None, None
+    match = re.match(r"([\d.]+)(GB|TB)\s*(\w*)", storage)
+    size = float(match.group(1)) * (1024 if match.group(2) == "TB" else 1)
+    return int(size), match.group(3) or None
+
+
+def _intel_generation(model):
+    # 10th gen onwards starts with the two-digit generation, e.g. 10510U,
+    # 1165G7 and 1235U; earlier ones with a single digit, e.g. 8350U
+    digits = re.match(r"\d+", model).group(0)
+    if len(digits) == 5 or (len(digits) == 4 and digits.startswith("1")):
+        return int(digits[:2])
+    return int(digits[0]) if len(digits) == 4 else None
+
+
+def cpu_specs(text):
+    """
+    :return: ``(vendor, tier, generation)``, e.g. ``("intel", 7, 11)``. Tier
+        follows the i3/i5/i7/i9 scale so vendors are comparable.
+    """
+    text = _clean(text)
+    generation = GENERATION_PATTERN.search(text)
+    generation = int(generation.group(1)) if generation else None
+
+    match = INTEL_PATTERN.search(text) or BARE_INTEL_PATTERN.search(text)
+    if match:
+        tier = int(match.group(1)[-1])
+        if match.group(2) and not generation:
+            generation = _intel_generation(match.group(2))
+        return "intel", tier, generation
+
+    match = AMD_PATTERN.search(text)
+    if match:
+        model = match.group(2)
+        return "amd", int(match.group(1)), int(model[0]) if model else generation
+
+    match = APPLE_BRAND_PATTERN.search(text) and APPLE_PATTERN.search(text)
+    if match:
+        tier = 9 if match.group(2) else 7
+        return "apple", tier, int(match.group(1)[1])
+
+    match = OTHER_CPU_PATTERN.search(text)
+    if match:
+        family = match.group(1).lower()
+        vendor = "amd" if family == "athlon" else "intel"
+        return vendor, 8 if family == "xeon" else 1, generation
+    return None, None, None
+
+
+def gpu_class(text):
+    """
+    Rough GPU performance class: 0 unknown, 1 integrated, 2 entry level
+    dedicated (MX), 3 mid range (GTX, Quadro, Radeon RX), 4 RTX.
+    """
+    graphics = parse_graphics(text)
+    if not graphics:
+        return 0
+    graphics = graphics.lower()
+    if "rtx" in graphics:
+        return 4
+    if "gtx" in graphics or "quadro" in graphics or "radeon rx" in graphics:
+        return 3
+    if "mx" in graphics:
+        return 2
+    return 1
+
+
+def screen_inches(text):
+    match = DISPLAY_PATTERN.search(_clean(text))
+    return float(match.group(1)) if match else None
+
+
+def structured_specs(post):
+    """
+    Numeric and normalized values of a post's free-text specs, keyed by the
+    ``LaptopPost`` column they are stored in. Unknown values are ``None``.
+
+    :param post: Mapping with the ``LaptopPost`` text fields.
+    """
+    price, currency = price_amount(post.get("price"))
+    storage, storage_type = storage_specs(post.get("storage"))
+    cpu_vendor, cpu_tier, cpu_generation = cpu_specs(post.get("processor"))
+    return {
+        "price_amount": None if price is None else round(price),
+        "currency": currency,
+        "ram_gb": ram_gb(post.get("ram")),
+        "storage_gb": storage,
+        "storage_type": storage_type,
+        "cpu_vendor": cpu_vendor,
+        "cpu_tier": cpu_tier,
+        "cpu_generation": cpu_generation,
+        "screen_inches": screen_inches(post.get("display")),
+    }
+
+
+PARSERS = {
+    "storage": parse_storage,
+    "processor": parse_processor,
+    "graphics": parse_graphics,
+    "display": parse_display,
+    "ram": parse_ram,
+    "battrey": parse_battery,
+    "status": parse_status,
+    "color": parse_color,
+    "price": parse_price,
+}
+
+
+def canonical(field, value):
+    """
+    Canonical form of a field value, used to compare two extractions
+    (e.g. "16 GB DDR4 RAM" and "16GB DDR4" are the same RAM).
+    """
+    if value is None:
+        return None
+    parser = PARSERS.get(field)
+    parsed = parser(value) if parser else None
+    return (parsed or " ".join(str(value).split())).casefold()
+
+
+def parse_caption(caption):
+    """
+    Extract laptop specs from a caption without calling the LLM.
+
+    :return: ``(confidence, data)`` where ``data`` has the keys checked by
+        ``verify_laptop_dict`` and ``confidence`` is the weighted share of the
+        important fields (see ``FIELD_WEIGHTS``) that were found.
+    """
+    title, has_brand = parse_title(caption)
+    data = {"title": title}
+    data.update({field: parser(caption) for field, parser in PARSERS.items()})
+    data["description"] = caption.strip() if caption else None
+
+    confidence = sum(
+        weight
+        for field, weight in FIELD_WEIGHTS.items()
+        if (has_brand if field == "title" else data.get(field))
+    )
+    return round(confidence, 2), data
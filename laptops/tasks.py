@@ -1,21 +1,20 @@
 import asyncio
 from pyrogram import Client
 from django.conf import settings
-from django.utils import timezone
-from .models import LaptopPost, TelegramChat, LaptopImage
-from pyrogram.errors import FloodWait
+from .fetch_scheduler import due_channels
+from .models import LaptopImage
+from .gemini import get_key_pool
+from .response_cache import bump_generation
 from typing import List
 import re
 import json
-import google.generativeai as genai
+import tempfile
 import time
 from collections import deque
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
 from asgiref.sync import sync_to_async
-from itertools import cycle
-from django.core.files.base import ContentFile
+from django.core.files import File
+from django.core.management import call_command
 import logging
 
 # Get the logger for your app
@@ -53,31 +52,16 @@ If any details are missing in the input, use null or an empty string. Ensure the
 }
 """
 
-
-class AsyncRateLimiter:
-    def __init__(self, max_requests, window_seconds):
-        self.max_requests = max_requests
-        self.window_seconds = window_seconds
-        self.request_times = deque()
-
-    async def check_and_wait(self):
-        current_time = time.time()
-
-        # Remove outdated request timestamps
-        while (
-            self.request_times
-            and current_time - self.request_times[0] > self.window_seconds
-        ):
-            self.request_times.popleft()
-
-        # Check if the rate limit is exceeded
-        if len(self.request_times) >= self.max_requests:
-            wait_time = self.window_seconds - (current_time - self.request_times[0])
-            if wait_time > 0:
-                await asyncio.sleep(wait_time)
-
-        # Log the current request
-        self.request_times.append(time.time())
+ai_batch_system_prompt = (
+    ai_system_prompt
+    + """
+You will receive several posts at once. Each post starts with a line of the form
+"### message_id: <id>" followed by the post text.
+Return a single JSON array with one object per post, in any order. Every object must
+contain a "message_id" key holding the integer id of the post it was parsed from,
+in addition to the keys above. Return only the JSON array.
+"""
+)
 
 
 class RateLimiter:
@@ -153,32 +137,20 @@ def get_json_response(data):
     return match[0] if match else {}
 
 
-key_pool = cycle(settings.GEMENI_API_KEY)
+def get_json_array_response(data):
+    start, end = data.find("["), data.rfind("]")
+    return data[start : end + 1] if start != -1 and end > start else "[]"
 
 
 async def process_product(product):
-    api_key = next(key_pool)
-
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(
-        "gemini-1.5-flash", system_instruction=ai_system_prompt
-    )
     if not product:
         return False, {}
 
     status, verified_product = False, {}
-    rate_limiter = AsyncRateLimiter(max_requests=42, window_seconds=60)  # 15 RPM
-
-    try:
-        # Wait for rate limiter
-        await rate_limiter.check_and_wait()
-    except Exception as e:
-        logger.error(f"Rate limiter failed: {str(e)}")
-        return status, verified_product  # Return failure in case of rate limiter issue
 
     try:
-        # Generate content with genai
-        response = await model.generate_content_async(product)
+        # Generate content with genai on whichever key has budget left
+        response = await get_key_pool().generate(product, ai_system_prompt)
         json_response = get_json_response(response.text)
 
         # Parse and verify the response
@@ -192,169 +164,189 @@ async def process_product(product):
     return status, verified_product
 
 
-@sync_to_async
-def get_last_message_from_db(channel_id):
-    return LaptopPost.objects.filter(channel_id=channel_id).order_by("-post_id").first()
+async def process_products_batch(products):
+    """
+    Parse several captions with a single LLM request.
+
+    :param products: Mapping of an integer key, unique within the batch, to
+        caption. Message ids are not, they repeat across channels. The key
+        is sent as the ``message_id`` tag of each caption.
+    :return: Mapping of the same keys to ``(status, verified_product)``.
+        Captions missing from the answer or failing ``verify_laptop_dict``
+        are retried one at a time with ``process_product``.
+    """
+    products = {key: text for key, text in products.items() if text}
+    if len(products) <= 1:
+        return {key: await process_product(text) for key, text in products.items()}
 
+    results = {}
+    prompt = "\n\n".join(
+        f"### message_id: {key}\n{text}" for key, text in products.items()
+    )
+
+    try:
+        response = await get_key_pool().generate(prompt, ai_batch_system_prompt)
+        parsed = json.loads(get_json_array_response(response.text))
+        for item in parsed if isinstance(parsed, list) else []:
+            if not isinstance(item, dict):
+                continue
+            try:
+                key = int(item.pop("message_id"))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if key not in products or key in results:
+                continue
+            status, verified_product = verify_laptop_dict(item)
+            if status:
+                results[key] = status, verified_product
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse batch JSON response: {str(e)}")
+    except Exception as e:
+        logger.error(f"Error in genai batch processing: {str(e)}")
+
+    retries = [key for key in products if key not in results]
+    if retries:
+        logger.info(f"Retrying {len(retries)} of {len(products)} captions one by one")
+        retried = await asyncio.gather(
+            *(process_product(products[key]) for key in retries)
+        )
+        results.update(zip(retries, retried))
+
+    return results
+
+
+class MediaTransferError(Exception):
+    """
+    Some photos of a post could not be downloaded or uploaded. The post is
+    retried later rather than saved without them.
+    """
 
-@sync_to_async
-def get_channel_list():
-    return list(TelegramChat.objects.all())
+
+def media_semaphore():
+    """Caps the photo downloads and uploads running at once."""
+    return asyncio.Semaphore(settings.SCRAPER_MEDIA_CONCURRENCY)
+
+
+async def download_photo(app: Client, media, channel_id, semaphore) -> File:
+    """
+    Stream a photo into a temporary file, kept in memory up to
+    ``SCRAPER_MEDIA_SPOOL_BYTES`` and on disk beyond.
+    """
+    async with semaphore:
+        spooled = tempfile.SpooledTemporaryFile(
+            max_size=settings.SCRAPER_MEDIA_SPOOL_BYTES
+        )
+        try:
+            async for chunk in app.stream_media(media):
+                spooled.write(chunk)
+        except BaseException:
+            spooled.close()
+            raise
+        spooled.seek(0)
+        # Create a unique filename for the photo
+        return File(spooled, name=f"telegram_photo_{media.id}{channel_id}.jpg")
 
 
 async def download_mediagroup_images(
-    app: Client, message_id: str | int, channel_id: str | int
-) -> List[ContentFile]:
-    media_group_photos = []
+    app: Client, message_id: str | int, channel_id: str | int, semaphore=None
+) -> List[File]:
+    """
+    Download the photos of a media group concurrently.
 
+    :param semaphore: Shared by every download of the scrape, see
+        ``media_semaphore()``.
+    :return: Open files, closed by ``upload_photos``. Messages outside of a
+        media group have none.
+    :raise MediaTransferError: When any photo failed to download.
+    """
+    semaphore = semaphore or media_semaphore()
     try:
         media_group = await app.get_media_group(channel_id, message_id)
-        for media in media_group:
-            if media.photo:
-                try:
-                    file_bytes = await app.download_media(
-                        media.photo.file_id, in_memory=True
-                    )
-                    file_bytes.seek(0)
-                    media_message_id = media.id
-
-                    # Create a unique filename for the photo
-                    file_name = f"telegram_photo_{media_message_id}{channel_id}.jpg"
-
-                    # Save the file as a Django FileField
-
-                    profile_photo_file = ContentFile(file_bytes.read(), name=file_name)
-                    media_group_photos.append(profile_photo_file)
-                except Exception as e:
-                    print(f"Error downloading photo: {str(e)}")
-    except Exception as e:
+    except ValueError as e:
+        # Raised for messages that do not belong to a media group
         logger.error(f"Error downloading media group images: {str(e)}")
-
+        return []
+    except Exception as e:
+        raise MediaTransferError(f"Error fetching media group: {str(e)}") from e
+
+    results = await asyncio.gather(
+        *(
+            download_photo(app, media, channel_id, semaphore)
+            for media in media_group
+            if media.photo
+        ),
+        return_exceptions=True,
+    )
+    media_group_photos = [r for r in results if not isinstance(r, Exception)]
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        for photo in media_group_photos:
+            photo.close()
+        raise MediaTransferError(
+            f"{len(errors)} of {len(results)} photos failed to download: "
+            f"{str(errors[0])}"
+        )
     return media_group_photos
 
 
-async def scrape_laptops_async():
-    logger.info("Starting to scrape telegram channels")
-    app = Client(
+async def upload_photos(photos: List[File], semaphore=None) -> List[str]:
+    """
+    Save downloaded photos to the ``LaptopImage.image`` storage
+    concurrently, each in its own thread, and close them.
+
+    :return: The stored names, in the order of ``photos``.
+    :raise MediaTransferError: When any photo failed to upload. The photos
+        stored meanwhile are deleted.
+    """
+    semaphore = semaphore or media_semaphore()
+    field = LaptopImage._meta.get_field("image")
+    save = sync_to_async(field.storage.save, thread_sensitive=False)
+
+    async def upload(photo):
+        async with semaphore:
+            try:
+                return await save(field.generate_filename(None, photo.name), photo)
+            finally:
+                photo.close()
+
+    results = await asyncio.gather(
+        *(upload(photo) for photo in photos), return_exceptions=True
+    )
+    names = [r for r in results if not isinstance(r, Exception)]
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        delete = sync_to_async(field.storage.delete, thread_sensitive=False)
+        await asyncio.gather(*(delete(name) for name in names), return_exceptions=True)
+        raise MediaTransferError(
+            f"{len(errors)} of {len(results)} photos failed to upload: "
+            f"{str(errors[0])}"
+        )
+    return names
+
+
+def telegram_client():
+    return Client(
         "LaptopScraper",
         api_id=settings.TELEGRAM_API_ID,
         api_hash=settings.TELEGRAM_API_HASH,
         session_string=settings.TELEGRAM_SESSIONS,
     )
-    # channels = settings.TELEGRAM_CHANNELS
-    channels = await get_channel_list()
 
-    max_messages = 20
+
+async def scrape_laptops_async(should_stop=None):
+    from .pipeline import ScrapePipeline
+
+    logger.info("Starting to scrape telegram channels")
+    app = telegram_client()
+    # channels = settings.TELEGRAM_CHANNELS
+    # Only the channels due for a poll, see laptops.fetch_scheduler
+    channels = await sync_to_async(due_channels)()
+    logger.info(f"{len(channels)} channels due for a poll")
 
     try:
         async with app:
-            for channel in channels:
-                logger.info(f"Processing channel: {channel}")
-
-                last_message_from_db = await get_last_message_from_db(
-                    channel_id=channel.channel_id
-                )
-
-                last_post_id = (
-                    last_message_from_db.post_id if last_message_from_db else 0
-                )
-                messages_with_captions = 0
-                last_message_id = 0
-                track = set()
-
-                while messages_with_captions < max_messages:
-                    should_break = False
-                    try:
-                        async for message in app.get_chat_history(
-                            chat_id=channel.channel_id,
-                            limit=50,
-                            offset_id=last_message_id,
-                        ):
-                            if message.id in track:
-                                # it will stop it if end of channel messsage
-                                should_break = True
-                            track.add(message.id)
-
-                            if message.id <= last_post_id:
-                                logger.info(
-                                    f"Skipping message already processed: {message.id}"
-                                )
-                                should_break = True
-                                break
-
-                            logger.info(f"Processing message: {message.id}")
-                            if message.caption:
-                                messages_with_captions += 1
-                            else:
-                                continue
-
-                            caption = message.caption
-
-                            status, processed_product = await process_product(caption)
-
-                            if status:
-                                try:
-                                    post = await sync_to_async(
-                                        LaptopPost.objects.update_or_create
-                                    )(
-                                        channel_name=message.sender_chat.title
-                                        if message.sender_chat
-                                        else "Unknown",
-                                        posted_at=timezone.make_aware(message.date),
-                                        post_id=message.id,
-                                        defaults=processed_product,
-                                        channel_id=channel,
-                                    )
-                                    laptop_post_photos = (
-                                        await download_mediagroup_images(
-                                            app, message.id, message.sender_chat.id
-                                        )
-                                    )
-                                    try:
-                                        for photo in laptop_post_photos:
-                                            await sync_to_async(
-                                                LaptopImage.objects.create
-                                            )(post=post[0], image=photo)
-
-                                    except Exception as e:
-                                        logger.error(
-                                            f"Error saving laptop image to database: {str(e)}"
-                                        )
-                                        raise e
-
-                                except Exception as e:
-                                    logger.error(
-                                        f"Error saving product to database: {str(e)}"
-                                    )
-                                    raise e
-                            else:
-                                logger.error(
-                                    f"Error processing product: {processed_product}, {caption}"
-                                )
-
-                            last_message_id = message.id
-                            if messages_with_captions >= max_messages:
-                                break
-
-                    except FloodWait as e:
-                        logger.info(
-                            f"Rate limit exceeded. Waiting for {e.value} seconds..."
-                        )
-                        await asyncio.sleep(
-                            e.value
-                        )  # Wait for the required time before retrying
-                        continue
-                    except Exception as e:
-                        logger.error(f"Error processing channel: {str(e)}")
-                        break
-
-                    if should_break:
-                        break
-
-                    if last_message_id is None:
-                        break
-
-                # customize based on the channel so i might need to make it dynamic
+            pipeline = ScrapePipeline(app, should_stop=should_stop)
+            await pipeline.run(channels)
 
     except ValueError as e:
         logger.error(f"Error processing channel : {str(e)}")
@@ -364,17 +356,52 @@ async def scrape_laptops_async():
         logger.error(f"Unexpected error processing channel : {str(e)}")
 
 
-def scrape_laptops():
-    asyncio.run(scrape_laptops_async())
+def scrape_laptops(should_stop=None):
+    """
+    Fetch the channels due for a poll, stopping early once ``should_stop()``
+    returns true.
+    """
+    asyncio.run(scrape_laptops_async(should_stop))
+    if should_stop is None or not should_stop():
+        refresh_similarity()
 
 
-def start_scheduler():
-    scheduler = BackgroundScheduler()
-    interval_minute = settings.SCHEDULE_INTERVAL
-    scheduler.add_job(
-        scrape_laptops,
-        trigger=IntervalTrigger(minutes=int(interval_minute)),
-        id="Scrapelaptops",
-        replace_existing=True,
-    )
-    scheduler.start()
+async def stream_laptops_async(should_stop):
+    from .pipeline import ScrapePipeline
+
+    logger.info("Starting to stream telegram channels")
+    app = telegram_client()
+    try:
+        async with app:
+            pipeline = ScrapePipeline(app, should_stop=should_stop)
+            await pipeline.stream(
+                settings.SCRAPER_RECONCILE_SECONDS,
+                # Off the event loop, streamed messages keep coming
+                on_reconciled=sync_to_async(refresh_similarity, thread_sensitive=False),
+            )
+    except Exception as e:
+        logger.error(f"Unexpected error streaming channels : {str(e)}")
+
+
+def stream_laptops(should_stop):
+    """
+    Ingest new messages as they are posted until ``should_stop()`` returns
+    true, scanning the channel histories every ``SCRAPER_RECONCILE_SECONDS``.
+    """
+    asyncio.run(stream_laptops_async(should_stop))
+
+
+def refresh_similarity():
+    # Give the newly scraped posts their neighbours right away
+    try:
+        call_command("simmilarity_compute", "--incremental")
+    except Exception as e:
+        logger.error(f"Error computing similarity scores: {str(e)}")
+
+    try:
+        call_command("build_similarity_index")
+    except Exception as e:
+        logger.error(f"Error building similarity index: {str(e)}")
+
+    # Posts, images and neighbours changed, drop cached API responses
+    bump_generation()
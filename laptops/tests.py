@@ -1,3 +1,2063 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from google.ai import generativelanguage as glm
+from google.api_core.exceptions import ResourceExhausted
+from pyrogram.errors import FloodWait
+from rapidfuzz import fuzz
+from rest_framework.test import APIClient
+
+from . import autocomplete, fetch_scheduler, ingest, tasks
+from .autocomplete import AutocompleteIndex
+from .caption_cache import CaptionCache
+from .gemini import GeminiKeyPool, TokenBucket
+from .management.commands.run_scraper import Command as RunScraperCommand
+from .management.commands.simmilarity_compute import Command as SimilarityCommand
+from .models import (
+    ChannelFetchState,
+    IngestJob,
+    LaptopImage,
+    LaptopPost,
+    ParsedCaption,
+    RawMessage,
+    Review,
+    SimilarNeighbour,
+    TelegramChat,
+    WorkerLease,
+)
+from .pipeline import ParsedPost, ScrapedMessage, ScrapePipeline
+from .post_writer import write_posts
+from .similarity import WEIGHTS, SimilarityEngine
+from .spec_parser import cpu_specs, parse_caption, parse_ram, price_amount
+from .tasks import (
+    MediaTransferError,
+    download_mediagroup_images,
+    process_products_batch,
+    upload_photos,
+)
+from .vector_index import VectorIndex, build_index, get_vector_index, record_build
+
+User = get_user_model()
+
+# Tests must not touch the cache shared with the development server
+TEST_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def make_chat(channel_id=1, title="Laptops"):
+    return TelegramChat.objects.create(
+        channel_id=channel_id, title=title, profile_photo="chat.jpg"
+    )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LaptopTestCase(TestCase):
+    """Test case using a cache of its own."""
+
+
+class APITestCase(LaptopTestCase):
+    """
+    Test case for cached endpoints. Rolled back test data does not bump the
+    response cache generation, so every test starts from an empty cache.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+
+@override_settings(SIMILARITY_BACKEND="table")
+class LaptopQueryCountTests(APITestCase):
+    """
+    Listing and detail pages must not issue queries per post, review or
+    neighbour.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+        cls.users = [
+            User.objects.create_user(email=f"user{i}@example.com", password="secret")
+            for i in range(3)
+        ]
+
+    def create_posts(self, count):
+        start = LaptopPost.objects.count()
+        posts = []
+        for i in range(start, start + count):
+            post = LaptopPost.objects.create(
+                title=f"HP EliteBook {i}",
+                ram="16GB",
+                storage="512GB SSD",
+                processor="Core i7",
+                price="85,000 birr",
+                post_id=i,
+                channel_name="Laptops",
+                channel_id=self.chat,
+                posted_at=timezone.now(),
+            )
+            for j in range(2):
+                LaptopImage.objects.create(post=post, image=f"{i}-{j}.jpg")
+            for user in self.users:
+                Review.objects.create(product=post, user=user, rating=4)
+            posts.append(post)
+
+        for post in posts:
+            for rank, neighbour in enumerate(p for p in posts if p != post):
+                SimilarNeighbour.objects.create(
+                    item=post, rank=rank, neighbour=neighbour, score=0.9
+                )
+        return posts
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_query_count_is_constant(self):
+        url = reverse("laptop-list")
+        self.create_posts(3)
+        few = self.count_queries(url)
+        self.create_posts(7)
+        many = self.count_queries(url)
+
+        self.assertEqual(few, many)
+        # total count, page of posts with their stored cards
+        self.assertEqual(many, 2)
+
+    def test_list_includes_rating_annotations(self):
+        post = self.create_posts(1)[0]
+        response = self.client.get(reverse("laptop-list"))
+        result = response.json()["results"][0]
+
+        self.assertEqual(result["id"], post.id)
+        self.assertEqual(result["average_rating"], 4)
+        self.assertEqual(result["review_count"], 3)
+        self.assertNotIn("reviews", result)
+        self.assertNotIn("simmilar_items", result)
+
+    def test_detail_query_count_is_constant(self):
+        few = self.create_posts(3)
+        few_queries = self.count_queries(reverse("laptop-detail", args=[few[0].id]))
+        many = self.create_posts(10)
+        many_queries = self.count_queries(reverse("laptop-detail", args=[many[0].id]))
+
+        self.assertEqual(few_queries, many_queries)
+
+        response = self.client.get(reverse("laptop-detail", args=[many[0].id]))
+        self.assertEqual(len(response.json()["reviews"]), 3)
+        self.assertEqual(len(response.json()["simmilar_items"]), 9)
+
+    def test_chat_posts_query_count_is_constant(self):
+        url = reverse("chat-posts", args=[self.chat.channel_id])
+        self.create_posts(3)
+        few = self.count_queries(url)
+        self.create_posts(7)
+
+        self.assertEqual(few, self.count_queries(url))
+
+
+class LaptopSearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        chat = make_chat()
+        specs = [
+            ("HP EliteBook 840 G5", "Core i5 8th gen", "Clean, barely used"),
+            ("Dell XPS 13", "Core i7 1165G7", "HP charger included"),
+            ("Lenovo ThinkPad T480", "Core i5 8350U", "Good battery"),
+        ]
+        cls.posts = [
+            LaptopPost.objects.create(
+                title=title,
+                processor=processor,
+                description=description,
+                price="85,000 birr",
+                post_id=i,
+                channel_name="Laptops",
+                channel_id=chat,
+                posted_at=timezone.now(),
+            )
+            for i, (title, processor, description) in enumerate(specs)
+        ]
+
+    def search(self, query):
+        response = self.client.get(reverse("laptop-list"), {"q": query})
+        return [result["id"] for result in response.json()["results"]]
+
+    def test_ranks_title_matches_first(self):
+        hp, dell, _ = self.posts
+        self.assertEqual(self.search("hp"), [hp.id, dell.id])
+
+    def test_matches_every_token_by_prefix(self):
+        hp, _, thinkpad = self.posts
+        self.assertEqual(set(self.search("i5 8")), {hp.id, thinkpad.id})
+        self.assertEqual(self.search("think i5"), [thinkpad.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        _, dell, thinkpad = self.posts
+        LaptopPost.objects.filter(id=thinkpad.id).update(title="Dell Latitude")
+        dell.delete()
+
+        self.assertEqual(self.search("dell"), [thinkpad.id])
+        self.assertEqual(self.search("xps"), [])
+
+    @override_settings(LAPTOP_SEARCH_BACKEND="icontains")
+    def test_icontains_backend(self):
+        hp, dell, _ = self.posts
+        self.assertEqual(set(self.search("hp")), {hp.id, dell.id})
+
+
+class AutocompleteIndexTests(LaptopTestCase):
+    def setUp(self):
+        self.index = AutocompleteIndex()
+        posts = [
+            ("Lenovo ThinkPad T480", "Core i5 8350U", "16GB"),
+            ("Lenovo ThinkPad X1", "Core i7 1165G7", "16GB"),
+            ("HP EliteBook 840", "Core i5 8350U", "8GB"),
+        ]
+        for post_id, (title, processor, ram) in enumerate(posts):
+            self.index.add(
+                post_id, {"title": title, "processor": processor, "ram": ram}
+            )
+
+    def values(self, query, field=None):
+        return [value for _, value, _ in self.index.complete(query, field)]
+
+    def test_prefix_of_any_word(self):
+        self.assertEqual(self.values("i5"), ["Core i5 8350U"])
+        self.assertEqual(
+            self.values("think"), ["Lenovo ThinkPad T480", "Lenovo ThinkPad X1"]
+        )
+
+    def test_ranks_by_post_count(self):
+        self.assertEqual(
+            self.values("core", "processor"),
+            [
+                "Core i5 8350U",
+                "Core i7 1165G7",
+            ],
+        )
+
+    def test_tolerates_typos(self):
+        self.assertEqual(self.values("elitbook"), ["HP EliteBook 840"])
+        self.assertEqual(self.values("lenovo thinkpd x"), ["Lenovo ThinkPad X1"])
+
+    def test_update_and_remove(self):
+        self.index.add(2, {"title": "Dell XPS 13", "processor": "Core i5 8350U"})
+        self.assertEqual(self.values("elitebook"), [])
+        self.assertEqual(self.values("xps"), ["Dell XPS 13"])
+
+        self.index.remove(2)
+        self.assertEqual(self.values("xps"), [])
+        self.assertNotIn("xps", self.index.words)
+
+    def test_evicts_least_used(self):
+        index = AutocompleteIndex(max_suggestions=5)
+        for post_id in range(10):
+            index.add(post_id, {"title": f"Laptop {post_id}", "ram": "8GB"})
+
+        self.assertLessEqual(len(index), 5)
+        self.assertEqual(self.values_of(index, "8g"), ["8GB"])
+
+    def test_evicted_suggestions_are_forgotten_by_their_posts(self):
+        index = AutocompleteIndex(max_suggestions=5)
+        for post_id in range(6):
+            index.add(post_id, {"title": f"Laptop {post_id}", "ram": "8GB"})
+        self.assertNotIn(("title", "laptop 0"), index.suggestions)
+
+        index.add(6, {"title": "Laptop 0"})
+        index.remove(0)
+        self.assertEqual(self.values_of(index, "laptop 0"), ["Laptop 0"])
+        self.assertEqual(
+            sorted(set().union(*index.documents.values())), sorted(index.suggestions)
+        )
+
+    def test_bulk_load_over_the_limit_evicts_once_sorted(self):
+        index = AutocompleteIndex(max_suggestions=10)
+        for post_id in range(40):
+            index.add(
+                post_id,
+                {"title": f"Laptop {post_id}", "processor": f"Core i{post_id % 3}"},
+                sort=False,
+            )
+        index.sort()
+
+        self.assertLessEqual(len(index), 10)
+        self.assertEqual(index.keys, sorted(index.keys))
+        self.assertEqual(index.vocabulary, sorted(index.words))
+        self.assertEqual(
+            self.values_of(index, "core"), ["Core i0", "Core i1", "Core i2"]
+        )
+
+    @staticmethod
+    def values_of(index, query):
+        return [value for _, value, _ in index.complete(query)]
+
+
+class AutocompleteViewTests(LaptopTestCase):
+    def setUp(self):
+        autocomplete._live_index = None
+        chat = make_chat()
+        self.post = LaptopPost.objects.create(
+            title="Dell Latitude 7490",
+            processor="Core i7 8650U",
+            graphics="Intel UHD 620",
+            post_id=1,
+            channel_name="Laptops",
+            channel_id=chat,
+            posted_at=timezone.now(),
+        )
+
+    def tearDown(self):
+        autocomplete._live_index = None
+
+    def complete(self, **params):
+        return self.client.get(reverse("autocomplete"), params)
+
+    def test_suggestions_follow_saves_without_queries(self):
+        self.assertEqual(
+            self.complete(q="latit").json()["results"],
+            [{"field": "title", "value": "Dell Latitude 7490", "count": 1}],
+        )
+
+        self.post.processor = "Core i5 8350U"
+        self.post.save()
+        with self.assertNumQueries(0):
+            results = self.complete(q="i5", field="processor").json()["results"]
+        self.assertEqual([result["value"] for result in results], ["Core i5 8350U"])
+
+        self.post.delete()
+        self.assertEqual(self.complete(q="latit").json()["results"], [])
+
+    def test_rejects_unknown_field(self):
+        self.assertEqual(self.complete(q="x", field="price").status_code, 400)
+
+    @override_settings(AUTOCOMPLETE_MAX_SUGGESTIONS=10)
+    def test_rebuild_over_the_limit(self):
+        for post_id in range(2, 42):
+            LaptopPost.objects.create(
+                title=f"Lenovo ThinkPad {post_id}",
+                processor=f"Core i{post_id % 3}",
+                post_id=post_id,
+                channel_name="Laptops",
+                channel_id=self.post.channel_id,
+                posted_at=timezone.now(),
+            )
+
+        response = self.complete(q="core", field="processor")
+        self.assertEqual(response.status_code, 200)
+        values = [result["value"] for result in response.json()["results"]]
+        self.assertEqual(sorted(values[:3]), ["Core i0", "Core i1", "Core i2"])
+
+
+class SpecFilterTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        chat = make_chat()
+        specs = [
+            ("8GB DDR4", "256GB SSD", "Core i5 8350U", "35,000 birr"),
+            ("16GB DDR4", "512GB SSD", "Core i7 1165G7", "60,000 birr"),
+            ("16GB", "1TB HDD", "Ryzen 5 5500U", "$450"),
+            ("32 GB RAM", "1TB SSD", "Core i9 12900H", None),
+        ]
+        for i, (ram, storage, processor, price) in enumerate(specs):
+            LaptopPost.objects.create(
+                title=f"Laptop {i}",
+                ram=ram,
+                storage=storage,
+                processor=processor,
+                price=price,
+                post_id=i,
+                channel_name="Laptops",
+                channel_id=chat,
+                posted_at=timezone.now(),
+            )
+        call_command("backfill_specs", stdout=open(os.devnull, "w"))
+
+    def titles(self, **params):
+        response = self.client.get(reverse("laptop-list"), params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(result["title"] for result in response.json()["results"])
+
+    def test_backfill_fills_structured_columns(self):
+        post = LaptopPost.objects.get(post_id=1)
+        self.assertEqual(
+            (post.ram_gb, post.storage_gb, post.storage_type), (16, 512, "SSD")
+        )
+        self.assertEqual(
+            (post.cpu_vendor, post.cpu_tier, post.cpu_generation), ("intel", 7, 11)
+        )
+        self.assertEqual((post.price_amount, post.currency), (60000, "ETB"))
+
+    def test_backfill_refreshes_cached_listings(self):
+        post = LaptopPost.objects.get(post_id=1)
+        self.assertEqual(json.loads(post.listing_card)["ram_gb"], 16)
+        self.assertEqual(self.titles(ram_min=32), [])
+
+        LaptopPost.objects.filter(id=post.id).update(ram="32GB")
+        call_command("backfill_specs", "--all", stdout=open(os.devnull, "w"))
+
+        post.refresh_from_db()
+        self.assertEqual(json.loads(post.listing_card)["ram_gb"], 32)
+        self.assertEqual(self.titles(ram_min=32), ["Laptop 1"])
+
+    def test_saving_a_post_reparses_its_specs(self):
+        post = LaptopPost.objects.get(post_id=0)
+        post.ram = "32GB"
+        post.price = "$500"
+        post.save()
+
+        post.refresh_from_db()
+        self.assertEqual((post.ram_gb, post.price_amount), (32, 500))
+        self.assertEqual(self.titles(ram_min=32), ["Laptop 0"])
+
+        post.storage = "2TB SSD"
+        post.save(update_fields=["storage"])
+        post.refresh_from_db()
+        self.assertEqual(post.storage_gb, 2048)
+
+    def test_range_filters(self):
+        self.assertEqual(
+            self.titles(ram_min=16, price_max=40000, currency="etb,usd"),
+            ["Laptop 2"],
+        )
+        self.assertEqual(self.titles(ram_min=16, price_max=70000), ["Laptop 1"])
+        self.assertEqual(self.titles(storage_min=1024), ["Laptop 2"])
+        self.assertEqual(self.titles(storage_min=1024, null_price=True), ["Laptop 3"])
+
+    def test_choice_filters(self):
+        self.assertEqual(self.titles(cpu_vendor="AMD"), ["Laptop 2"])
+        self.assertEqual(
+            self.titles(storage_type="ssd", cpu_tier="5,7"), ["Laptop 0", "Laptop 1"]
+        )
+
+    def test_rejects_invalid_values(self):
+        response = self.client.get(reverse("laptop-list"), {"ram_min": "lots"})
+        self.assertEqual(response.status_code, 400)
+
+
+class SpecParserTests(LaptopTestCase):
+    def check(self, parser, cases):
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(parser(text), expected)
+
+    def test_cpu_generation(self):
+        self.check(
+            cpu_specs,
+            [
+                ("Core i5-8350U", ("intel", 5, 8)),
+                ("Intel Core i7 1165G7", ("intel", 7, 11)),
+                ("Core i5-1235U", ("intel", 5, 12)),
+                ("i7-1260P", ("intel", 7, 12)),
+                ("Core i7-10510U", ("intel", 7, 10)),
+                ("Core i9-13900HX", ("intel", 9, 13)),
+                ("Core i5 6th gen", ("intel", 5, 6)),
+                ("Ryzen 7 5800H", ("amd", 7, 5)),
+            ],
+        )
+
+    def test_price(self):
+        self.check(
+            price_amount,
+            [
+                ("1,200.50$", (1200.5, "USD")),
+                ("$1,200", (1200, "USD")),
+                ("45,000 birr", (45000, "ETB")),
+                ("Price: 85k", (85000, "ETB")),
+                ("12.500 Birr", (12500, "ETB")),
+                ("call 0911", (None, None)),
+            ],
+        )
+
+    def test_ram_ignores_graphics_memory(self):
+        self.check(
+            parse_ram,
+            [
+                ("Core i7 / 16GB / RTX 3060 6GB / 512GB SSD", "16GB"),
+                ("NVIDIA GeForce RTX 3050 (4GB) 8GB", "8GB"),
+                ("4GB GDDR6 graphics, 16GB RAM", "16GB"),
+                ("Intel UHD graphics 8GB RAM", "8GB"),
+                ("RTX 3050 8GB", None),
+                ("16GB DDR4", "16GB DDR4"),
+            ],
+        )
+
+    def test_templated_caption(self):
+        confidence, data = parse_caption(
+            "HP EliteBook 840 G5\n"
+            "Core i5-8350U 8th gen\n"
+            "8GB DDR4 RAM\n"
+            "256GB SSD\n"
+            '14" FHD IPS\n'
+            "Brand new, silver\n"
+            "Price: 45,000 birr"
+        )
+
+        expected = {
+            "title": "HP EliteBook 840 G5",
+            "processor": "Intel Core i5-8350U 8th Gen",
+            "ram": "8GB DDR4",
+            "storage": "256GB SSD",
+            "display": "14-inch FHD IPS",
+            "status": "New",
+            "color": "Silver",
+            "price": "45,000 Birr",
+            "graphics": None,
+        }
+        self.assertEqual(confidence, 0.95)
+        self.assertEqual({field: data[field] for field in expected}, expected)
+
+    def test_free_text_caption_has_no_confidence(self):
+        self.assertEqual(parse_caption("selling my laptop, call 0911")[0], 0)
+        self.assertEqual(parse_caption("")[1]["description"], None)
+
+    def test_only_low_confidence_captions_reach_the_llm(self):
+        chat = make_chat()
+        captions = [
+            "Dell Latitude 7490\nCore i7-8650U\n16GB RAM\n512GB SSD\nPrice 60k birr",
+            "dm for details",
+        ]
+        batch = [
+            ScrapedMessage(
+                channel=chat,
+                message_id=i,
+                caption=caption,
+                channel_name=chat.title,
+                posted_at=timezone.now(),
+                chat_id=chat.channel_id,
+            )
+            for i, caption in enumerate(captions)
+        ]
+        pipeline = ScrapePipeline(None)
+        with mock.patch(
+            "laptops.pipeline.process_product",
+            mock.AsyncMock(return_value=(True, laptop_data("From the LLM"))),
+        ) as process_product:
+            async_to_sync(pipeline.parse_batch)(batch)
+
+        process_product.assert_awaited_once_with("dm for details")
+        parsed = [pipeline.image_queue.get_nowait() for _ in batch]
+        self.assertEqual(
+            [post.data["title"] for post in parsed],
+            ["Dell Latitude 7490", "From the LLM"],
+        )
+
+
+class FacetTests(SpecFilterTests):
+    def facets(self, **params):
+        response = self.client.get(reverse("laptop-facets"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_per_bucket(self):
+        data = self.facets()
+        facets = data["facets"]
+
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(
+            {entry["label"]: entry["count"] for entry in facets["ram"]},
+            {"8GB - 16GB": 1, "16GB - 32GB": 2},
+        )
+        self.assertEqual(
+            {entry["label"]: entry["count"] for entry in facets["processor"]},
+            {"Core i5": 1, "Core i7": 1, "Ryzen 5": 1},
+        )
+        self.assertEqual(
+            [(entry["label"], entry["params"]) for entry in facets["price"]],
+            [
+                (
+                    "20k Birr - 40k Birr",
+                    {"currency": "ETB", "price_min": 20000, "price_max": 39999},
+                ),
+                (
+                    "60k Birr - 80k Birr",
+                    {"currency": "ETB", "price_min": 60000, "price_max": 79999},
+                ),
+                (
+                    "$400 - $600",
+                    {"currency": "USD", "price_min": 400, "price_max": 599},
+                ),
+            ],
+        )
+        self.assertEqual(facets["channel"][0]["count"], 3)
+
+    def test_params_select_the_bucket(self):
+        entry = self.facets()["facets"]["storage"][0]
+        self.assertEqual(len(self.titles(**entry["params"])), entry["count"])
+
+    def test_follows_filters_and_caches_per_normalized_search(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.facets(cpu_vendor="intel")["count"], 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.facets(cpu_vendor="INTEL,intel")["count"], 2)
+        self.assertEqual(self.facets(q="ryzen")["count"], 1)
+
+    def test_recounts_after_a_change(self):
+        self.assertEqual(self.facets()["count"], 3)
+        LaptopPost.objects.get(post_id=2).delete()
+        self.assertEqual(self.facets()["count"], 2)
+
+
+class KeysetPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+        posted_at = timezone.now()
+        # Pairs of posts share a timestamp, so pages must break ties on id
+        cls.posts = [
+            LaptopPost.objects.create(
+                title=f"Laptop {i}",
+                price="50,000 birr",
+                post_id=i,
+                channel_name="Laptops",
+                channel_id=cls.chat,
+                posted_at=posted_at - timezone.timedelta(minutes=i // 2),
+            )
+            for i in range(25)
+        ]
+
+    def walk(self, url, link="next"):
+        ids = []
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(result["id"] for result in data["results"])
+            url = data[link]
+        return ids
+
+    def test_pages_cover_every_post_once_in_order(self):
+        expected = [
+            post.id
+            for post in sorted(
+                self.posts, key=lambda p: (p.posted_at, p.id), reverse=True
+            )
+        ]
+        self.assertEqual(self.walk(reverse("laptop-list")), expected)
+        self.assertEqual(
+            self.walk(reverse("chat-posts", args=[self.chat.channel_id])), expected
+        )
+
+    def test_previous_links_walk_back(self):
+        first = self.client.get(reverse("laptop-list"), {"count": "false"}).json()
+        second = self.client.get(first["next"]).json()
+        self.assertIsNone(first["previous"])
+        self.assertEqual(self.client.get(second["previous"]).json(), first)
+
+    def test_deep_pages_skip_the_count(self):
+        url = reverse("laptop-list")
+        for _ in range(2):
+            url = self.client.get(url).json()["next"]
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url).json()
+        self.assertNotIn("count", data)
+        self.assertFalse(
+            any(
+                "COUNT(*)" in query["sql"].upper() for query in queries.captured_queries
+            )
+        )
+        self.assertEqual(
+            self.client.get(url, {"count": "true"}).json()["count"], len(self.posts)
+        )
+
+    def test_first_page_keeps_the_count(self):
+        url = reverse("laptop-list")
+        self.assertEqual(self.client.get(url).json()["count"], len(self.posts))
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, {"count": "false"}).json()
+        self.assertNotIn("count", data)
+        self.assertFalse(
+            any(
+                "COUNT(*)" in query["sql"].upper() for query in queries.captured_queries
+            )
+        )
+
+    def test_search_results_paginate_by_relevance(self):
+        ids = self.walk(reverse("laptop-list") + "?q=laptop")
+        self.assertEqual(sorted(ids), sorted(post.id for post in self.posts))
+
+    def test_page_numbers_still_work(self):
+        data = self.client.get(reverse("laptop-list"), {"page": 3}).json()
+        self.assertEqual(data["count"], len(self.posts))
+        self.assertEqual(len(data["results"]), 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("laptop-list"), {"cursor": "nonsense"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ResponseCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+        cls.post = LaptopPost.objects.create(
+            title="Dell Latitude 7490",
+            price="50,000 birr",
+            post_id=1,
+            channel_name="Laptops",
+            channel_id=cls.chat,
+            posted_at=timezone.now(),
+        )
+
+    def test_serves_repeated_requests_from_cache(self):
+        url = reverse("laptop-list")
+        first = self.client.get(url, {"ram_min": 8, "q": "dell"})
+        with self.assertNumQueries(0):
+            second = self.client.get(url, {"q": "dell", "ram_min": 8})
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_saves_invalidate_cached_responses(self):
+        url = reverse("laptop-detail", args=[self.post.id])
+        self.client.get(url)
+        user = User.objects.create_user(email="a@example.com", password="secret")
+        Review.objects.create(product=self.post, user=user, rating=5)
+
+        self.assertEqual(self.client.get(url).json()["average_rating"], 5)
+
+        self.post.title = "Dell Latitude 5490"
+        self.post.save()
+        response = self.client.get(reverse("chat-posts", args=[1]))
+        self.assertEqual(response.json()["results"][0]["title"], "Dell Latitude 5490")
+
+    def test_conditional_requests_get_304(self):
+        url = reverse("chat-list")
+        response = self.client.get(url)
+
+        for headers in (
+            {"HTTP_IF_NONE_MATCH": response["ETag"]},
+            {"HTTP_IF_MODIFIED_SINCE": response["Last-Modified"]},
+        ):
+            self.assertEqual(self.client.get(url, **headers).status_code, 304)
+
+        self.chat.title = "Laptops Addis"
+        self.chat.save()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200
+        )
+
+
+@override_settings(RESPONSE_CACHE_SECONDS=0, SIMILARITY_BACKEND="table")
+class ListingCardTests(LaptopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+        cls.user = User.objects.create_user(email="a@example.com", password="secret")
+        cls.post = LaptopPost.objects.create(
+            title="Lenovo ThinkPad T14",
+            ram="16GB",
+            price="60,000 birr",
+            post_id=1,
+            channel_name="Laptops",
+            channel_id=cls.chat,
+            posted_at=timezone.now(),
+        )
+        LaptopImage.objects.create(post=cls.post, image="t14.jpg")
+        Review.objects.create(product=cls.post, user=cls.user, rating=4)
+
+    def listed(self):
+        return self.client.get(reverse("laptop-list")).json()["results"][0]
+
+    def test_card_matches_serialized_post(self):
+        detail = self.client.get(reverse("laptop-detail", args=[self.post.id])).json()
+        del detail["reviews"], detail["simmilar_items"]
+
+        self.assertEqual(self.listed(), detail)
+        self.assertEqual(detail["first_image"], "http://testserver/media/t14.jpg")
+        self.assertEqual(detail["image_count"], 1)
+        self.assertEqual(detail["channel"], "http://testserver/api/chats/1/")
+
+    def test_image_urls_are_built_when_served(self):
+        self.assertNotIn("/media/", LaptopPost.objects.get().listing_card)
+
+        signed = "https://bucket.example.com/t14.jpg?X-Amz-Signature=2"
+        with mock.patch.object(default_storage, "url", return_value=signed):
+            card = self.listed()
+        self.assertEqual(card["first_image"], signed)
+        self.assertEqual(card["images"], [{"image": signed}])
+
+    def test_list_page_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse("laptop-list"), {"count": "false"})
+
+    def test_cards_follow_their_inputs(self):
+        LaptopImage.objects.create(post=self.post, image="t14-side.jpg")
+        other = User.objects.create_user(email="b@example.com", password="secret")
+        Review.objects.create(product=self.post, user=other, rating=2)
+        self.post.title = "Lenovo ThinkPad T14 Gen 2"
+        self.post.save()
+
+        card = self.listed()
+        self.assertEqual(card["title"], "Lenovo ThinkPad T14 Gen 2")
+        self.assertEqual(card["image_count"], 2)
+        self.assertEqual(card["average_rating"], 3)
+        self.assertEqual(card["review_count"], 2)
+
+    def test_missing_cards_are_rendered(self):
+        LaptopPost.objects.update(listing_card=None)
+        self.assertEqual(self.listed()["title"], "Lenovo ThinkPad T14")
+        self.assertIsNotNone(LaptopPost.objects.get().listing_card)
+
+        LaptopPost.objects.update(listing_card=None)
+        call_command("rebuild_listing_cards", stdout=open(os.devnull, "w"))
+        self.assertIsNotNone(LaptopPost.objects.get().listing_card)
+
+
+@override_settings(RESPONSE_CACHE_SECONDS=0)
+class RatingAggregateTests(LaptopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+        cls.users = [
+            User.objects.create_user(email=f"user{i}@example.com", password="secret")
+            for i in range(3)
+        ]
+        cls.posts = [
+            LaptopPost.objects.create(
+                title=f"Dell Latitude {i}",
+                post_id=i,
+                price="50,000 birr",
+                channel_name="Laptops",
+                channel_id=cls.chat,
+                posted_at=timezone.now() - timezone.timedelta(days=i),
+            )
+            for i in range(2)
+        ]
+
+    def ratings(self, post):
+        post = LaptopPost.objects.get(pk=post.pk)
+        return post.rating_count, post.rating_sum, post.rating_average
+
+    def test_reviews_update_the_aggregates(self):
+        post = self.posts[0]
+        reviews = [
+            Review.objects.create(product=post, user=user, rating=rating)
+            for user, rating in zip(self.users, (5, 4, 3))
+        ]
+        self.assertEqual(self.ratings(post), (3, 12, 4.0))
+
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        url = reverse("review-get-update-delete", args=[reviews[0].id])
+        client.patch(url, {"rating": 2})
+        self.assertEqual(self.ratings(post), (3, 9, 3.0))
+        client.delete(url)
+        self.assertEqual(self.ratings(post), (2, 7, 3.5))
+
+        self.users[1].delete()
+        self.assertEqual(self.ratings(post), (1, 3, 3.0))
+        reviews[2].delete()
+        self.assertEqual(self.ratings(post), (0, 0, 0.0))
+
+    def test_saving_a_stale_post_keeps_the_aggregates(self):
+        post = self.posts[0]
+        Review.objects.create(product=post, user=self.users[0], rating=5)
+        post.title = "Dell Latitude 5490"
+        post.save()
+        self.assertEqual(self.ratings(post), (1, 5, 5.0))
+
+    def test_repair_recomputes_drifted_aggregates(self):
+        Review.objects.create(product=self.posts[0], user=self.users[0], rating=5)
+        LaptopPost.objects.update(rating_count=7, rating_sum=1, rating_average=0.1)
+        call_command("repair_ratings", stdout=open(os.devnull, "w"))
+
+        self.assertEqual(self.ratings(self.posts[0]), (1, 5, 5.0))
+        self.assertEqual(self.ratings(self.posts[1]), (0, 0, 0.0))
+
+    def test_sort_and_filter_by_rating(self):
+        Review.objects.create(product=self.posts[1], user=self.users[0], rating=5)
+        url = reverse("laptop-list")
+
+        results = self.client.get(url, {"sort": "rating"}).json()["results"]
+        self.assertEqual([r["id"] for r in results], [p.id for p in self.posts[::-1]])
+        results = self.client.get(url, {"rating_min": 4}).json()["results"]
+        self.assertEqual([r["id"] for r in results], [self.posts[1].id])
+        self.assertEqual(self.client.get(url, {"sort": "price"}).status_code, 400)
+
+
+@override_settings(RESPONSE_CACHE_SECONDS=0)
+class PostWriterTests(LaptopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.media_dir = os.path.join(media.name, "telegram_assets", "laptop_images")
+
+    def parsed(self, message_id, title, photos=0, channel=None):
+        message = ScrapedMessage(
+            channel=channel or self.chat,
+            message_id=message_id,
+            caption=title,
+            channel_name="Laptops",
+            posted_at=timezone.now(),
+            chat_id=1,
+        )
+        data = {
+            "title": title,
+            "storage": "512GB SSD",
+            "processor": "Core i5 8th Gen",
+            "graphics": None,
+            "display": None,
+            "ram": "8GB",
+            "battrey": None,
+            "status": "Used",
+            "color": None,
+            "description": title,
+            "price": "35,000 birr",
+        }
+        uploaded = async_to_sync(upload_photos)(
+            [
+                ContentFile(b"jpeg", name=f"photo_{message_id}_{i}.jpg")
+                for i in range(photos)
+            ]
+        )
+        return ParsedPost(message, data, uploaded)
+
+    def test_writes_a_batch_in_constant_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            write_posts([self.parsed(i, f"HP {i}", photos=2) for i in range(2)])
+        with CaptureQueriesContext(connection) as many:
+            write_posts([self.parsed(i, f"HP {i}", photos=2) for i in range(2, 12)])
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(LaptopPost.objects.count(), 12)
+        self.assertEqual(LaptopImage.objects.count(), 24)
+        post = LaptopPost.objects.get(post_id=5)
+        self.assertEqual((post.ram_gb, post.cpu_tier), (8, 5))
+        self.assertEqual(json.loads(post.listing_card)["image_count"], 2)
+
+    def test_rewrites_update_posts_and_keep_ratings_and_photos(self):
+        write_posts([self.parsed(1, "Dell Latitude", photos=1)])
+        post = LaptopPost.objects.get()
+        user = User.objects.create_user(email="a@example.com", password="secret")
+        Review.objects.create(product=post, user=user, rating=5)
+
+        write_posts([self.parsed(1, "Dell Latitude 7490", photos=1)])
+        post = LaptopPost.objects.get()
+        self.assertEqual(post.title, "Dell Latitude 7490")
+        self.assertEqual((post.rating_count, post.rating_average), (1, 5.0))
+        self.assertEqual(post.images.count(), 1)
+        self.assertEqual(len(os.listdir(self.media_dir)), 1)
+        self.assertEqual(
+            self.client.get(reverse("laptop-list")).json()["results"][0]["title"],
+            "Dell Latitude 7490",
+        )
+
+    def test_same_message_id_in_two_channels_makes_two_posts(self):
+        other = make_chat(2, "Other laptops")
+        write_posts(
+            [
+                self.parsed(7, "Dell Latitude", photos=1),
+                self.parsed(7, "HP EliteBook", photos=1, channel=other),
+            ]
+        )
+        write_posts([self.parsed(7, "HP EliteBook 840", photos=1, channel=other)])
+
+        self.assertEqual(
+            sorted(LaptopPost.objects.values_list("channel_id", "title")),
+            [(1, "Dell Latitude"), (2, "HP EliteBook 840")],
+        )
+        self.assertEqual(LaptopImage.objects.count(), 2)
+        self.assertEqual(len(os.listdir(self.media_dir)), 2)
+
+    def test_values_are_cut_to_fit_their_columns(self):
+        parsed = self.parsed(1, "Dell Latitude")
+        parsed.data.update(
+            color="Silver with a black keyboard",
+            status="Used, " + "like new " * 10,
+            price="4,000,000,000 birr, " + "negotiable " * 10,
+        )
+        write_posts([parsed])
+
+        post = LaptopPost.objects.get()
+        self.assertEqual(post.color, "Silver with a black ")
+        self.assertEqual(len(post.status), 40)
+        self.assertEqual(len(post.price), 50)
+        self.assertIsNone(post.price_amount)
+
+    def test_a_new_copy_named_like_a_stored_photo_is_kept(self):
+        write_posts([self.parsed(1, "Dell Latitude", photos=1)])
+        name = LaptopImage.objects.get().image.name
+
+        # S3 overwrites the stored photo with the new copy of the same name
+        rescraped = self.parsed(1, "Dell Latitude 7490")
+        rescraped.photos = [name]
+        write_posts([rescraped])
+
+        self.assertEqual(LaptopImage.objects.get().image.name, name)
+        self.assertEqual(os.listdir(self.media_dir), [os.path.basename(name)])
+
+
+class FakeMedia:
+    def __init__(self, id, chunks):
+        self.id = id
+        self.photo = True
+        self.chunks = chunks
+
+
+class FakeTelegramClient:
+    """Serves a media group whose photos each take 50ms to stream."""
+
+    def __init__(self, media_group):
+        self.media_group = media_group
+        self.streaming = self.max_streaming = 0
+
+    async def get_media_group(self, chat_id, message_id):
+        return self.media_group
+
+    async def stream_media(self, media):
+        self.streaming += 1
+        self.max_streaming = max(self.max_streaming, self.streaming)
+        try:
+            for chunk in media.chunks:
+                await asyncio.sleep(0.05 / len(media.chunks))
+                yield chunk
+        finally:
+            self.streaming -= 1
+
+
+class MediaDownloadTests(LaptopTestCase):
+    def download(self, client, concurrency):
+        async def run():
+            started = time.monotonic()
+            photos = await download_mediagroup_images(
+                client, 1, 1, asyncio.Semaphore(concurrency)
+            )
+            return photos, time.monotonic() - started
+
+        return async_to_sync(run)()
+
+    @override_settings(SCRAPER_MEDIA_SPOOL_BYTES=4)
+    def test_downloads_photos_concurrently_up_to_the_cap(self):
+        client = FakeTelegramClient(
+            [FakeMedia(i, [b"ab", b"cd", bytes([i])]) for i in range(6)]
+        )
+        photos, elapsed = self.download(client, 3)
+
+        self.assertEqual(client.max_streaming, 3)
+        # Two rounds of three photos, not six photos one after the other
+        self.assertLess(elapsed, 0.25)
+        self.assertEqual([photo.read() for photo in photos][4], b"abcd\x04")
+        for photo in photos:
+            photo.close()
+
+    def test_failed_upload_deletes_the_stored_photos(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        storage = LaptopImage._meta.get_field("image").storage
+        save = storage.save
+
+        def flaky_save(name, content):
+            if "broken" in name:
+                raise OSError("S3 unavailable")
+            return save(name, content)
+
+        photos = [ContentFile(b"jpeg", name=f"{name}.jpg") for name in ("ok", "broken")]
+        with mock.patch.object(storage, "save", flaky_save):
+            with self.assertRaisesMessage(MediaTransferError, "S3 unavailable"):
+                async_to_sync(upload_photos)(photos)
+        stored = os.path.join(media.name, "telegram_assets", "laptop_images")
+        self.assertEqual(os.listdir(stored), [])
+
+
+class WorkerLeaseTests(LaptopTestCase):
+    def test_one_holder_at_a_time(self):
+        self.assertTrue(WorkerLease.acquire("scraper", "a", 60))
+        self.assertFalse(WorkerLease.acquire("scraper", "b", 60))
+        # Renewing keeps the lease
+        self.assertTrue(WorkerLease.acquire("scraper", "a", 60))
+
+        WorkerLease.objects.update(expires_at=timezone.now())
+        self.assertTrue(WorkerLease.acquire("scraper", "b", 60))
+        self.assertFalse(WorkerLease.acquire("scraper", "a", 60))
+
+        WorkerLease.release("scraper", "b")
+        self.assertTrue(WorkerLease.acquire("scraper", "a", 60))
+
+    @mock.patch("laptops.management.commands.run_scraper.scrape_laptops")
+    def test_worker_scrapes_only_with_the_lease(self, scrape_laptops):
+        out = io.StringIO()
+        WorkerLease.acquire("scraper", "other", 60)
+        call_command("run_scraper", "--once", stdout=out)
+        scrape_laptops.assert_not_called()
+        self.assertIn("Another worker", out.getvalue())
+
+        WorkerLease.release("scraper", "other")
+        call_command("run_scraper", "--once", stdout=out)
+        scrape_laptops.assert_called_once()
+        self.assertFalse(WorkerLease.objects.exists())
+
+    @mock.patch("laptops.management.commands.run_scraper.scrape_laptops")
+    def test_scraper_command_takes_the_lease(self, scrape_laptops):
+        out = io.StringIO()
+        WorkerLease.acquire("scraper", "other", 60)
+        call_command("scraper_command", stdout=out)
+        scrape_laptops.assert_not_called()
+
+        WorkerLease.release("scraper", "other")
+        call_command("scraper_command", stdout=out)
+        scrape_laptops.assert_called_once()
+
+    @mock.patch.object(WorkerLease, "acquire", side_effect=OperationalError("gone"))
+    def test_failed_renewal_stops_the_work(self, acquire):
+        command = RunScraperCommand()
+        command.owner = "me"
+        stopped = []
+        command.with_lease(lambda lost: stopped.append(lost.wait(5)), 60, 0.01)
+        self.assertEqual(stopped, [True])
+
+    def test_pipeline_stops_when_asked(self):
+        pipeline = ScrapePipeline(FakeStreamClient([]), should_stop=lambda: True)
+        async_to_sync(pipeline.stream)(3600)
+        self.assertTrue(pipeline.stopping)
+
+
+@override_settings(INGEST_MAX_ATTEMPTS=2, INGEST_RETRY_SECONDS=60)
+class IngestJobTests(LaptopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+
+    def enqueue(self, *captions):
+        ingest.enqueue_messages(
+            [
+                ScrapedMessage(
+                    channel=self.chat,
+                    message_id=i,
+                    caption=caption,
+                    channel_name="Laptops",
+                    posted_at=timezone.now(),
+                    chat_id=1,
+                )
+                for i, caption in enumerate(captions, start=1)
+            ]
+        )
+
+    def test_claims_retries_and_gives_up(self):
+        self.enqueue("HP EliteBook", "Dell Latitude")
+        self.enqueue("HP EliteBook")
+        self.assertEqual(IngestJob.objects.count(), 2)
+        self.assertEqual(ingest.last_enqueued_message_id(self.chat.channel_id), 2)
+
+        first, second = ingest.claim_jobs(10)
+        self.assertEqual((first.state, first.attempts), ("running", 1))
+        self.assertEqual(ingest.claim_jobs(10), [])
+
+        ingest.complete_jobs([first.id])
+        ingest.fail_jobs({second.id: "Gemini quota exceeded"})
+        second.refresh_from_db()
+        self.assertEqual(
+            (second.state, second.last_error), ("pending", "Gemini quota exceeded")
+        )
+        self.assertGreater(second.available_at, timezone.now())
+        self.assertEqual(ingest.claim_jobs(10), [])
+
+        IngestJob.objects.filter(id=second.id).update(available_at=timezone.now())
+        [retried] = ingest.claim_jobs(10)
+        self.assertEqual(retried.attempts, 2)
+        ingest.fail_jobs({retried.id: "Gemini quota exceeded"})
+        retried.refresh_from_db()
+        self.assertEqual(retried.state, "failed")
+
+        first.refresh_from_db()
+        self.assertEqual(first.state, "done")
+
+    @override_settings(INGEST_LOCK_SECONDS=60)
+    def test_reclaims_jobs_of_dead_workers(self):
+        self.enqueue("HP EliteBook")
+        ingest.claim_jobs(10)
+        self.assertEqual(ingest.claim_jobs(10), [])
+
+        IngestJob.objects.update(locked_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(len(ingest.claim_jobs(10)), 1)
+
+    @mock.patch("laptops.pipeline.parse_caption", return_value=(0, {}))
+    @mock.patch("laptops.pipeline.process_products_batch")
+    @mock.patch("laptops.pipeline.process_product")
+    def test_pipeline_completes_and_retries_jobs(self, process, process_batch, _):
+        async def parse(caption):
+            if caption.startswith("HP"):
+                return True, {"title": caption}
+            return False, {}
+
+        async def parse_batch(captions):
+            return {id: await parse(caption) for id, caption in captions.items()}
+
+        process.side_effect = parse
+        process_batch.side_effect = parse_batch
+        self.enqueue("HP EliteBook 840 G5", "Call us for prices")
+        good, bad = IngestJob.objects.order_by("message_id")
+        app = mock.Mock()
+        app.get_media_group = mock.AsyncMock(side_effect=ValueError("No media group"))
+
+        async_to_sync(ScrapePipeline(app, batch_linger=0.01).run)([])
+
+        self.assertEqual(LaptopPost.objects.get().title, "HP EliteBook 840 G5")
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(good.state, "done")
+        self.assertEqual((bad.state, bad.attempts), ("pending", 1))
+        self.assertIn("Error processing product", bad.last_error)
+
+    @mock.patch("laptops.pipeline.parse_caption", return_value=(0, {}))
+    @mock.patch("laptops.pipeline.process_product")
+    @mock.patch("laptops.pipeline.upload_photos")
+    def test_failed_photo_uploads_are_retried_later(self, upload, process, _):
+        async def parse(caption):
+            return True, {"title": caption}
+
+        process.side_effect = parse
+        upload.side_effect = MediaTransferError("1 of 1 photos failed to upload")
+        self.enqueue("HP EliteBook 840 G5")
+        app = FakeTelegramClient([FakeMedia(1, [b"jpeg"])])
+
+        async_to_sync(ScrapePipeline(app, batch_linger=0.01).run)([])
+
+        self.assertFalse(LaptopPost.objects.exists())
+        job = IngestJob.objects.get()
+        self.assertEqual((job.state, job.attempts), ("pending", 1))
+        self.assertIn("failed to upload", job.last_error)
+
+    @mock.patch("laptops.pipeline.parse_caption", return_value=(0, {}))
+    @mock.patch("laptops.pipeline.process_products_batch")
+    @mock.patch("laptops.pipeline.process_product")
+    def test_a_rejected_post_does_not_fail_its_batch(self, process, process_batch, _):
+        async def parse(caption):
+            return True, {"title": caption}
+
+        async def parse_batch(captions):
+            return {i: await parse(caption) for i, caption in captions.items()}
+
+        def reject_broken(batch):
+            sizes.append(len(batch))
+            if any(item.data["title"] == "Broken" for item in batch):
+                raise OperationalError("constraint failed")
+            return write_posts(batch)
+
+        process.side_effect = parse
+        process_batch.side_effect = parse_batch
+        self.enqueue("HP EliteBook 840 G5", "Broken", "Dell Latitude 7490")
+        sizes = []
+        pipeline = ScrapePipeline(
+            FakeHistoryClient([]),
+            parse_workers=1,
+            db_workers=1,
+            write_batch_size=3,
+            batch_linger=0.2,
+        )
+        with mock.patch("laptops.pipeline.write_posts", reject_broken):
+            async_to_sync(pipeline.run)([])
+
+        self.assertEqual(sizes, [3, 1, 1, 1])
+
+        self.assertEqual(
+            sorted(LaptopPost.objects.values_list("title", flat=True)),
+            ["Dell Latitude 7490", "HP EliteBook 840 G5"],
+        )
+        self.assertEqual(
+            list(
+                IngestJob.objects.order_by("message_id").values_list("state", flat=True)
+            ),
+            ["done", "pending", "done"],
+        )
+
+    @mock.patch("laptops.pipeline.parse_caption", return_value=(0, {}))
+    @mock.patch("laptops.pipeline.process_product")
+    @mock.patch("laptops.pipeline.write_posts", side_effect=OperationalError("locked"))
+    def test_failed_writes_delete_their_photos(self, _, process, __):
+        async def parse(caption):
+            return True, {"title": caption}
+
+        process.side_effect = parse
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.enqueue("HP EliteBook 840 G5")
+        app = FakeTelegramClient([FakeMedia(1, [b"jpeg"])])
+
+        async_to_sync(ScrapePipeline(app, batch_linger=0.01).run)([])
+
+        stored = os.path.join(media.name, "telegram_assets", "laptop_images")
+        self.assertEqual(os.listdir(stored), [])
+        job = IngestJob.objects.get()
+        self.assertEqual((job.state, job.attempts), ("pending", 1))
+
+    @mock.patch("laptops.pipeline.parse_caption", return_value=(0, {}))
+    @mock.patch("laptops.pipeline.process_product")
+    def test_rescraped_posts_keep_their_photos(self, process, _):
+        async def parse(caption):
+            return True, {"title": caption}
+
+        process.side_effect = parse
+        post = LaptopPost.objects.create(
+            title="HP EliteBook",
+            post_id=1,
+            channel_name="Laptops",
+            channel_id=self.chat,
+            posted_at=timezone.now(),
+        )
+        LaptopImage.objects.create(post=post, image="photo.jpg")
+        self.enqueue("HP EliteBook 840 G5")
+        app = FakeTelegramClient([FakeMedia(1, [b"jpeg"])])
+
+        async_to_sync(ScrapePipeline(app, batch_linger=0.01).run)([])
+
+        self.assertEqual(app.max_streaming, 0)
+        post.refresh_from_db()
+        self.assertEqual(post.title, "HP EliteBook 840 G5")
+        self.assertEqual(
+            list(post.images.values_list("image", flat=True)), ["photo.jpg"]
+        )
+
+
+class FakeChat:
+    def __init__(self, id, title):
+        self.id = id
+        self.title = title
+        self.username = None
+
+
+class FakeMessage:
+    def __init__(self, id, caption=None):
+        self.id = id
+        self.caption = caption
+        self.date = datetime(2026, 1, 1) + timezone.timedelta(minutes=id)
+        self.chat = self.sender_chat = FakeChat(1, "Laptops")
+        self.media_group_id = "album-1"
+        self.photo = None
+
+
+class FakeHistoryClient:
+    def __init__(self, messages, flood_wait=None):
+        self.messages = messages
+        self.flood_wait = flood_wait
+        self.limits = []
+
+    async def get_media_group(self, chat_id, message_id):
+        return []
+
+    async def get_chat_history(self, chat_id, limit, offset_id):
+        self.limits.append(limit)
+        if self.flood_wait:
+            raise FloodWait(value=self.flood_wait)
+        older = [m for m in self.messages if not offset_id or m.id < offset_id]
+        for message in older[:limit]:
+            yield message
+
+
+class RawMessageArchiveTests(LaptopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+
+    def test_fetch_archives_every_message_and_enqueues_captioned_ones(self):
+        app = FakeHistoryClient(
+            [FakeMessage(3, "HP EliteBook 840 G5"), FakeMessage(2), FakeMessage(1)]
+        )
+        async_to_sync(ScrapePipeline(app).fetch_channel)(self.chat)
+
+        self.assertEqual(
+            list(
+                RawMessage.objects.order_by("-message_id").values_list(
+                    "message_id", flat=True
+                )
+            ),
+            [3, 2, 1],
+        )
+        self.assertEqual(
+            list(IngestJob.objects.values_list("message_id", flat=True)), [3]
+        )
+        data = RawMessage.objects.get(message_id=3).data
+        self.assertEqual(data["caption"], "HP EliteBook 840 G5")
+        self.assertEqual(data["sender_chat"], {"id": 1, "title": "Laptops"})
+
+    @mock.patch("laptops.pipeline.process_products_batch")
+    @mock.patch("laptops.pipeline.process_product")
+    def test_reparse_rebuilds_posts_from_the_archive(self, process, process_batch):
+        async def parse(caption):
+            return True, {"title": caption.upper()}
+
+        async def parse_batch(captions):
+            return {id: await parse(caption) for id, caption in captions.items()}
+
+        process.side_effect = parse
+        process_batch.side_effect = parse_batch
+        app = FakeHistoryClient([FakeMessage(i, f"Laptop {i}") for i in (2, 1)])
+        async_to_sync(ScrapePipeline(app).fetch_channel)(self.chat)
+
+        with mock.patch("laptops.pipeline.parse_caption", return_value=(0, {})):
+            call_command("reparse", "--channel", "1", stdout=io.StringIO())
+        self.assertEqual(
+            sorted(LaptopPost.objects.values_list("title", flat=True)),
+            ["LAPTOP 1", "LAPTOP 2"],
+        )
+
+    def test_reparse_rejects_an_invalid_date(self):
+        for since in ("yesterday", "2026-13-01"):
+            with self.subTest(since=since), self.assertRaises(CommandError):
+                call_command("reparse", "--since", since, stdout=io.StringIO())
+
+
+class PipelineShutdownTests(LaptopTestCase):
+    @mock.patch("laptops.pipeline.parse_caption", return_value=(0, {}))
+    @mock.patch("laptops.pipeline.process_products_batch")
+    @mock.patch("laptops.pipeline.process_product")
+    def test_stop_drains_what_was_claimed(self, process, process_batch, _):
+        async def parse(caption):
+            return True, laptop_data(caption)
+
+        async def parse_batch(captions):
+            return {key: await parse(text) for key, text in captions.items()}
+
+        def claim_then_stop(limit):
+            jobs = ingest.claim_jobs(limit)
+            pipeline.stop()
+            return jobs
+
+        process.side_effect = parse
+        process_batch.side_effect = parse_batch
+        chat = make_chat()
+        ingest.enqueue_messages(
+            [
+                ScrapedMessage(
+                    channel=chat,
+                    message_id=i,
+                    caption=f"Laptop {i}",
+                    channel_name=chat.title,
+                    posted_at=timezone.now(),
+                    chat_id=chat.channel_id,
+                )
+                for i in range(1, 6)
+            ]
+        )
+        pipeline = ScrapePipeline(
+            FakeHistoryClient([]), write_batch_size=3, queue_size=1, batch_linger=0.01
+        )
+        with mock.patch("laptops.pipeline.claim_jobs", claim_then_stop):
+            async_to_sync(pipeline.run)([])
+
+        self.assertEqual(
+            sorted(LaptopPost.objects.values_list("title", flat=True)),
+            ["Laptop 1", "Laptop 2", "Laptop 3"],
+        )
+        self.assertEqual(
+            dict(
+                IngestJob.objects.values("state")
+                .annotate(count=Count("id"))
+                .values_list("state", "count")
+            ),
+            {"done": 3, "pending": 2},
+        )
+
+    @mock.patch("laptops.pipeline.process_product", return_value=(False, {}))
+    def test_stop_skips_the_channels_not_fetched_yet(self, _):
+        chats = [make_chat(1), make_chat(2, "Other laptops")]
+        app = FakeHistoryClient([FakeMessage(1, "Laptop 1")])
+        pipeline = ScrapePipeline(app, channel_concurrency=1, batch_linger=0.01)
+        fetch_channel = pipeline.fetch_channel
+
+        async def fetch_then_stop(channel):
+            await fetch_channel(channel)
+            pipeline.stop()
+
+        with mock.patch.object(pipeline, "fetch_channel", fetch_then_stop):
+            async_to_sync(pipeline.run)(chats)
+
+        self.assertEqual(
+            list(ChannelFetchState.objects.values_list("channel_id", flat=True)), [1]
+        )
+
+
+class FetchSchedulerTests(LaptopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.busy, cls.dormant = [
+            make_chat(channel_id, title)
+            for channel_id, title in ((1, "Busy"), (2, "Dormant"))
+        ]
+
+    def poll(self, channel, new_messages, hours):
+        state = fetch_scheduler.channel_state(channel)
+        now = timezone.now()
+        state.last_polled_at = now - timezone.timedelta(hours=hours)
+        fetch_scheduler.record_poll(state, new_messages, 0, now=now)
+        return state
+
+    def test_busy_channels_are_polled_more_often_with_larger_pages(self):
+        for _ in range(3):
+            busy = self.poll(self.busy, 3000, 1)
+            dormant = self.poll(self.dormant, 0, 1)
+
+        self.assertLess(busy.poll_seconds, dormant.poll_seconds)
+        self.assertGreater(busy.fetch_limit, dormant.fetch_limit)
+        self.assertEqual(dormant.poll_seconds, settings.SCRAPER_MAX_POLL_SECONDS)
+        self.assertEqual(fetch_scheduler.due_channels(busy.next_poll_at), [self.busy])
+
+    @override_settings(SCRAPER_MIN_FETCH_LIMIT=10, SCRAPER_MAX_FETCH_LIMIT=10)
+    def test_polls_cut_short_resume_until_the_gap_is_closed(self):
+        ChannelFetchState.objects.create(
+            channel=self.busy, last_message_id=100, fetch_limit=10
+        )
+        app = FakeHistoryClient(
+            [FakeMessage(i, f"Laptop {i}") for i in range(128, 90, -1)]
+        )
+        fetch = async_to_sync(ScrapePipeline(app).fetch_channel)
+
+        # 28 new messages, 10 per poll
+        for last_message_id, resume_offset_id in ((100, 119), (100, 109), (128, 0)):
+            fetch(self.busy)
+            state = ChannelFetchState.objects.get(channel=self.busy)
+            self.assertEqual(
+                (state.last_message_id, state.resume_offset_id),
+                (last_message_id, resume_offset_id),
+            )
+        self.assertEqual(app.limits, [10, 10, 10])
+        self.assertEqual(
+            sorted(IngestJob.objects.values_list("message_id", flat=True)),
+            list(range(101, 129)),
+        )
+        # Stopped by its limit, the last polls came soon after
+        self.assertEqual(state.poll_seconds, settings.SCRAPER_MIN_POLL_SECONDS)
+
+        app.messages.insert(0, FakeMessage(129, "Laptop 129"))
+        fetch(self.busy)
+        state = ChannelFetchState.objects.get(channel=self.busy)
+        self.assertEqual(state.last_message_id, 129)
+        self.assertEqual(IngestJob.objects.count(), 29)
+
+    def test_flood_wait_moves_on_to_other_channels(self):
+        app = FakeHistoryClient([FakeMessage(1, "Laptop 1")], flood_wait=600)
+        async_to_sync(ScrapePipeline(app).fetch_channel)(self.busy)
+
+        state = ChannelFetchState.objects.get(channel=self.busy)
+        self.assertEqual(state.flood_waits, 1)
+        self.assertGreaterEqual(
+            state.next_poll_at, timezone.now() + timezone.timedelta(seconds=590)
+        )
+        self.assertEqual(fetch_scheduler.due_channels(), [self.dormant])
+
+
+class FakeStreamClient(FakeHistoryClient):
+    def __init__(self, messages):
+        super().__init__(messages)
+        self.handlers = []
+
+    def add_handler(self, handler):
+        self.handlers.append(handler)
+
+    def remove_handler(self, handler):
+        self.handlers.remove(handler)
+
+    async def push(self, message):
+        for handler in self.handlers:
+            if await handler.filters(self, message):
+                await handler.callback(self, message)
+
+
+class StreamingTests(LaptopTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chat = make_chat()
+
+    @mock.patch("laptops.pipeline.process_products_batch")
+    @mock.patch("laptops.pipeline.process_product")
+    def test_streamed_messages_go_through_the_pipeline(self, process, process_batch):
+        async def parse(caption):
+            return True, {"title": caption}
+
+        async def parse_batch(captions):
+            return {id: await parse(caption) for id, caption in captions.items()}
+
+        process.side_effect = parse
+        process_batch.side_effect = parse_batch
+        app = FakeStreamClient([FakeMessage(1, "Dell Latitude 7490")])
+        reconciled = mock.AsyncMock()
+        streamed = FakeMessage(2, "HP EliteBook 840 G5")
+        other_chat = FakeMessage(3, "Lenovo ThinkPad T480")
+        other_chat.chat = FakeChat(2, "Elsewhere")
+
+        async def scenario():
+            pipeline = ScrapePipeline(app, batch_linger=0.01)
+            streaming = asyncio.create_task(pipeline.stream(3600, reconciled))
+            while not reconciled.await_count:
+                await asyncio.sleep(0.01)
+            await app.push(streamed)
+            await app.push(other_chat)
+            for _ in range(500):
+                if await sync_to_async(LaptopPost.objects.count)() == 2:
+                    break
+                await asyncio.sleep(0.01)
+            pipeline.stop()
+            await streaming
+
+        with mock.patch("laptops.pipeline.parse_caption", return_value=(0, {})):
+            async_to_sync(scenario)()
+
+        # The history scan fetched message 1, the stream message 2
+        self.assertEqual(
+            sorted(LaptopPost.objects.values_list("title", flat=True)),
+            ["Dell Latitude 7490", "HP EliteBook 840 G5"],
+        )
+        self.assertEqual(RawMessage.objects.count(), 2)
+        self.assertEqual(app.handlers, [])
+
+
+def llm_answer(data):
+    return mock.Mock(text=json.dumps(data))
+
+
+def laptop_data(title):
+    fields = ("storage", "processor", "graphics", "display", "ram", "battrey")
+    fields += ("status", "color", "description", "price")
+    return {"title": title, **dict.fromkeys(fields)}
+
+
+class TokenBucketTests(LaptopTestCase):
+    @mock.patch("laptops.gemini.time.monotonic")
+    def test_refills_at_the_rate_per_minute(self, monotonic):
+        monotonic.return_value = 100.0
+        bucket = TokenBucket(rate_per_minute=2)
+
+        self.assertEqual([bucket.try_acquire() for _ in range(2)], [0, 0])
+        self.assertEqual(bucket.try_acquire(), 30)
+
+        monotonic.return_value = 115.0
+        self.assertEqual(bucket.try_acquire(), 15)
+        monotonic.return_value = 130.0
+        self.assertEqual(bucket.try_acquire(), 0)
+
+    @mock.patch("laptops.gemini.time.monotonic")
+    def test_blocked_bucket_refuses_tokens(self, monotonic):
+        monotonic.return_value = 100.0
+        bucket = TokenBucket(rate_per_minute=60)
+        bucket.block(10)
+
+        self.assertEqual(bucket.try_acquire(), 10)
+        monotonic.return_value = 110.0
+        self.assertEqual(bucket.try_acquire(), 0)
+
+
+def gemini_answer(text):
+    return glm.GenerateContentResponse(
+        candidates=[glm.Candidate(content=glm.Content(parts=[glm.Part(text=text)]))]
+    )
+
+
+class GeminiKeyPoolTests(LaptopTestCase):
+    def test_acquire_prefers_the_key_with_the_most_budget(self):
+        pool = GeminiKeyPool(["a", " b ", ""], requests_per_minute=2)
+        pool.buckets["a"].try_acquire()
+
+        acquired = [async_to_sync(pool.acquire)() for _ in range(3)]
+        self.assertEqual(acquired, ["b", "a", "b"])
+
+    def test_acquire_waits_for_a_refill(self):
+        pool = GeminiKeyPool(["a"], requests_per_minute=6000)
+        pool.buckets["a"].block(0.05)
+
+        self.assertEqual(async_to_sync(pool.acquire)(), "a")
+        with self.assertRaises(RuntimeError):
+            async_to_sync(GeminiKeyPool([], requests_per_minute=60).acquire)()
+
+    @mock.patch("laptops.gemini.glm.GenerativeServiceAsyncClient")
+    def test_generate_sends_the_key_and_instruction(self, client_class):
+        client = client_class.return_value
+        client.generate_content = mock.AsyncMock(return_value=gemini_answer("{}"))
+        pool = GeminiKeyPool(["a"], requests_per_minute=60)
+
+        response = async_to_sync(pool.generate)("HP 840", "Extract the specs")
+
+        self.assertEqual(response.text, "{}")
+        client_class.assert_called_once_with(client_options={"api_key": "a"})
+        request = client.generate_content.await_args.args[0]
+        self.assertEqual(request.model, "models/gemini-1.5-flash")
+        self.assertEqual(request.system_instruction.parts[0].text, "Extract the specs")
+        self.assertEqual(request.contents[0].parts[0].text, "HP 840")
+
+    @mock.patch("laptops.gemini.glm.GenerativeServiceAsyncClient")
+    def test_throttled_key_is_paused(self, client_class):
+        client_class.return_value.generate_content = mock.AsyncMock(
+            side_effect=ResourceExhausted("quota")
+        )
+        pool = GeminiKeyPool(["a"], requests_per_minute=60)
+
+        with self.assertLogs("laptops", "WARNING"), self.assertRaises(
+            ResourceExhausted
+        ):
+            async_to_sync(pool.generate)("HP 840", "Extract the specs")
+        self.assertGreater(pool.buckets["a"].try_acquire(), 59)
+
+
+@mock.patch("laptops.caption_cache.timezone.now")
+class CaptionCacheTests(LaptopTestCase):
+    start = timezone.make_aware(datetime(2026, 1, 1))
+
+    def at(self, now, minutes):
+        now.return_value = self.start + timedelta(minutes=minutes)
+
+    def test_reposts_hit_the_same_entry(self, now):
+        self.at(now, 0)
+        cache = CaptionCache(max_entries=10, ttl=timedelta(days=1))
+        cache.set_many({"HP 840 G5, 45k birr @shop_one": {"title": "HP 840 G5"}})
+
+        self.assertEqual(
+            cache.get_many({7: "hp 840 g5 45k BIRR 🔥 t.me/shop_two", 8: "Dell"}),
+            {7: {"title": "HP 840 G5"}},
+        )
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "hit_rate": 0.5})
+        self.assertEqual(CaptionCache("v2").get_many({7: "HP 840 G5, 45k birr"}), {})
+
+    def test_entries_expire_after_the_ttl(self, now):
+        self.at(now, 0)
+        cache = CaptionCache(max_entries=10, ttl=timedelta(hours=1))
+        cache.set_many({"HP": {"title": "HP"}})
+
+        self.at(now, 59)
+        self.assertEqual(cache.get_many({1: "HP"}), {1: {"title": "HP"}})
+        self.at(now, 61)
+        self.assertEqual(cache.get_many({1: "HP"}), {})
+        cache.set_many({"Dell": {"title": "Dell"}})
+        self.assertEqual(ParsedCaption.objects.count(), 1)
+
+    def test_least_recently_used_entries_are_evicted(self, now):
+        cache = CaptionCache(max_entries=2, ttl=timedelta(days=1))
+        for minutes, caption in enumerate(["HP", "Dell"]):
+            self.at(now, minutes)
+            cache.set_many({caption: {"title": caption}})
+        self.at(now, 2)
+        cache.get_many({1: "HP"})
+
+        self.at(now, 3)
+        cache.set_many({"Lenovo": {"title": "Lenovo"}})
+        self.assertEqual(
+            cache.get_many({1: "HP", 2: "Dell", 3: "Lenovo"}),
+            {1: {"title": "HP"}, 3: {"title": "Lenovo"}},
+        )
+
+
+class BatchParsingTests(LaptopTestCase):
+    @mock.patch("laptops.tasks.get_key_pool")
+    def test_missing_and_invalid_items_are_retried_one_by_one(self, get_key_pool):
+        async def generate(prompt, system_prompt):
+            if system_prompt == tasks.ai_batch_system_prompt:
+                return llm_answer(
+                    [
+                        {"message_id": 0, **laptop_data("HP")},
+                        {"message_id": 1, "title": 5},
+                        {"message_id": 9, **laptop_data("Unknown")},
+                        "noise",
+                    ]
+                )
+            return llm_answer(laptop_data(f"Retried {prompt}"))
+
+        generate = get_key_pool.return_value.generate = mock.AsyncMock(
+            side_effect=generate
+        )
+        results = async_to_sync(process_products_batch)(
+            {0: "hp", 1: "dell", 2: "lenovo", 3: ""}
+        )
+
+        self.assertEqual(
+            {key: (status, data["title"]) for key, (status, data) in results.items()},
+            {0: (True, "HP"), 1: (True, "Retried dell"), 2: (True, "Retried lenovo")},
+        )
+        self.assertEqual(generate.await_count, 3)
+
+    def test_same_message_id_in_two_channels_keeps_both_captions(self):
+        async def parse_batch(captions):
+            self.assertEqual(len(captions), 2)
+            return {key: (True, laptop_data(text)) for key, text in captions.items()}
+
+        batch = [
+            ScrapedMessage(
+                channel=chat,
+                message_id=7,
+                caption=caption,
+                channel_name=chat.title,
+                posted_at=timezone.now(),
+                chat_id=chat.channel_id,
+            )
+            for chat, caption in (
+                (make_chat(), "Dell Latitude 7490"),
+                (make_chat(2, "Other laptops"), "HP EliteBook 840"),
+            )
+        ]
+        pipeline = ScrapePipeline(None)
+        with mock.patch(
+            "laptops.pipeline.parse_caption", return_value=(0, {})
+        ), mock.patch("laptops.pipeline.process_products_batch", parse_batch):
+            async_to_sync(pipeline.parse_batch)(batch)
+
+        parsed = [pipeline.image_queue.get_nowait() for _ in batch]
+        self.assertEqual(
+            [(post.message.chat_id, post.data["title"]) for post in parsed],
+            [(1, "Dell Latitude 7490"), (2, "HP EliteBook 840")],
+        )
+
+
+class SimilarityEngineTests(LaptopTestCase):
+    columns = {
+        "title": ["HP EliteBook 840", "hp elitebook 850", "Dell XPS 13", "MacBook"],
+        "storage": ["256GB SSD", "256GB SSD", "1TB SSD", None],
+        "processor": ["Core i5", "Core i7", "Core i7", "Apple M1"],
+        "ram": ["8GB", "16GB", "16GB", "8GB"],
+    }
+    ids = [3, 5, 8, 13]
+
+    def engine(self):
+        return SimilarityEngine(self.ids, self.columns, workers=1)
+
+    def expected_score(self, a, b):
+        return sum(
+            weight
+            * fuzz.ratio(
+                (self.columns[name][a] or "").lower(),
+                (self.columns[name][b] or "").lower(),
+            )
+            / 100
+            for name, weight in WEIGHTS.items()
+        )
+
+    def test_scores_weigh_every_attribute(self):
+        scores = self.engine().score_rows([0, 2])
+
+        self.assertEqual(scores.shape, (2, 4))
+        for i, row in enumerate([0, 2]):
+            for column in range(4):
+                self.assertAlmostEqual(
+                    float(scores[i, column]),
+                    self.expected_score(row, column),
+                    # The engine rounds ratios to whole percents
+                    delta=0.01,
+                )
+
+    def test_top_k_ranks_other_posts_best_first(self):
+        neighbours = dict(self.engine().top_k(2))
+
+        self.assertEqual(list(neighbours), self.ids)
+        self.assertEqual([item_id for item_id, _ in neighbours[3]], [5, 8])
+        for item_id, item_neighbours in neighbours.items():
+            scores = [score for _, score in item_neighbours]
+            self.assertNotIn(item_id, [neighbour for neighbour, _ in item_neighbours])
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_top_k_does_not_depend_on_the_chunk_size(self):
+        engine = self.engine()
+
+        self.assertEqual(
+            list(engine.top_k(3, chunk_size=1)), list(engine.top_k(3, chunk_size=512))
+        )
+        self.assertEqual(list(engine.top_k(3, rows=[2])), list(engine.top_k(3))[2:3])
+
+    def test_low_scores_are_left_out(self):
+        neighbours = dict(self.engine().top_k(3, min_score=0.99))
+
+        self.assertEqual(neighbours, {item_id: [] for item_id in self.ids})
+
+
+class SimilarityComputeTests(LaptopTestCase):
+    specs = [
+        ("HP EliteBook 840", "8GB", "256GB SSD", "Core i5 8th gen"),
+        ("HP EliteBook 850", "16GB", "512GB SSD", "Core i7 8th gen"),
+        ("Dell Latitude 7490", "8GB", "256GB SSD", "Core i5 8th gen"),
+        ("Dell XPS 13", "16GB", "1TB SSD", "Core i7 11th gen"),
+        ("Lenovo ThinkPad T480", "8GB", "500GB HDD", "Core i5 7th gen"),
+        ("MacBook Air M1", "8GB", "256GB SSD", "Apple M1"),
+    ]
+
+    def setUp(self):
+        self.chat = make_chat()
+        self.posts = [self.create_post(i, *spec) for i, spec in enumerate(self.specs)]
+
+    def create_post(self, post_id, title, ram, storage, processor):
+        return LaptopPost.objects.create(
+            title=title,
+            ram=ram,
+            storage=storage,
+            processor=processor,
+            post_id=post_id,
+            channel_name="Laptops",
+            channel_id=self.chat,
+            posted_at=timezone.now(),
+        )
+
+    def compute(self, *args):
+        call_command(
+            "simmilarity_compute", "--min-score", "0", *args, stdout=io.StringIO()
+        )
+        lists = {}
+        for item_id, neighbour_id, score in SimilarNeighbour.objects.values_list(
+            "item_id", "neighbour_id", "score"
+        ):
+            lists.setdefault(item_id, []).append((neighbour_id, round(score, 4)))
+        return lists
+
+    def test_incremental_run_matches_a_full_run(self):
+        self.compute()
+        self.posts[0].processor = "Core i7 11th gen"
+        self.posts[0].save()
+        self.create_post(len(self.specs), "Dell XPS 15", "16GB", "1TB SSD", "Core i7")
+
+        incremental = self.compute("--incremental")
+        self.assertEqual(len(incremental), len(self.specs) + 1)
+        self.assertEqual(incremental, self.compute())
+
+    def test_many_changes_recompute_every_post(self):
+        self.compute()
+        for post in self.posts[:2]:
+            post.save()
+
+        with mock.patch(
+            "laptops.management.commands.simmilarity_compute."
+            "Command.incremental_neighbours"
+        ) as incremental_neighbours:
+            lists = self.compute("--incremental", "--max-changed", "1")
+
+        incremental_neighbours.assert_not_called()
+        self.assertEqual(len(lists), len(self.specs))
+
+    def test_posts_created_while_computing_wait_for_the_next_run(self):
+        self.compute()
+        build = SimilarityEngine.from_queryset
+
+        def build_then_post(queryset, **kwargs):
+            engine = build(queryset, **kwargs)
+            self.create_post(len(self.specs), "Dell XPS 15", "16GB", "1TB SSD", "i7")
+            return engine
+
+        with mock.patch(
+            "laptops.management.commands.simmilarity_compute."
+            "SimilarityEngine.from_queryset",
+            build_then_post,
+        ):
+            self.assertEqual(len(self.compute("--incremental")), len(self.specs))
+        self.assertEqual(len(self.compute("--incremental")), len(self.specs) + 1)
+
+    def test_lists_keep_the_top_k_neighbours(self):
+        lists = self.compute("--top-k", "2")
+
+        self.assertEqual(len(lists), len(self.specs))
+        self.assertTrue(all(len(neighbours) == 2 for neighbours in lists.values()))
+
+    def test_saving_a_shorter_list_drops_the_ranks_past_its_end(self):
+        first, second, third = (post.id for post in self.posts[:3])
+        SimilarityCommand().save_neighbours(
+            {first: [(second, 0.9), (third, 0.8)], second: [(first, 0.9)]}
+        )
+        SimilarityCommand().save_neighbours({first: [(third, 0.95)]})
+
+        self.assertEqual(
+            list(
+                SimilarNeighbour.objects.order_by("item_id", "rank").values_list(
+                    "item_id", "rank", "neighbour_id", "score"
+                )
+            ),
+            [(first, 0, third, 0.95), (second, 0, first, 0.9)],
+        )
+
+    def test_posts_missing_from_the_engine_are_skipped(self):
+        engine = SimilarityEngine.from_queryset(LaptopPost.objects.all())
+        ids = [post.id for post in self.posts]
+
+        self.assertEqual(
+            engine.positions([ids[3], ids[1], ids[-1] + 1, 0]).tolist(), [1, 3]
+        )
+
+
+class VectorIndexTests(LaptopTestCase):
+    specs = [
+        ("HP EliteBook 840 G5", "8GB", "256GB SSD", "Core i5-8350U", "45,000 birr"),
+        ("HP EliteBook 840 G6", "8GB", "256GB SSD", "Core i5-8365U", "47,000 birr"),
+        ("Dell XPS 15", "32GB", "1TB SSD", "Core i9-11900H", "1,500$"),
+        ("Lenovo IdeaPad 3", "4GB", "1TB HDD", "Celeron N4020", "18,000 birr"),
+    ]
+
+    def setUp(self):
+        chat = make_chat()
+        self.ids = [
+            LaptopPost.objects.create(
+                title=title,
+                ram=ram,
+                storage=storage,
+                processor=processor,
+                price=price,
+                post_id=i,
+                channel_name="Laptops",
+                channel_id=chat,
+                posted_at=timezone.now(),
+            ).id
+            for i, (title, ram, storage, processor, price) in enumerate(self.specs)
+        ]
+
+    def test_search_ranks_the_closest_post_first(self):
+        index = build_index(LaptopPost.objects.all())
+        results = index.search(self.ids[0], k=3)
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0], self.ids[1])
+        self.assertNotIn(self.ids[0], [item_id for item_id, _ in results])
+        self.assertGreater(results[0][1], 0.9)
+        self.assertEqual(index.search(max(self.ids) + 1), [])
+
+    def test_hashed_search_finds_near_duplicates(self):
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((500, 16)).astype(np.float32)
+        vectors[1::2] = vectors[::2] + 0.01 * rng.standard_normal((250, 16))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = VectorIndex(np.arange(500), vectors, brute_force_limit=0)
+
+        self.assertFalse(index.brute_force)
+        for item_id in range(0, 500, 50):
+            self.assertEqual(index.search(item_id, k=1)[0][0], item_id + 1)
+
+    def test_a_saved_index_is_picked_up_by_readers(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            SIMILARITY_INDEX_DIR=directory
+        ):
+            self.assertIsNone(get_vector_index())
+            build_index(LaptopPost.objects.all()).save(directory)
+            self.assertEqual(get_vector_index().ids.tolist(), self.ids)
+
+            LaptopPost.objects.filter(id=self.ids[-1]).delete()
+            build_index(LaptopPost.objects.all()).save(directory)
+            self.assertEqual(get_vector_index().ids.tolist(), self.ids[:-1])
+
+    def test_an_index_out_of_reach_is_not_served(self):
+        self.addCleanup(cache.clear)
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            SIMILARITY_INDEX_DIR=directory
+        ):
+            build_index(LaptopPost.objects.all()).save(directory)
+            # Built by a worker on another host, in a folder of its own
+            with mock.patch("socket.gethostname", return_value="worker-1"):
+                record_build("index-1")
+            with self.assertLogs("laptops", "ERROR"):
+                self.assertIsNone(get_vector_index())
+            with self.assertNoLogs("laptops", "ERROR"):
+                self.assertIsNone(get_vector_index())
+
+            record_build(build_index(LaptopPost.objects.all()).save(directory))
+            self.assertEqual(get_vector_index().ids.tolist(), self.ids)
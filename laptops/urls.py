@@ -4,6 +4,7 @@ from .views import (
     ReviewList,
     ChatsResourceView,
     ChatPosts,
+    AutocompleteView,
 )
 from rest_framework.routers import DefaultRouter
 from django.urls import path
@@ -20,6 +21,7 @@ urlpatterns = [
         name="review-get-update-delete",
     ),
     path("chat/<str:channel_id>", ChatPosts.as_view(), name="chat-posts"),
+    path("autocomplete", AutocompleteView.as_view(), name="autocomplete"),
 ]
 
 urlpatterns += router.urls
@@ -0,0 +1,315 @@
+import logging
+import math
+import os
+import shutil
+import socket
+import threading
+import time
+import warnings
+import zlib
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .spec_parser import (
+    cpu_specs,
+    gpu_class,
+    price_amount,
+    ram_gb,
+    screen_inches,
+    storage_specs,
+)
+
+logger = logging.getLogger("laptops")
+
+# Rough conversion so USD and Birr prices land on the same scale
+USD_TO_ETB = 125
+
+NUMERIC_FEATURES = (
+    "ram_gb",
+    "storage_gb",
+    "ssd",
+    "cpu_tier",
+    "cpu_generation",
+    "gpu_class",
+    "screen_inches",
+    "price",
+)
+# Features compared on a log scale, so 8 vs 16GB weighs like 16 vs 32GB
+LOG_FEATURES = {"ram_gb", "storage_gb", "price"}
+
+TITLE_DIMS = 128
+# Share of the vector norm given to the title n-grams vs the numeric specs
+TITLE_WEIGHT = 0.5
+
+# Version and host of the latest build, in the cache shared with the worker
+BUILD_KEY = "laptops:similarity-index"
+
+
+def numeric_features(post):
+    """
+    Numeric spec features of a post, ``nan`` where a value is unknown.
+
+    :param post: Mapping with the ``LaptopPost`` text fields.
+    """
+    storage, storage_kind = storage_specs(post.get("storage"))
+    _, cpu_tier, cpu_generation = cpu_specs(post.get("processor"))
+    price, currency = price_amount(post.get("price"))
+    if price is not None and currency == "USD":
+        price *= USD_TO_ETB
+
+    values = {
+        "ram_gb": ram_gb(post.get("ram")),
+        "storage_gb": storage,
+        "ssd": None if storage_kind is None else float(storage_kind == "SSD"),
+        "cpu_tier": cpu_tier,
+        "cpu_generation": cpu_generation,
+        "gpu_class": gpu_class(post.get("graphics")) or None,
+        "screen_inches": screen_inches(post.get("display")),
+        "price": price,
+    }
+    return [
+        math.nan if values[name] is None else float(values[name])
+        for name in NUMERIC_FEATURES
+    ]
+
+
+def title_vectors(titles, dims=TITLE_DIMS):
+    """
+    TF-IDF of hashed character trigrams, one L2-normalized row per title.
+    """
+    counts = np.zeros((len(titles), dims), dtype=np.float32)
+    for row, title in enumerate(titles):
+        text = f" {' '.join((title or '').lower().split())} "
+        for i in range(len(text) - 2):
+            counts[row, zlib.crc32(text[i : i + 3].encode("utf-8")) % dims] += 1
+
+    document_frequency = (counts > 0).sum(axis=0)
+    idf = np.log((1 + len(titles)) / (1 + document_frequency)) + 1
+    vectors = np.where(counts > 0, 1 + np.log(np.maximum(counts, 1)), 0) * idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def build_vectors(posts):
+    """
+    :param posts: List of mappings with the ``LaptopPost`` text fields.
+    :return: float32 matrix of unit vectors, cosine similarity is a dot product.
+    """
+    numeric = np.array([numeric_features(post) for post in posts], dtype=np.float64)
+    numeric = numeric.reshape(len(posts), len(NUMERIC_FEATURES))
+    for i, name in enumerate(NUMERIC_FEATURES):
+        if name in LOG_FEATURES:
+            numeric[:, i] = np.log1p(numeric[:, i])
+
+    # Standardize, unknown values sit at the mean
+    with warnings.catch_warnings():
+        # Columns with no known value at all are expected
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(numeric, axis=0) if len(posts) else 0
+        std = np.nanstd(numeric, axis=0) if len(posts) else 1
+    numeric = np.nan_to_num((numeric - mean) / np.where(std > 0, std, 1))
+    numeric /= np.maximum(np.linalg.norm(numeric, axis=1, keepdims=True), 1e-12)
+
+    titles = title_vectors([post.get("title") for post in posts])
+    vectors = np.hstack(
+        [
+            math.sqrt(1 - TITLE_WEIGHT) * numeric.astype(np.float32),
+            math.sqrt(TITLE_WEIGHT) * titles,
+        ]
+    )
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class VectorIndex:
+    """
+    In-process nearest-neighbour index over post feature vectors.
+
+    Small catalogs are searched exactly with one matrix-vector product.
+    Larger ones use multi-probe random-hyperplane LSH: ``n_tables`` hash
+    tables of ``n_bits`` each propose candidates, which are then ranked
+    exactly.
+    """
+
+    def __init__(
+        self,
+        ids,
+        vectors,
+        n_tables=10,
+        n_bits=12,
+        n_probes=8,
+        brute_force_limit=10000,
+        seed=0,
+    ):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = vectors
+        self.positions = {int(item_id): row for row, item_id in enumerate(self.ids)}
+        self.brute_force = len(self.ids) <= brute_force_limit
+        self.n_probes = n_probes
+
+        self.tables = []
+        if not self.brute_force:
+            rng = np.random.default_rng(seed)
+            powers = 1 << np.arange(n_bits, dtype=np.int64)
+            self.planes = rng.standard_normal(
+                (n_tables, vectors.shape[1], n_bits)
+            ).astype(np.float32)
+            self.powers = powers
+            for planes in self.planes:
+                codes = ((np.asarray(vectors) @ planes) > 0).astype(np.int64) @ powers
+                order = np.argsort(codes, kind="stable")
+                bucket_codes, starts = np.unique(codes[order], return_index=True)
+                ends = np.append(starts[1:], len(order))
+                self.tables.append(
+                    {
+                        int(code): order[start:end]
+                        for code, start, end in zip(bucket_codes, starts, ends)
+                    }
+                )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, item_id):
+        return item_id in self.positions
+
+    def candidates(self, query):
+        """
+        Rows sharing a bucket with ``query`` in any table. Each table is
+        also probed with the ``n_probes`` least certain bits flipped
+        (multi-probe LSH), which raises recall without more tables.
+        """
+        buckets = []
+        for planes, table in zip(self.planes, self.tables):
+            projection = query @ planes
+            code = int((projection > 0).astype(np.int64) @ self.powers)
+            probes = [code] + [
+                code ^ int(self.powers[bit])
+                for bit in np.argsort(np.abs(projection))[: self.n_probes]
+            ]
+            buckets.extend(table[probe] for probe in probes if probe in table)
+        return np.unique(np.concatenate(buckets)) if buckets else np.array([], int)
+
+    def search(self, item_id, k=10):
+        """
+        :return: Up to ``k`` ``(neighbour_id, score)`` pairs, best first.
+        """
+        row = self.positions.get(item_id)
+        if row is None:
+            return []
+        query = np.asarray(self.vectors[row])
+
+        rows = None if self.brute_force else self.candidates(query)
+        if rows is not None and len(rows) <= k:
+            rows = None  # too few candidates, fall back to an exact scan
+
+        scores = (
+            np.asarray(self.vectors) @ query
+            if rows is None
+            else np.asarray(self.vectors[rows]) @ query
+        )
+        rows = np.arange(len(self.ids)) if rows is None else rows
+        scores[rows == row] = -np.inf
+
+        k = min(k, len(rows) - 1)
+        if k <= 0:
+            return []
+        best = np.argpartition(scores, -k)[-k:]
+        best = best[np.argsort(-scores[best])]
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in best]
+
+    def save(self, directory):
+        """
+        Write the index to a new versioned folder inside ``directory`` and
+        point ``CURRENT`` at it, so readers never see a half-written index.
+        """
+        directory = Path(directory)
+        version = directory / f"index-{time.time_ns()}"
+        version.mkdir(parents=True)
+        np.save(version / "ids.npy", self.ids)
+        np.save(version / "vectors.npy", np.asarray(self.vectors))
+
+        pointer = directory / "CURRENT.tmp"
+        pointer.write_text(version.name)
+        os.replace(pointer, directory / "CURRENT")
+
+        # Keep the previous version around for processes still reading it
+        versions = sorted(directory.glob("index-*"))
+        for old in versions[:-2]:
+            shutil.rmtree(old, ignore_errors=True)
+        return version.name
+
+    @classmethod
+    def load(cls, directory, **kwargs):
+        directory = Path(directory)
+        try:
+            version = directory / (directory / "CURRENT").read_text().strip()
+        except FileNotFoundError:
+            return None
+        ids = np.load(version / "ids.npy")
+        vectors = np.load(version / "vectors.npy", mmap_mode="r")
+        return cls(ids, vectors, **kwargs)
+
+
+def build_index(queryset):
+    rows = list(
+        queryset.order_by("id").values(
+            "id", "title", "storage", "processor", "graphics", "display", "ram", "price"
+        )
+    )
+    return VectorIndex([row["id"] for row in rows], build_vectors(rows))
+
+
+def record_build(version):
+    """Tell the web processes, wherever they run, which index is current."""
+    cache.set(BUILD_KEY, {"version": version, "host": socket.gethostname()}, None)
+
+
+_index = None
+_index_version = None
+_unreachable_version = None
+_index_lock = threading.Lock()
+
+
+def get_vector_index():
+    """
+    The process-wide index, reloaded when a newer build has been saved.
+    ``None`` when the latest build was saved on another host and is not in
+    ``SIMILARITY_INDEX_DIR``: an older index would serve stale neighbours.
+    """
+    global _index, _index_version, _unreachable_version
+    try:
+        version = (Path(settings.SIMILARITY_INDEX_DIR) / "CURRENT").read_text()
+    except FileNotFoundError:
+        version = None
+
+    build = cache.get(BUILD_KEY)
+    if (
+        build is not None
+        and build["version"] != version
+        and build["host"] != socket.gethostname()
+    ):
+        if build["version"] != _unreachable_version:
+            _unreachable_version = build["version"]
+            logger.error(
+                f"Similarity index {build['version']} was built on "
+                f"{build['host']} and is not in SIMILARITY_INDEX_DIR, serving "
+                "similar laptops from SimilarNeighbour. Point "
+                "SIMILARITY_INDEX_DIR at a folder shared with the scraper "
+                "worker, or set SIMILARITY_BACKEND=table."
+            )
+        return None
+    if version is None:
+        return None
+
+    with _index_lock:
+        if version != _index_version:
+            try:
+                _index = VectorIndex.load(settings.SIMILARITY_INDEX_DIR)
+                _index_version = version
+            except Exception as e:
+                logger.error(f"Error loading similarity index: {str(e)}")
+        return _index
@@ -1,18 +1,33 @@
 from rest_framework.viewsets import ReadOnlyModelViewSet
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.core.cache import cache
 from .models import LaptopPost, Review, TelegramChat
 from .serializers import LaptopPostSerializer, ReviewSerializer, ChatSerializer
-from rest_framework.pagination import PageNumberPagination
+from .pagination import ChatPagination, PostPagination, ReviewPagination
+from .response_cache import CachedResponseMixin
+from .listing_cards import ListingCardMixin
 from rest_framework.generics import ListAPIView, RetrieveUpdateDestroyAPIView
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
-from django.db.models import Q
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .search import get_search_backend
+from .filters import apply_spec_filters, filter_params
+from .facets import compute_facets, facets_cache_key
+from .autocomplete import FIELDS as AUTOCOMPLETE_FIELDS, get_autocomplete_index
 
 
-class LaptopResourceView(ReadOnlyModelViewSet):
+class LaptopResourceView(
+    CachedResponseMixin, ListingCardMixin, ReadOnlyModelViewSet
+):
     queryset = LaptopPost.objects.all()
     serializer_class = LaptopPostSerializer
     permission_classes = []
     authentication_classes = []
-    pagination_class = PageNumberPagination
+    pagination_class = PostPagination
+    # `sort` parameter -> ordering, newest first by default
+    orderings = {"rating": ("-rating_average", "-posted_at")}
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -21,61 +36,91 @@ class LaptopResourceView(ReadOnlyModelViewSet):
         return context
 
     def get_queryset(self):
-        query = self.request.query_params.get("q", "")
-        retrieve_null_price = self.request.query_params.get("null_price", False)
-        tokens = query.split()
-
-        query_types = self.request.query_params.get("type", "").split(",")
-        query_filter_types = {
-            "storage": Q(storage__icontains=query),
-            "processor": Q(processor__icontains=query),
-            "graphics": Q(graphics__icontains=query),
-            "display": Q(display__icontains=query),
-            "ram": Q(ram__icontains=query),
-            "battrey": Q(battrey__icontains=query),
-            "status": Q(status__icontains=query),
-            "color": Q(color__icontains=query),
-            "description": Q(description__icontains=query),
+        queryset = self.sort(self.search(super().get_queryset()))
+        # Load reviews, images and neighbours up front instead of per post
+        return (
+            queryset.for_detail()
+            if self.action == "retrieve"
+            else queryset.for_listing()
+        )
+
+    def get_listing_queryset(self):
+        return self.sort(self.search(LaptopPost.objects.all()))
+
+    def sort(self, queryset):
+        sort = self.request.query_params.get("sort", "")
+        if not sort:
+            return queryset
+        if sort not in self.orderings:
+            raise ValidationError(
+                {"sort": f"Must be one of {', '.join(self.orderings)}"}
+            )
+        return queryset.order_by(*self.orderings[sort])
+
+    def search_params(self):
+        params = self.request.query_params
+        return {
+            "query": params.get("q", ""),
+            "types": params.get("type", "").split(","),
+            "null_price": params.get("null_price", "").lower() in ("1", "true"),
         }
 
-        # query_filter = Q(title__icontains=query) | Q(description__icontains=query)
-        query_filter = Q()
-        for token in tokens:
-            query_filter &= Q(title__icontains=token) | Q(description__icontains=token)
-        if query_types:
-            for query_type in query_types:
-                if query_type in query_filter_types:
-                    query_filter |= query_filter_types.get(query_type)
+    def search(self, queryset):
+        """
+        Apply the search query and filters of the request to ``queryset``.
+        """
+        search_params = self.search_params()
+        queryset = apply_spec_filters(
+            queryset.filter(price__isnull=search_params["null_price"]),
+            self.request.query_params,
+        )
 
+        # Full-text backends index every spec column, so `type` only
+        # widens the legacy substring search
         return (
-            super()
-            .get_queryset()
-            .filter(query_filter, price__isnull=retrieve_null_price)
-            if query
-            else super().get_queryset().filter(price__isnull=retrieve_null_price)
+            get_search_backend().search(
+                queryset, search_params["query"], search_params["types"]
+            )
+            if search_params["query"]
+            else queryset
         )
 
+    @action(detail=False)
+    def facets(self, request):
+        """
+        Counts per spec bucket of the posts matching the current search and
+        filters, cached per normalized search.
+        """
+        key = facets_cache_key(
+            filter_params(request.query_params), **self.search_params()
+        )
+        facets = cache.get(key)
+        if facets is None:
+            facets = compute_facets(self.search(LaptopPost.objects.all()))
+            cache.set(key, facets, settings.FACETS_CACHE_SECONDS)
+        return Response(facets)
+
 
 class ReviewList(ListAPIView):
-    queryset = Review.objects.all()
-    pagination_class = PageNumberPagination
+    queryset = Review.objects.select_related("user")
+    pagination_class = ReviewPagination
     serializer_class = ReviewSerializer
 
 
 class ReviewRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
-    queryset = Review.objects.all()
-    pagination_class = PageNumberPagination
+    queryset = Review.objects.select_related("user")
+    pagination_class = ReviewPagination
     serializer_class = ReviewSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     lookup_url_kwarg = "id"
 
 
-class ChatsResourceView(ReadOnlyModelViewSet):
+class ChatsResourceView(CachedResponseMixin, ReadOnlyModelViewSet):
     queryset = TelegramChat.objects.all()
     serializer_class = ChatSerializer
     permission_classes = []
     authentication_classes = []
-    pagination_class = PageNumberPagination
+    pagination_class = ChatPagination
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -84,12 +129,48 @@ class ChatsResourceView(ReadOnlyModelViewSet):
         return context
 
 
-class ChatPosts(ListAPIView):
-    queryset = LaptopPost.objects.all()
+class ChatPosts(CachedResponseMixin, ListingCardMixin, ListAPIView):
+    queryset = LaptopPost.objects.for_listing()
     serializer_class = LaptopPostSerializer
-    pagination_class = PageNumberPagination
+    pagination_class = PostPagination
     permission_classes = []
     authentication_classes = []
 
     def get_queryset(self):
         return super().get_queryset().filter(channel_id=self.kwargs.get("channel_id"))
+
+    def get_listing_queryset(self):
+        return LaptopPost.objects.filter(channel_id=self.kwargs.get("channel_id"))
+
+
+class AutocompleteView(APIView):
+    """
+    Prefix suggestions for titles and specs, answered from memory.
+    """
+
+    permission_classes = []
+    authentication_classes = []
+    max_limit = 25
+
+    def get(self, request):
+        query = request.query_params.get("q", "")
+        field = request.query_params.get("field") or None
+        if field is not None and field not in AUTOCOMPLETE_FIELDS:
+            return Response(
+                {"detail": f"field must be one of {', '.join(AUTOCOMPLETE_FIELDS)}"},
+                status=400,
+            )
+        try:
+            limit = min(int(request.query_params.get("limit", 10)), self.max_limit)
+        except ValueError:
+            return Response({"detail": "limit must be an integer"}, status=400)
+
+        suggestions = get_autocomplete_index().complete(query, field, limit)
+        return Response(
+            {
+                "results": [
+                    {"field": field, "value": value, "count": count}
+                    for field, value, count in suggestions
+                ]
+            }
+        )